@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+"""
+Benchmark of BaseHandler.allow_build with the compiled allowlist/blocklist
+rules.
+
+The script calls allow_build() for many images of a single advisory, as when
+planning the rebuild of a large advisory, and prints the time it took.
+
+Example usage:
+    - Evaluate the rules for 20000 images:
+        FRESHMAKER_DEVELOPER_ENV=1 ./allow_build.py
+    - Evaluate the rules for 100000 images, 5 times:
+        FRESHMAKER_DEVELOPER_ENV=1 ./allow_build.py --images 100000 --repeat 5
+"""
+
+import argparse
+import time
+
+from freshmaker import conf
+from freshmaker.config import all_, any_
+from freshmaker.handlers import ContainerBuildHandler
+from freshmaker.types import ArtifactType
+
+
+class BenchmarkHandler(ContainerBuildHandler):
+    name = "BenchmarkHandler"
+
+    def can_handle(self, event):
+        return False
+
+    def handle(self, event):
+        return []
+
+
+def measure(handler, images, repeat):
+    durations = []
+    for _ in range(repeat):
+        # Start with the rules not compiled yet.
+        BenchmarkHandler.invalidate_build_rules()
+        start = time.monotonic()
+        allowed = [
+            handler.allow_build(
+                ArtifactType.IMAGE, advisory_name="RHSA-2017:1000",
+                has_hightouch_bugs=False, severity="important",
+                image_name=image_name)
+            for image_name in images]
+        durations.append(time.monotonic() - start)
+    print("%-30s best %.3fs, average %.3fs" % (
+        "allow_build", min(durations), sum(durations) / len(durations)))
+    return allowed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=20000,
+                        help="Number of images to evaluate the rules for.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times the evaluation is measured.")
+    args = parser.parse_args()
+
+    conf.handler_build_allowlist = {
+        "BenchmarkHandler": {
+            "image": all_(
+                {"advisory_name": r"RHSA-\d+:\d+"},
+                any_(
+                    {"has_hightouch_bugs": True},
+                    {"severity": ["critical", "important"]}
+                ),
+            )
+        }
+    }
+    conf.handler_build_blocklist = {
+        "BenchmarkHandler": {
+            "image": {"image_name": ["foo-1$", "bar-.*"]},
+        }
+    }
+
+    images = ["foo-%d" % (i % 1000) for i in range(args.images)]
+    print("Evaluating the rules for %d images (%d unique)" % (
+        len(images), len(set(images))))
+    allowed = measure(BenchmarkHandler(), images, args.repeat)
+    print("%d images not allowed" % allowed.count(False))
+
+
+if __name__ == "__main__":
+    main()
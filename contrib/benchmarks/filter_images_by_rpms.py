@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark of the RPM based image filters in freshmaker.lightblue.
+
+It compares LightBlue._filter_out_images_by_rpms, which runs
+filter_out_images_with_higher_rpm_nvr and filter_out_modularity_mismatch in
+a single indexed pass, with the previous implementation looping over all
+the RPMs of every image and parsing the NVRs with kobo.rpmlib again and
+again. Both implementations must keep the same images.
+
+Example usage:
+    - Filter 5000 images with 800 RPMs each:
+        FRESHMAKER_DEVELOPER_ENV=1 ./filter_images_by_rpms.py
+    - Filter 1000 images with 300 RPMs each, 5 times:
+        FRESHMAKER_DEVELOPER_ENV=1 ./filter_images_by_rpms.py --images 1000 --rpms 300 --repeat 5
+"""
+
+import argparse
+import random
+import time
+
+import kobo.rpmlib
+
+from freshmaker.lightblue import ContainerImage, LightBlue, RpmSymbols
+from freshmaker.utils import is_pkg_modular, parse_nvr, parse_nvra
+
+
+def generate_images(count, rpm_count, seed):
+    rand = random.Random(seed)
+    names = ["package-%d" % i for i in range(rpm_count * 2)]
+    symbols = RpmSymbols()
+    images = []
+    for i in range(count):
+        rpms = []
+        for name in rand.sample(names, rpm_count):
+            release = "%d.el8" % rand.randint(1, 10)
+            if rand.random() < 0.1:
+                release += "+module+el8.2.0+%d" % rand.randint(1000, 9999)
+            nvra = "%s-%d.%d-%s.x86_64" % (
+                name, rand.randint(1, 3), rand.randint(0, 9), release)
+            rpms.append({"name": name, "nvra": nvra, "srpm_name": name,
+                         "srpm_nevra": nvra.replace(".x86_64", ".src")})
+        images.append(ContainerImage.create({
+            "brew": {"build": "image-%d-1-1" % i},
+            "rpm_manifest": [{"rpms": rpms}],
+        }, symbols))
+    rpm_name_to_nvrs = {
+        name: ["%s-2.5-5.el8" % name] for name in rand.sample(names, 5)}
+    return images, rpm_name_to_nvrs
+
+
+def filter_by_kobo(images, rpm_name_to_nvrs):
+    ret = []
+    for image in images:
+        rpms = image.get_rpms()
+        if rpms is None:
+            ret.append(image)
+            continue
+        has_older_rpm = False
+        modularity_matches = False
+        for rpm in rpms:
+            for rpm_nvr in rpm_name_to_nvrs.get(rpm.get("name"), []):
+                if kobo.rpmlib.compare_nvr(
+                        kobo.rpmlib.parse_nvra(rpm["nvra"]),
+                        kobo.rpmlib.parse_nvr(rpm_nvr), ignore_epoch=True) == -1:
+                    has_older_rpm = True
+                if is_pkg_modular(rpm_nvr) == is_pkg_modular(rpm["nvra"]):
+                    modularity_matches = True
+        if has_older_rpm and modularity_matches:
+            ret.append(image)
+    return ret
+
+
+def measure(name, filter_images, images, rpm_name_to_nvrs, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.monotonic()
+        ret = filter_images(images, rpm_name_to_nvrs)
+        durations.append(time.monotonic() - start)
+    print("%-30s best %.3fs, average %.3fs, %d images kept" % (
+        name, min(durations), sum(durations) / len(durations), len(ret)))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--images", type=int, default=5000,
+                        help="Number of images to filter.")
+    parser.add_argument("--rpms", type=int, default=800,
+                        help="Number of RPMs in each image.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times each filter is measured.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the generated images.")
+    args = parser.parse_args()
+
+    images, rpm_name_to_nvrs = generate_images(args.images, args.rpms, args.seed)
+    print("Filtering %d images with %d RPMs each" % (args.images, args.rpms))
+
+    lb = LightBlue("lb.example.com", "/dev/null", "/dev/null")
+    expected = measure("kobo parse/compare_nvr", filter_by_kobo,
+                       images, rpm_name_to_nvrs, args.repeat)
+
+    def filter_cold(images, rpm_name_to_nvrs):
+        parse_nvr.cache_clear()
+        parse_nvra.cache_clear()
+        return lb._filter_out_images_by_rpms(images, rpm_name_to_nvrs)
+
+    ret = measure("indexed filter", filter_cold, images, rpm_name_to_nvrs,
+                  args.repeat)
+    assert ret == expected, "indexed filter kept different images"
+
+
+if __name__ == "__main__":
+    main()
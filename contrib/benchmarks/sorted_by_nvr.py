@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+Benchmark of freshmaker.utils.sorted_by_nvr compared to the previous
+implementation sorting by kobo.rpmlib.compare_nvr with functools.cmp_to_key.
+
+The script generates NVRs of container images with realistic versions and
+releases, checks that both implementations return the same order and prints
+the time each of them took.
+
+Example usage:
+    - Sort 100000 NVRs:
+        FRESHMAKER_DEVELOPER_ENV=1 ./sorted_by_nvr.py
+    - Sort 20000 NVRs, 5 times:
+        FRESHMAKER_DEVELOPER_ENV=1 ./sorted_by_nvr.py --nvrs 20000 --repeat 5
+"""
+
+import argparse
+import functools
+import random
+import time
+
+import kobo.rpmlib
+
+from freshmaker.utils import parse_nvr, sorted_by_nvr
+
+
+def generate_nvrs(count, seed):
+    rand = random.Random(seed)
+    names = ["image-%d-container" % i for i in range(max(1, count // 50))]
+    nvrs = []
+    for _ in range(count):
+        version = "%d.%d" % (rand.randint(1, 9), rand.randint(0, 20))
+        if rand.random() < 0.05:
+            version += "~rc%d" % rand.randint(1, 3)
+        release = "%d" % rand.randint(1, 300)
+        if rand.random() < 0.3:
+            release += ".%d" % rand.randint(1572631468, 1672631468)
+        nvrs.append("%s-%s-%s" % (rand.choice(names), version, release))
+    return nvrs
+
+
+def sorted_by_compare_nvr(lst, reverse=False):
+    def _compare_items(nvr1, nvr2):
+        nvr1_dict = kobo.rpmlib.parse_nvr(nvr1)
+        nvr2_dict = kobo.rpmlib.parse_nvr(nvr2)
+        if nvr1_dict["name"] != nvr2_dict["name"]:
+            return (nvr1_dict["name"] > nvr2_dict["name"]) - (nvr1_dict["name"] < nvr2_dict["name"])
+        return kobo.rpmlib.compare_nvr(nvr1_dict, nvr2_dict)
+
+    return sorted(lst, key=functools.cmp_to_key(_compare_items), reverse=reverse)
+
+
+def measure(name, sort, nvrs, repeat):
+    durations = []
+    for _ in range(repeat):
+        start = time.monotonic()
+        ret = sort(nvrs)
+        durations.append(time.monotonic() - start)
+    print("%-30s best %.3fs, average %.3fs" % (
+        name, min(durations), sum(durations) / len(durations)))
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument("--nvrs", type=int, default=100000,
+                        help="Number of NVRs to sort.")
+    parser.add_argument("--repeat", type=int, default=3,
+                        help="Number of times each sorting is measured.")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the generated NVRs.")
+    args = parser.parse_args()
+
+    nvrs = generate_nvrs(args.nvrs, args.seed)
+    print("Sorting %d NVRs (%d unique)" % (len(nvrs), len(set(nvrs))))
+
+    expected = measure("kobo compare_nvr", sorted_by_compare_nvr, nvrs, args.repeat)
+
+    def sort_cold(nvrs):
+        parse_nvr.cache_clear()
+        return sorted_by_nvr(nvrs)
+
+    ret = measure("sorted_by_nvr (cold cache)", sort_cold, nvrs, args.repeat)
+    assert ret == expected, "sorted_by_nvr returned different order"
+    ret = measure("sorted_by_nvr (warm cache)", sorted_by_nvr, nvrs, args.repeat)
+    assert ret == expected, "sorted_by_nvr returned different order"
+
+
+if __name__ == "__main__":
+    main()
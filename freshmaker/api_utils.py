@@ -20,18 +20,72 @@
 # SOFTWARE.
 
 import copy
-from flask import request, url_for, jsonify
-
-from freshmaker import db
+import hashlib
+import threading
+from collections import OrderedDict, namedtuple
+from flask import request, url_for, jsonify, json, Response
+from flask_sqlalchemy import Pagination
+from sqlalchemy import func
+
+from freshmaker import conf, db
 from freshmaker.errors import ValidationError
 from freshmaker.types import ArtifactType, ArtifactBuildState, EventState
-from freshmaker.models import ArtifactBuild, Event
+from freshmaker.models import (
+    ArtifactBuild, ArtifactBuildCompose, Event, EventDependency)
+from freshmaker.monitor import (
+    freshmaker_api_response_cache_hit_counter,
+    freshmaker_api_response_cache_miss_counter)
+
+# Events and builds in these states are not changed by Freshmaker anymore.
+TERMINAL_EVENT_STATES = [
+    EventState.COMPLETE.value, EventState.FAILED.value,
+    EventState.SKIPPED.value, EventState.CANCELED.value]
+TERMINAL_BUILD_STATES = [
+    ArtifactBuildState.DONE.value, ArtifactBuildState.FAILED.value,
+    ArtifactBuildState.CANCELED.value]
+
+
+class KeysetPagination(Pagination):
+    """
+    Pagination object used instead of `flask_sqlalchemy.Pagination` when
+    the total count of items is not requested or when the page starts
+    after the item defined by the `after_id` cursor.
+
+    One more item than `per_page` is fetched to find out whether there is
+    a next page, so no COUNT(*) query is needed to paginate.
+    """
+
+    def __init__(self, query, page, per_page, total, keyset):
+        """
+        :param query: Query returning the items to paginate.
+        :param int page: Number of the page.
+        :param int per_page: Number of items per page.
+        :param total: Total number of items or None if not counted.
+        :param bool keyset: When True, the query is ordered by the item id
+            and the next page is defined by the `after_id` cursor.
+        """
+        items = query.limit(per_page + 1).offset((page - 1) * per_page).all()
+        super(KeysetPagination, self).__init__(
+            query, page, per_page, total, items[:per_page])
+        self._has_next = len(items) > per_page
+        self.keyset = keyset
+
+    @property
+    def has_next(self):
+        return self._has_next
+
+    @property
+    def next_after_id(self):
+        """The `after_id` cursor of the next page or None."""
+        if self.keyset and self.has_next:
+            return self.items[-1].id
+        return None
 
 
 def pagination_metadata(p_query, request_args):
     """
     Returns a dictionary containing metadata about the paginated query. This must be run as part of a Flask request.
-    :param p_query: flask_sqlalchemy.Pagination object
+    :param p_query: flask_sqlalchemy.Pagination or KeysetPagination object
     :param request_args: a dictionary of the arguments that were part of the
         Flask request
     :return: a dictionary containing metadata about the paginated query
@@ -40,7 +94,7 @@ def pagination_metadata(p_query, request_args):
     # Remove pagination related args because those are handled elsewhere
     # Also, remove any args that url_for accepts in case the user entered
     # those in
-    for key in ["page", "per_page", "endpoint"]:
+    for key in ["page", "per_page", "after_id", "endpoint"]:
         if key in request_args_wo_page:
             request_args_wo_page.pop(key)
     for key in request_args:
@@ -49,7 +103,7 @@ def pagination_metadata(p_query, request_args):
 
     pagination_data = {
         "page": p_query.page,
-        "pages": p_query.pages,
+        "pages": p_query.pages if p_query.total is not None else None,
         "per_page": p_query.per_page,
         "prev": None,
         "next": None,
@@ -61,15 +115,17 @@ def pagination_metadata(p_query, request_args):
             _external=True,
             **request_args_wo_page
         ),
-        "last": url_for(
+        "last": None,
+    }
+
+    if p_query.total is not None:
+        pagination_data["last"] = url_for(
             request.endpoint,
             page=p_query.pages,
             per_page=p_query.per_page,
             _external=True,
             **request_args_wo_page
-        ),
-    }
-
+        )
     if p_query.has_prev:
         pagination_data["prev"] = url_for(
             request.endpoint,
@@ -78,7 +134,15 @@ def pagination_metadata(p_query, request_args):
             _external=True,
             **request_args_wo_page
         )
-    if p_query.has_next:
+    if getattr(p_query, "next_after_id", None) is not None:
+        pagination_data["next"] = url_for(
+            request.endpoint,
+            after_id=p_query.next_after_id,
+            per_page=p_query.per_page,
+            _external=True,
+            **request_args_wo_page
+        )
+    elif p_query.has_next:
         pagination_data["next"] = url_for(
             request.endpoint,
             page=p_query.next_num,
@@ -119,11 +183,62 @@ def _order_by(flask_request, query, base_class, allowed_keys, default_key):
     return query.order_by(order_by_attr)
 
 
+def _paginate(flask_request, query, base_class):
+    """
+    Paginates the `query` based on the "page", "per_page", "after_id" and
+    "show_total" arguments from flask_request.args.
+
+    The "after_id" argument can be used only when ordering by "id" or "-id".
+    It returns the items following the item with this id, so the page is
+    found using the index instead of skipping all the previous items.
+
+    When "show_total" is "False", the COUNT(*) query is not executed and
+    the next page is defined by the "after_id" cursor if possible.
+
+    :return: flask_sqlalchemy.Pagination or KeysetPagination
+    """
+    page = flask_request.args.get('page', 1, type=int)
+    per_page = flask_request.args.get('per_page', 10, type=int)
+    after_id = flask_request.args.get('after_id', None, type=int)
+    show_total = flask_request.args.get('show_total', 'True') != 'False'
+
+    if after_id is None and show_total:
+        return query.paginate(page, per_page, False)
+
+    order_by = flask_request.args.get('order_by', '-id', type=str)
+    keyset = order_by in ['id', '-id']
+    if per_page < 1 or page < 1:
+        raise ValidationError('The "page" and "per_page" must be positive numbers.')
+
+    total = query.order_by(None).count() if show_total else None
+
+    if after_id is not None:
+        if not keyset:
+            raise ValidationError(
+                'The "after_id" can be used only when ordering by "id" or "-id".')
+        if order_by == '-id':
+            query = query.filter(base_class.id < after_id)
+        else:
+            query = query.filter(base_class.id > after_id)
+        page = 1
+
+    return KeysetPagination(query, page, per_page, total, keyset)
+
+
 def filter_artifact_builds(flask_request):
     """
     Returns a flask_sqlalchemy.Pagination object based on the request parameters
     :param request: Flask request object
-    :return: flask_sqlalchemy.Pagination
+    :return: flask_sqlalchemy.Pagination or KeysetPagination
+    """
+    return _paginate(flask_request, query_artifact_builds(flask_request), ArtifactBuild)
+
+
+def query_artifact_builds(flask_request):
+    """
+    Returns the ordered query of ArtifactBuilds matching the request parameters
+    :param request: Flask request object
+    :return: flask_sqlalchemy.BaseQuery
     """
     search_query = dict()
 
@@ -158,7 +273,7 @@ def filter_artifact_builds(flask_request):
         if flask_request.args.get(key, None):
             search_query[key] = flask_request.args[key]
 
-    query = ArtifactBuild.query
+    query = ArtifactBuild.query.options(*ArtifactBuild.json_load_options())
 
     if search_query:
         query = query.filter_by(**search_query)
@@ -178,18 +293,24 @@ def filter_artifact_builds(flask_request):
                       ["id", "name", "event_id", "dep_on_id", "build_id",
                        "original_nvr", "rebuilt_nvr"], "-id")
 
-    page = flask_request.args.get('page', 1, type=int)
-    per_page = flask_request.args.get('per_page', 10, type=int)
-    return query.paginate(page, per_page, False)
+    return query
 
 
 def filter_events(flask_request):
     """
     Returns a flask_sqlalchemy.Pagination object based on the request parameters
     :param request: Flask request object
-    :return: flask_sqlalchemy.Pagination
+    :return: flask_sqlalchemy.Pagination or KeysetPagination
     """
+    return _paginate(flask_request, query_events(flask_request), Event)
 
+
+def query_events(flask_request):
+    """
+    Returns the ordered query of Events matching the request parameters
+    :param request: Flask request object
+    :return: flask_sqlalchemy.BaseQuery
+    """
     query = Event.query
 
     for key in ['message_id', 'search_key', 'event_type_id', 'requester']:
@@ -219,9 +340,226 @@ def filter_events(flask_request):
     query = _order_by(flask_request, query, Event,
                       ["id", "message_id"], "-id")
 
-    page = flask_request.args.get('page', 1, type=int)
-    per_page = flask_request.args.get('per_page', 10, type=int)
-    return query.paginate(page, per_page, False)
+    return query
+
+
+def get_event_cache_validators(event_id, variant):
+    """
+    Returns the validators used for HTTP caching of the Event JSON without
+    loading the whole Event and its builds.
+
+    :param int event_id: Id of the Event.
+    :param str variant: Name of the JSON representation of the Event.
+    :return: None if the Event does not exist, otherwise tuple with the
+        ETag and last modification time. The ETag is None when the Event is
+        not in a terminal state, because it can still change. The last
+        modification time is always None, because the builds and depending
+        events can change after the Event has been done and their changes
+        are tracked only by the ETag.
+    """
+    # The list of depending events and the builds can change even when the
+    # Event is in a terminal state, so they are part of the ETag too.
+    last_dependency_id = db.session.query(func.max(EventDependency.id)).filter(
+        EventDependency.event_dependency_id == Event.id).label("last_dependency_id")
+    row = db.session.query(
+        Event.id, Event.state, Event.time_done, last_dependency_id,
+    ).filter(Event.id == event_id).first()
+    if row is None:
+        return None
+    if row.state not in TERMINAL_EVENT_STATES:
+        return None, None
+
+    etag = "event-%s-%d-%d-%s-%s-%s" % (
+        variant, row.id, row.state, _etag_time(row.time_done),
+        row.last_dependency_id, _get_builds_digest(row.id))
+    return etag, None
+
+
+def _get_builds_digest(event_id):
+    """
+    Returns the digest of the ArtifactBuilds columns of the Event which can
+    change after the Event is done.
+
+    The builds do not store the time of their last change, so the digest is
+    computed from the columns themselves. This way the re-triggered builds
+    or builds with changed state or state_reason change the digest even
+    when their time_completed stays the same.
+    """
+    digest = hashlib.sha256()
+    builds = db.session.query(
+        ArtifactBuild.id, ArtifactBuild.state, ArtifactBuild.state_reason,
+        ArtifactBuild.build_id, ArtifactBuild.rebuilt_nvr,
+        ArtifactBuild.build_args, ArtifactBuild.dep_on_id,
+        ArtifactBuild.time_submitted, ArtifactBuild.time_completed,
+    ).filter(ArtifactBuild.event_id == event_id).order_by(ArtifactBuild.id)
+    for build in builds:
+        digest.update(repr(tuple(build)).encode("utf-8"))
+    composes = db.session.query(
+        ArtifactBuildCompose.build_id, ArtifactBuildCompose.compose_id,
+    ).join(ArtifactBuild).filter(ArtifactBuild.event_id == event_id).order_by(
+        ArtifactBuildCompose.build_id, ArtifactBuildCompose.compose_id)
+    for compose in composes:
+        digest.update(repr(tuple(compose)).encode("utf-8"))
+    return digest.hexdigest()
+
+
+def get_build_cache_validators(build_id):
+    """
+    Returns the validators used for HTTP caching of the ArtifactBuild JSON
+    without loading the whole ArtifactBuild.
+
+    :param int build_id: Id of the ArtifactBuild.
+    :return: None if the ArtifactBuild does not exist, otherwise tuple with
+        the ETag and last modification time. Both are None when the build
+        is not in a terminal state, because it can still change.
+    """
+    row = db.session.query(
+        ArtifactBuild.id, ArtifactBuild.state, ArtifactBuild.time_completed,
+    ).filter(ArtifactBuild.id == build_id).first()
+    if row is None:
+        return None
+    if row.state not in TERMINAL_BUILD_STATES:
+        return None, None
+
+    etag = "build-%d-%d-%s" % (row.id, row.state, _etag_time(row.time_completed))
+    return etag, row.time_completed
+
+
+def _etag_time(dt):
+    return dt.strftime("%Y%m%dT%H%M%S.%f") if dt else "none"
+
+
+def conditional_json_response(etag, last_modified, get_json, revalidate=False):
+    """
+    Returns the JSON response with the HTTP caching headers.
+
+    When `etag` is set, the object is in a terminal state and the client
+    already has its current representation according to the If-None-Match
+    or If-Modified-Since request headers, the "304 Not Modified" response
+    is returned without calling `get_json`.
+
+    :param str etag: ETag of the object or None if it can still change.
+    :param datetime last_modified: Time of the last change of the object
+        or None.
+    :param get_json: Function returning the JSON representation of the
+        object.
+    :param bool revalidate: When True, the response with `etag` must be
+        revalidated by the caches before every use instead of being cached
+        for `api_terminal_cache_max_age` seconds. Used for objects which
+        can change even in a terminal state.
+    :rtype: flask.Response
+    """
+    if last_modified:
+        # HTTP dates have one second precision.
+        last_modified = last_modified.replace(microsecond=0)
+
+    not_modified = False
+    if etag:
+        if request.if_none_match:
+            not_modified = request.if_none_match.contains(etag)
+        elif last_modified and request.if_modified_since:
+            not_modified = last_modified <= request.if_modified_since
+
+    if not_modified:
+        response = Response(status=304)
+    else:
+        response = jsonify(get_json())
+
+    response.cache_control.public = True
+    if etag:
+        response.set_etag(etag)
+        if last_modified:
+            response.last_modified = last_modified
+        if revalidate:
+            response.cache_control.no_cache = True
+        else:
+            response.cache_control.max_age = conf.api_terminal_cache_max_age
+    else:
+        response.cache_control.max_age = conf.api_cache_max_age
+    return response
+
+
+CachedResponse = namedtuple("CachedResponse", ["body", "etag"])
+
+
+class ResponseCache(object):
+    """
+    Thread-safe LRU cache of serialized JSON responses of the read-only API
+    views.
+
+    The view passes the cache key and the function returning the JSON data
+    to `ResponseCache.response()`. The JSON data is serialized only on the
+    cache miss and the cached response is then served with a strong ETag
+    computed from its body.
+    """
+
+    def __init__(self, maxsize):
+        """
+        :param int maxsize: Maximum number of cached responses. The least
+            recently used response is evicted when it is exceeded.
+        """
+        self.maxsize = maxsize
+        self._lock = threading.Lock()
+        self._responses = OrderedDict()
+
+    def __len__(self):
+        return len(self._responses)
+
+    def clear(self):
+        with self._lock:
+            self._responses.clear()
+
+    def get(self, key, get_json):
+        """
+        Returns the cached response for `key`. On cache miss, the `get_json`
+        is called and its result is serialized and stored in the cache.
+
+        :param key: Hashable key of the response.
+        :param get_json: Function returning the JSON data of the response
+            or None if there is nothing to respond with.
+        :return: CachedResponse or None if `get_json` returned None.
+        """
+        with self._lock:
+            cached = self._responses.get(key)
+            if cached is not None:
+                self._responses.move_to_end(key)
+                freshmaker_api_response_cache_hit_counter.inc()
+                return cached
+
+        freshmaker_api_response_cache_miss_counter.inc()
+        data = get_json()
+        if data is None:
+            return None
+        body = (json.dumps(data) + "\n").encode("utf-8")
+        cached = CachedResponse(body, hashlib.sha256(body).hexdigest())
+
+        with self._lock:
+            self._responses[key] = cached
+            self._responses.move_to_end(key)
+            while len(self._responses) > self.maxsize:
+                self._responses.popitem(last=False)
+        return cached
+
+    def response(self, key, get_json):
+        """
+        Returns the Flask response with the cached JSON for `key`, or the
+        "304 Not Modified" response if the If-None-Match request header
+        matches its ETag. See `ResponseCache.get()` for the arguments.
+
+        :return: flask.Response or None if `get_json` returned None.
+        """
+        cached = self.get(key, get_json)
+        if cached is None:
+            return None
+        if request.if_none_match.contains(cached.etag):
+            response = Response(status=304)
+        else:
+            response = Response(cached.body, mimetype="application/json")
+        response.set_etag(cached.etag)
+        return response
+
+
+response_cache = ResponseCache(conf.api_response_cache_size)
 
 
 def json_error(status, error, message):
@@ -0,0 +1,187 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2026  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Compiled form of the HANDLER_BUILD_ALLOWLIST and HANDLER_BUILD_BLOCKLIST
+rules used by `BaseHandler.allow_build()`.
+"""
+
+import functools
+import re
+
+
+# Results of `BuildRules.evaluate()`.
+ALLOWED = "allowed"
+BLOCKED = "blocked"
+NOT_ALLOWED = "not allowed"
+
+
+class _NeverRule(object):
+    """ Rule which does not match any criteria, used for empty rules. """
+
+    def match(self, criteria):
+        return False
+
+
+class _OperatorRule(object):
+    """
+    Rule matching when *any* or *all* of its subrules match, constructed
+    by freshmaker.config's any_() and all_() methods.
+    """
+
+    def __init__(self, operator, subrules):
+        self.match_any = operator == "any"
+        self.subrules = tuple(subrules)
+
+    def match(self, criteria):
+        if self.match_any:
+            for subrule in self.subrules:
+                if subrule.match(criteria):
+                    return True
+            return False
+
+        for subrule in self.subrules:
+            if not subrule.match(criteria):
+                return False
+        return True
+
+
+class _DictRule(object):
+    """
+    Rule matching when the criteria values match the regular expressions of
+    all the keys in the rule dict which are in the criteria.
+    """
+
+    def __init__(self, rule):
+        self.keys = frozenset(rule.keys())
+        self.patterns = []
+        for key, value_patterns in rule.items():
+            # If the key-val is not in the rule, it means the configuration
+            # does not care about the value.
+            if value_patterns is None:
+                continue
+            if not isinstance(value_patterns, (tuple, list)):
+                value_patterns = [str(value_patterns)]
+            self.patterns.append(
+                (key, tuple(re.compile(regex) for regex in value_patterns)))
+        self.patterns = tuple(self.patterns)
+
+    def match(self, criteria):
+        # If none of passed criteria matches configured rule, build is not allowed
+        if self.keys.isdisjoint(criteria):
+            return False
+
+        for key, regexes in self.patterns:
+            value = criteria.get(key)
+            if value is None:
+                continue
+            for regex in regexes:
+                if regex.match(value):
+                    break
+            else:
+                return False
+        return True
+
+
+def compile_rule(rule):
+    """
+    Compiles the rule from the Freshmaker configuration to the tree of
+    objects with `match(criteria)` method returning True if the criteria
+    matches the rule. The `criteria` passed to `match()` must be a dict with
+    string values.
+
+    :param dict or list of dicts rule: Rule from the Freshmaker
+        configuration. It can be list or dict:
+
+        If it is dict, all the key-vals in the rule dict must match the
+        key-vals in the criteria dict. If the value is list for
+        particular key in rule dict, the relationship between this list's
+        items is OR.
+
+        If it is list, it must have following format:
+
+            ["operator_name", [{rules}, {to}, {evaluate}, ...]]
+
+        Such list is constructed by freshmaker.config's any_() and all_()
+        methods. The operator name is either "any" or "all".
+    :raises TypeError: if the rule has invalid format.
+    :raises ValueError: if the rule uses unknown operator.
+    :raises re.error: if the rule contains invalid regular expression.
+    """
+    if isinstance(rule, list):
+        if not rule:
+            return _NeverRule()
+
+        if not isinstance(rule[0], str):
+            raise TypeError(
+                "Rule does not have any operator, use any_() or all_() "
+                "methods to construct the rule: %r" % rule)
+
+        if rule[0] not in ("any", "all"):
+            raise ValueError(
+                "Invalid operator %s in rule: %r." % (rule[0], rule))
+
+        return _OperatorRule(
+            rule[0], [compile_rule(subrule) for subrule in rule[1]])
+
+    if not isinstance(rule, dict):
+        raise TypeError(
+            "Rebuild rule must be dict or list, got %r." % rule)
+
+    return _DictRule(rule)
+
+
+class BuildRules(object):
+    """
+    Compiled allowlist and blocklist rules of single handler and artifact
+    type with memoized results.
+    """
+
+    def __init__(self, allowlist, blocklist, cache_size=4096):
+        """
+        :param allowlist: Allowlist rule from the Freshmaker configuration.
+        :param blocklist: Blocklist rule from the Freshmaker configuration.
+        :param int cache_size: Maximum number of memoized results.
+        """
+        self.allowlist = compile_rule(allowlist)
+        self.blocklist = compile_rule(blocklist)
+        self._evaluate = functools.lru_cache(maxsize=cache_size)(self._evaluate_criteria)
+
+    def _evaluate_criteria(self, criteria_items):
+        criteria = dict(criteria_items)
+        if not self.allowlist.match(criteria):
+            return NOT_ALLOWED
+        if self.blocklist.match(criteria):
+            return BLOCKED
+        return ALLOWED
+
+    def evaluate(self, criteria):
+        """
+        Evaluates the rules for `criteria`.
+
+        :param dict criteria: key-val criteria defining all the attributes of
+            an artifact which is considered for rebuild.
+        :return: ALLOWED, BLOCKED or NOT_ALLOWED.
+        """
+        # The rules match the criteria values as strings, so the criteria
+        # with the same string values always have the same result.
+        return self._evaluate(
+            tuple(sorted((key, str(value)) for key, value in criteria.items())))
@@ -269,6 +269,30 @@ class Config(object):
                     'for other images. WARN: This may lead to downgrade to older '
                     'release as result of rebuild when image to rebuild depends '
                     'on unreleased release of the parent image.'},
+        'lightblue_pool_size': {
+            'type': int,
+            'default': 10,
+            'desc': 'Maximum number of keep-alive connections to LightBlue '
+                    'kept in the per-process HTTP connection pool.'},
+        'lightblue_max_retries': {
+            'type': int,
+            'default': 3,
+            'desc': 'Number of times a failed request to LightBlue is retried.'},
+        'lightblue_retry_backoff_factor': {
+            'type': float,
+            'default': 0.5,
+            'desc': 'Backoff factor used to compute the delay between retries '
+                    'of failed requests to LightBlue, in seconds.'},
+        'lightblue_timeout': {
+            'type': int,
+            'default': 120,
+            'desc': 'Timeout of a single request to LightBlue, in seconds.'},
+        'lightblue_nvrs_chunk_size': {
+            'type': int,
+            'default': 50,
+            'desc': 'Maximum number of NVRs queried in a single LightBlue '
+                    'request. Larger lists of NVRs are split into chunks '
+                    'which are queried in parallel.'},
         'lightblue_repo_vendors': {
             'type': tuple,
             'default': ("redhat",),
@@ -365,6 +389,72 @@ class Config(object):
             'type': str,
             'default': 'dogpile.cache.memory',
             'desc': 'Name of dogpile.cache backend to use.'},
+        'koji_session_pool_size': {
+            'type': int,
+            'default': 10,
+            'desc': 'Maximum number of idle Koji sessions kept for reuse '
+                    'for each Koji profile and authentication type.'},
+        'koji_build_submission_rate': {
+            'type': float,
+            'default': 0.0,
+            'desc': 'Maximum number of container builds submitted to Koji '
+                    'per second. The rate is not limited when set to 0.'},
+        'koji_multicall_batch_size': {
+            'type': int,
+            'default': 100,
+            'desc': 'Maximum number of Koji API calls sent in single '
+                    'multicall request.'},
+        'api_export_batch_size': {
+            'type': int,
+            'default': 1000,
+            'desc': 'Number of database rows fetched at once by the export '
+                    'API endpoints streaming the events and builds.'},
+        'api_response_cache_size': {
+            'type': int,
+            'default': 256,
+            'desc': 'Maximum number of prebuilt responses of the read-only '
+                    'API endpoints kept in memory by each worker.'},
+        'image_verifier_cache_size': {
+            'type': int,
+            'default': 1024,
+            'desc': 'Maximum number of image and repository verification '
+                    'results kept in memory by each worker.'},
+        'image_verifier_cache_ttl': {
+            'type': int,
+            'default': 300,
+            'desc': 'Number of seconds the image and repository verification '
+                    'results are cached. The results are not cached when '
+                    'set to 0.'},
+        'api_cache_max_age': {
+            'type': int,
+            'default': 10,
+            'desc': 'Cache-Control max-age in seconds of the API responses '
+                    'with a single event or build which can still change.'},
+        'api_terminal_cache_max_age': {
+            'type': int,
+            'default': 86400,
+            'desc': 'Cache-Control max-age in seconds of the API responses '
+                    'with a single build in a final state. The responses '
+                    'with a single event in a final state must always be '
+                    'revalidated.'},
+        'koji_cache_backend': {
+            'type': str,
+            'default': '',
+            'desc': 'Name of dogpile.cache backend used to cache the Koji '
+                    'build metadata. Use a persistent backend shared by all '
+                    'the processes, e.g. "dogpile.cache.redis" with the '
+                    '"allkeys-lru" eviction policy. Defaults to '
+                    'DOGPILE_CACHE_BACKEND.'},
+        'koji_cache_arguments': {
+            'type': dict,
+            'default': {},
+            'desc': 'Arguments passed to the KOJI_CACHE_BACKEND, e.g. '
+                    '{"url": "redis://localhost:6379/0"} or '
+                    '{"filename": "/var/cache/freshmaker/koji.dbm"}.'},
+        'koji_cache_expiration_time': {
+            'type': int,
+            'default': 30 * 24 * 3600,
+            'desc': 'Number of seconds the Koji build metadata are cached for.'},
         'messaging_backends': {
             'type': dict,
             'default': {},
@@ -465,7 +555,7 @@ class Config(object):
         if key in self._defaults:
             # type conversion for configuration item
             convert = self._defaults[key]['type']
-            if convert in [bool, int, list, str, set, dict, tuple]:
+            if convert in [bool, int, float, list, str, set, dict, tuple]:
                 try:
                     # Do no try to convert None...
                     if value is not None:
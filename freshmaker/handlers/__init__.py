@@ -24,15 +24,16 @@
 import abc
 import json
 import re
-import copy
-from functools import wraps
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial, wraps
 
 from freshmaker import conf, log, db, models
-from freshmaker.kojiservice import koji_service, parse_NVR
+from freshmaker.build_rules import BuildRules, ALLOWED
+from freshmaker.kojiservice import KojiService, koji_service, parse_NVR
 from freshmaker.models import ArtifactBuildState
 from freshmaker.types import EventState
 from freshmaker.models import ArtifactBuild, Event
-from freshmaker.utils import get_rebuilt_nvr
+from freshmaker.utils import get_rebuilt_nvr, RateLimiter
 from freshmaker.errors import UnprocessableEntity, ProgrammingError
 from freshmaker.odcsclient import create_odcs_client, FreshmakerODCSClient
 from freshmaker.odcsclient import COMPOSE_STATES
@@ -146,6 +147,10 @@ class BaseHandler(object):
     # have the same order value, they can be called in any random order.
     order = 50
 
+    # Incremented by invalidate_build_rules() to make all the handlers
+    # recompile their BuildRules.
+    _build_rules_generation = 0
+
     def __init__(self):
         self._db_event_id = None
         self._db_artifact_build_id = None
@@ -159,6 +164,11 @@ class BaseHandler(object):
         # decorator but not the others.
         self._last_handled_exception = None
         self.odcs = FreshmakerODCSClient(self)
+        # BuildRules compiled by _get_build_rules() keyed by the artifact
+        # type, valid for the handler name, allowlist, blocklist and
+        # generation stored in _build_rules_conf.
+        self._build_rules_conf = (None, None, None, None)
+        self._build_rules = {}
 
     def _log(self, log_fnc, msg, *args, **kwargs):
         """
@@ -302,81 +312,69 @@ class BaseHandler(object):
         db.session.commit()
         return build
 
-    def _match_allow_build_rule(self, criteria, rule):
+    def _get_build_rules(self, artifact_type):
         """
-        Returns True if the build criteria matches the rule.
+        Returns the BuildRules compiled from HANDLER_BUILD_ALLOWLIST and
+        HANDLER_BUILD_BLOCKLIST for this handler and `artifact_type`.
 
-        :param dict criteria: key-val criteria defining all the attributes of
-            an artifact which is considered for rebuild.
-        :param dict or list of dicts rule: Rule from the Freshmaker
-            configuration. It can be list or dict:
+        The rules are compiled only once and recompiled only when the
+        configuration is replaced or invalidate_build_rules() is called.
 
-            If it is dict, all the key-vals in the rule dict must match the
-            key-vals in the criteria dict. If the value is list for
-            particular key in rule dict, the relationship between this list's
-            items is OR.
+        :param artifact_type: an enum member of ArtifactType.
+        :rtype: BuildRules
+        """
+        handler_name = self.name
+        allowlist_conf = conf.handler_build_allowlist
+        blocklist_conf = conf.handler_build_blocklist
+        build_rules_conf = self._build_rules_conf
+        if (build_rules_conf[0] != handler_name or
+                build_rules_conf[1] is not allowlist_conf or
+                build_rules_conf[2] is not blocklist_conf or
+                build_rules_conf[3] != BaseHandler._build_rules_generation):
+            self._build_rules_conf = (
+                handler_name, allowlist_conf, blocklist_conf,
+                BaseHandler._build_rules_generation)
+            self._build_rules = {}
+        else:
+            build_rules = self._build_rules.get(artifact_type)
+            if build_rules is not None:
+                return build_rules
 
-            If it is list, it must have following format:
+        type_name = artifact_type.name.lower()
 
-                ["operator_name", [{rules}, {to}, {evaluate}, ...]]
+        # Global rules overridden by this handler rules
+        allowlist_rules = dict(allowlist_conf.get("global", {}))
+        blocklist_rules = dict(blocklist_conf.get("global", {}))
+        allowlist_rules.update(allowlist_conf.get(handler_name, {}))
+        blocklist_rules.update(blocklist_conf.get(handler_name, {}))
 
-            Such list is constructed by freshmaker.config's any_() and all_()
-            methods. The operator name is either "any" or "all".
+        try:
+            build_rules = BuildRules(
+                allowlist_rules.get(type_name, []),
+                blocklist_rules.get(type_name, []))
+        except re.error as exc:
+            err_msg = ("Error while compiling allowlist rule "
+                       "for <handler(%s) artifact(%s)>:\n"
+                       "Incorrect regular expression: %s\n"
+                       "Allowlist will not take effect" %
+                       (handler_name, type_name, str(exc)))
+            self.log_error(err_msg)
+            raise UnprocessableEntity(err_msg)
 
-            If "any" is used, this method returns True if *any* dict in list
-            after the operator name matches the criteria.
+        self._build_rules[artifact_type] = build_rules
+        return build_rules
 
-            If "all" is used, this method returns True if *all* dicts in list
-            after the operator name matches the criteria.
-        :rtype: bool
-        :return: True if the criteria matches the rule.
-        """
-        # If rule is list, check each item (which should be a dict) separately
-        # and return True if any item matches. Support also tuples for
-        # convenience.
-        if isinstance(rule, list):
-            if not rule:
-                return False
-
-            if not isinstance(rule[0], str):
-                raise TypeError(
-                    "Rule does not have any operator, use any_() or all_() "
-                    "methods to construct the rule: %r" % rule)
-
-            if rule[0] == "any":
-                operator = any
-            elif rule[0] == "all":
-                operator = all
-            else:
-                raise ValueError(
-                    "Invalid operator %s in rule: %r." % (rule[0], rule))
-
-            return operator([
-                self._match_allow_build_rule(criteria, subrule)
-                for subrule in rule[1]])
-
-        if not isinstance(rule, dict):
-            raise TypeError(
-                "Rebuild rule must be dict or list, got %r." % rule)
-
-        # If none of passed criteria matches configured rule, build is not allowed
-        if not (set(rule.keys()) & set(criteria.keys())):
-            return False
-
-        # For each key-val of artifact to rebuild, check if it matches
-        # the key-val of rule. If the key-val is not in the rule, it means
-        # the configuration does not care about the value.
-        for key, value in criteria.items():
-            value_patterns = rule.get(key, None)
-            if value_patterns is None:
-                continue
-
-            if not isinstance(value_patterns, (tuple, list)):
-                value_patterns = [str(value_patterns)]
+    @staticmethod
+    def invalidate_build_rules():
+        """
+        Makes all the handlers recompile their BuildRules on the next
+        allow_build() call.
 
-            if not any((re.match(regex, str(value)) for regex in value_patterns)):
-                return False
-        return True
+        Replacing HANDLER_BUILD_ALLOWLIST or HANDLER_BUILD_BLOCKLIST in the
+        configuration is detected automatically, but this method must be
+        called after editing them in place.
+        """
+        BaseHandler._build_rules_generation += 1
 
     def allow_build(self, artifact_type, **criteria):
         """
@@ -392,41 +390,10 @@ class BaseHandler(object):
         :return: True if build is allowed, otherwise False is returned.
         :rtype: bool
         """
-        # Global rules
-        allowlist_rules = copy.deepcopy(
-            conf.handler_build_allowlist.get("global", {}))
-        blocklist_rules = copy.deepcopy(
-            conf.handler_build_blocklist.get("global", {}))
-
-        # This handler rules
-        handler_name = self.name
-        allowlist_rules.update(conf.handler_build_allowlist.get(handler_name, {}))
-        blocklist_rules.update(conf.handler_build_blocklist.get(handler_name, {}))
-
-        try:
-            allowlist = allowlist_rules.get(artifact_type.name.lower(), [])
-            if self._match_allow_build_rule(criteria, allowlist):
-                blocklist = blocklist_rules.get(artifact_type.name.lower(), [])
-                if self._match_allow_build_rule(criteria, blocklist):
-                    self.log_debug('%r, type=%r is blocked.',
-                                   criteria, artifact_type.name.lower())
-                    return False
-                self.log_debug('%r, type=%r is allowed.',
-                               criteria, artifact_type.name.lower())
-                self.log_debug('name=%r, allowlist=%r', handler_name, allowlist)
-                return True
-        except re.error as exc:
-            err_msg = ("Error while compiling whilelist rule "
-                       "for <handler(%s) artifact(%s)>:\n"
-                       "Incorrect regular expression: %s\n"
-                       "Allowlist will not take effect" %
-                       (handler_name, artifact_type.name.lower(), str(exc)))
-            self.log_error(err_msg)
-            raise UnprocessableEntity(err_msg)
-
-        self.log_debug('%r, type=%r is not allowed.',
-                       criteria, artifact_type.name.lower())
-        return False
+        result = self._get_build_rules(artifact_type).evaluate(criteria)
+        self.log_debug('%r, type=%r is %s.',
+                       criteria, artifact_type.name.lower(), result)
+        return result == ALLOWED
 
 
 class ContainerBuildHandler(BaseHandler):
@@ -481,6 +448,29 @@ class ContainerBuildHandler(BaseHandler):
         :return: Koji build id.
         :rtype: int
         """
+        submit = self.prepare_image_artifact_build(build, repo_urls)
+        db.session.commit()
+        if not submit:
+            return
+        return submit()
+
+    def prepare_image_artifact_build(self, build, repo_urls=None):
+        """
+        Prepares ArtifactBuild of 'image' type to be submitted to Koji.
+
+        The changes of the `build` are not committed, the caller is
+        responsible for committing them.
+
+        :param build: ArtifactBuild of 'image' type.
+        :param list[str] repo_urls: list of YUM repository URLs that will be
+            passed to the ``buildContainer`` eventually as a build option.
+        :return: function without arguments submitting the build to Koji and
+            returning the Koji build id, or None if the build cannot be
+            submitted and has been marked as FAILED.
+        :rtype: callable
+        :raises ODCSComposeNotReady: if some ODCS compose used by the build
+            is not generated yet.
+        """
         if build.state != ArtifactBuildState.PLANNED.value:
             build.transition(
                 ArtifactBuildState.FAILED.value,
@@ -548,9 +538,9 @@ class ContainerBuildHandler(BaseHandler):
                 build, build.rebuilt_nvr, rebuilt_nvr)
 
         build.rebuilt_nvr = rebuilt_nvr
-        db.session.commit()
 
-        return self.build_container(
+        return partial(
+            self.build_container,
             scm_url, branch, target,
             repo_urls=repo_urls,
             isolated=True,
@@ -597,21 +587,67 @@ class ContainerBuildHandler(BaseHandler):
     def start_to_build_images(self, builds):
         """Start to build images
 
+        The builds are prepared one by one, then submitted to Koji in
+        parallel by at most MAX_THREAD_WORKERS threads and at most
+        KOJI_BUILD_SUBMISSION_RATE builds per second. The resulting states
+        of all the builds are committed at once.
+
+        The build which cannot be prepared or submitted is marked as FAILED
+        with the error in its state_reason, but the other builds are still
+        submitted, so the builds already running in Koji are not failed.
+
         :param builds: list of ArtifactBuild, each of them represents a
             container image to be rebuilt.
         :type builds: list or tuple
         """
-
-        def build_image(build):
+        # List of (build, submit) tuples.
+        prepared = []
+        for build in builds:
             self.set_context(build)
             repo_urls = self.get_repo_urls(build)
             try:
-                build.build_id = self.build_image_artifact_build(build, repo_urls)
+                submit = self.prepare_image_artifact_build(build, repo_urls)
             except ODCSComposeNotReady:
                 # We skip this image for now. It will be built once the ODCS
                 # compose is finished.
-                return
-            if build.build_id:
+                continue
+            except Exception as e:
+                log.exception("Cannot prepare container build %r.", build)
+                build.transition(
+                    ArtifactBuildState.FAILED.value, "Handling of "
+                    "build failed with traceback: %s" % (str(e)))
+                continue
+            prepared.append((build, submit))
+
+        if self.dry_run:
+            # The fake task ids are taken from the database, which the
+            # workers do not touch.
+            KojiService.seed_fake_task_id()
+
+        limiter = RateLimiter(conf.koji_build_submission_rate)
+
+        def run_submit(submit):
+            # The workers only talk to Koji, they do not touch the database.
+            if not submit:
+                return None, None
+            limiter.wait()
+            try:
+                return submit(), None
+            except Exception as e:
+                log.exception("Cannot submit container build to Koji.")
+                return None, e
+
+        with ThreadPoolExecutor(max_workers=conf.max_thread_workers) as executor:
+            results = list(executor.map(
+                run_submit, [submit for _, submit in prepared]))
+
+        for (build, _), (build_id, error) in zip(prepared, results):
+            build.build_id = build_id
+            if error:
+                build.transition(
+                    ArtifactBuildState.FAILED.value, "Handling of "
+                    "build failed with traceback: %s" % (str(error)))
+            elif build.build_id:
                 build.transition(
                     ArtifactBuildState.BUILD.value,
                     "Building container image in Koji.")
@@ -620,6 +656,4 @@ class ContainerBuildHandler(BaseHandler):
                     ArtifactBuildState.FAILED.value,
                     "Error while building container image in Koji.")
             db.session.add(build)
-            db.session.commit()
-
-        list(map(build_image, builds))
+        db.session.commit()
@@ -23,7 +23,7 @@ import koji
 import json
 
 from freshmaker import conf, db, log
-from freshmaker.lightblue import LightBlue
+from freshmaker.lightblue import ContainerImage, LightBlue
 from freshmaker.handlers import ContainerBuildHandler, fail_event_on_handler_exception
 from freshmaker.events import FreshmakerAsyncManualBuildEvent
 from freshmaker.types import EventState
@@ -179,28 +179,46 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
 
         return lb.get_images_by_brew_package(self.event.container_images)
 
-    def get_image_tree(self, lb, image, tree):
+    def get_image_trees(self, lb, images):
         """
-        This method recursively finds the tree for given image, up to the base image.
-        At every recursive call it will add one element of the tree.
-        When the base image is reached, the tree will be completed.
+        This method finds the trees for given images, up to the base images.
+        The trees are built one level at a time, so the parents of all the
+        images in the same level are found using single batched query.
 
         :param lb LightBlue: LightBlue instance
-        :param image ContainerImage: image of which we want the tree.
-        :param tree list: the list of images that we found until now.
-        :return: list of images, in this order: [parent, grandparent, ..., baseimage]
-        :rtype: list
+        :param images list: images of which we want the trees.
+        :return: list of trees in the same order as `images`. Each tree is
+            list of images, in this order: [parent, grandparent, ..., baseimage]
+        :rtype: list of lists
         """
-        parent_nvr = lb.find_parent_brew_build_nvr_from_child(image)
-        if parent_nvr:
-            parent = lb.get_images_by_nvrs([parent_nvr], published=None)
-            if parent:
-                parent = parent[0]
+        trees = [[] for image in images]
+        # List of (image, tree) tuples for the images whose parent we look for.
+        frontier = list(zip(images, trees))
+        while frontier:
+            parent_nvrs = [
+                lb.find_parent_brew_build_nvr_from_child(image) for image, _ in frontier]
+            nvrs_to_query = [nvr for nvr in parent_nvrs if nvr]
+            if not nvrs_to_query:
+                # All the images in this level are base images.
+                break
+            level_parents = lb.get_images_by_nvrs_batch(nvrs_to_query, published=None)
+            ContainerImage.prefetch_koji_data(
+                [parent.nvr for parent in level_parents if parent])
+            parents = iter(level_parents)
+
+            next_frontier = []
+            for (image, tree), parent_nvr in zip(frontier, parent_nvrs):
+                if not parent_nvr:
+                    continue
+                parent = next(parents)
+                if not parent:
+                    continue
                 parent.resolve(lb)
                 image['parent'] = parent
                 tree.append(parent)
-                return self.get_image_tree(lb, parent, tree)
-        return tree
+                next_frontier.append((parent, tree))
+            frontier = next_frontier
+        return trees
 
     def filter_images_based_on_dist_git_branch(self, images, db_event):
         """
@@ -234,21 +252,30 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
             #   * cnv-libvirt-container-1.3-1
             #   * cnv-libvirt-container-1.2-4
             #   * ...
-            # Since `images` is a list of sorted NVRs, we just need to select the first NVR for
-            # each package (name).
+            # Since `images` is a list of sorted NVRs, we just need to select the first NVR
+            # built from the requested branch for each package (name).
+            package_to_images = {}
             for image in images:
-                build = None
-                git_branch = None
-
-                package = image['brew']['package']
-                # if package is already in images_to_rebuild we don't need to keep searching
-                # since the images were sorted by NVR in the beginning
-                if package not in images_to_rebuild:
-                    # Let's get the branch for this image
-                    build = session.get_build(image.nvr)
-                    task_id = build.get("extra", {}).get("container_koji_task_id")
+                package_to_images.setdefault(image['brew']['package'], []).append(image)
+
+            # Check the highest not yet checked NVR of all the packages at once, so
+            # the Koji data are queried using single multicall for each round.
+            while package_to_images:
+                candidates = {
+                    package: package_images.pop(0)
+                    for package, package_images in package_to_images.items()}
+                builds = session.get_builds([image.nvr for image in candidates.values()])
+                task_ids = [
+                    (build or {}).get("extra", {}).get("container_koji_task_id")
+                    for build in builds]
+                tasks = iter(session.get_task_requests(
+                    [task_id for task_id in task_ids if task_id]))
+
+                for (package, image), build, task_id in zip(
+                        candidates.items(), builds, task_ids):
+                    git_branch = None
                     if task_id:
-                        task = session.get_task_request(task_id)
+                        task = next(tasks)
                         # The task_info should always be in the 3rd element
                         task_info = task[2]
                         git_branch = task_info.get("git_branch") if len(task_info) else None
@@ -256,6 +283,9 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
                     if (build and task_id and git_branch and
                             self.event.dist_git_branch == git_branch):
                         images_to_rebuild[package] = image
+                        del package_to_images[package]
+                    elif not package_to_images[package]:
+                        del package_to_images[package]
 
             if not images_to_rebuild or len(images_to_rebuild) < len(self.event.container_images):
                 # If we didn't find images to rebuild, or we found less than what the user asked
@@ -299,9 +329,9 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
         # images_trees will be a list of lists, where the first elements in the list will be
         # the requested images and the following elements are the elements in the tree up to the
         # base image.
-        images_trees = []
-        for image in images_to_rebuild:
-            images_trees.append([image] + self.get_image_tree(lb, image, []))
+        images_trees = [
+            [image] + tree for image, tree in zip(
+                images_to_rebuild, self.get_image_trees(lb, images_to_rebuild))]
 
         # Let's remove duplicated images which share the same name and version, but different
         # release.
@@ -323,6 +353,8 @@ class RebuildImagesOnAsyncManualBuild(ContainerBuildHandler):
         # builds tracks all the builds we register in db
         builds = {}
 
+        ContainerImage.prefetch_koji_data(
+            [image.nvr for batch in batches for image in batch])
         for batch in batches:
             for image in batch:
                 # Reset context to db_event for each iteration before
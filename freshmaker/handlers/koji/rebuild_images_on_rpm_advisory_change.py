@@ -24,8 +24,9 @@
 
 import json
 import koji
+from datetime import datetime
 
-from freshmaker import conf, db
+from freshmaker import conf, db, messaging
 from freshmaker.events import (
     ErrataAdvisoryRPMsSignedEvent, ManualRebuildWithAdvisoryEvent)
 from freshmaker.handlers import ContainerBuildHandler, fail_event_on_handler_exception
@@ -34,7 +35,8 @@ from freshmaker.pulp import Pulp
 from freshmaker.errata import Errata
 from freshmaker.types import (
     ArtifactType, ArtifactBuildState, EventState, RebuildReason)
-from freshmaker.models import Event, Compose
+from freshmaker.models import (
+    ArtifactBuild, ArtifactBuildCompose, Compose, Event)
 
 
 class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
@@ -216,19 +218,33 @@ class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
         # of content_sets. Value is Compose database object.
         odcs_cache = {}
 
+        # Find out the builds done in the dependant events for all the images
+        # and their parents at once instead of querying them image by image.
+        nvrs = set()
         for batch in batches:
             for image in batch:
-                # Reset context to db_event for each iteration before
-                # the ArtifactBuild is created.
-                self.set_context(db_event)
+                nvrs.add(image.nvr)
+                if "parent" in image and image["parent"]:
+                    nvrs.add(image["parent"].nvr)
+        dep_builds = db_event.get_artifact_builds_from_event_dependencies(
+            nvrs - set(builds.keys()))
+
+        # The ArtifactBuilds are only added to the session here and all of
+        # them are committed at once at the end of this method. The list of
+        # (ArtifactBuild, [Compose, ...]) tuples is used to store the
+        # relationships between them once the ids are assigned by the database.
+        new_builds = []
+        self.set_context(db_event)
 
+        for batch in batches:
+            for image in batch:
                 nvr = image.nvr
                 if nvr in builds:
                     self.log_debug("Skipping recording build %s, "
                                    "it is already in db", nvr)
                     continue
 
-                parent_build = db_event.get_artifact_build_from_event_dependencies(nvr)
+                parent_build = dep_builds.get(nvr)
                 if parent_build:
                     self.log_debug(
                         "Skipping recording build %s, "
@@ -241,7 +257,7 @@ class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
                 dep_on = builds[parent_nvr] if parent_nvr in builds else None
 
                 if parent_nvr:
-                    build = db_event.get_artifact_build_from_event_dependencies(parent_nvr)
+                    build = dep_builds.get(parent_nvr)
                     if build:
                         parent_nvr = build[0].rebuilt_nvr
                         dep_on = None
@@ -270,18 +286,17 @@ class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
                 else:
                     rebuild_reason = RebuildReason.DEPENDENCY.value
 
-                build = self.record_build(
-                    event, image_name, ArtifactType.IMAGE,
-                    dep_on=dep_on,
-                    state=ArtifactBuildState.PLANNED.value,
-                    original_nvr=nvr,
-                    rebuild_reason=rebuild_reason)
-
-                # Set context to particular build so logging shows this build
-                # in case of error.
-                self.set_context(build)
-
-                build.transition(state, state_reason)
+                build = ArtifactBuild.create(
+                    db.session, db_event, image_name,
+                    ArtifactType.IMAGE.name.lower(),
+                    dep_on=dep_on, state=state,
+                    original_nvr=nvr, rebuild_reason=rebuild_reason)
+                if state == ArtifactBuildState.FAILED.value:
+                    build.state_reason = state_reason
+                    build.time_completed = datetime.utcnow()
+                    ArtifactBuildState.FAILED.counter.inc()
+                    self.log_error("Artifact build %s moved to state FAILED, %r",
+                                   nvr, state_reason)
 
                 build.build_args = json.dumps({
                     "repository": image["repository"],
@@ -293,8 +308,7 @@ class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
                     "renewed_odcs_compose_ids": image["odcs_compose_ids"],
                 })
 
-                db.session.commit()
-
+                composes = []
                 if state != ArtifactBuildState.FAILED.value:
                     # Store odcs pulp compose to build.
                     # Also generate pulp repos in case the image is unpublished,
@@ -311,18 +325,10 @@ class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
                         else:
                             compose = self.odcs.prepare_pulp_repo(
                                 build, image["content_sets"])
-
-                            if build.state != ArtifactBuildState.FAILED.value:
-                                db_compose = Compose(odcs_compose_id=compose['id'])
-                                db.session.add(db_compose)
-                                db.session.commit()
-                                odcs_cache[cache_key] = db_compose
-                            else:
-                                db_compose = None
-                                db.session.commit()
-                        if db_compose:
-                            build.add_composes(db.session, [db_compose])
-                            db.session.commit()
+                            db_compose = Compose(odcs_compose_id=compose['id'])
+                            db.session.add(db_compose)
+                            odcs_cache[cache_key] = db_compose
+                        composes.append(db_compose)
 
                     # Unpublished images can contain unreleased RPMs, so generate
                     # the ODCS compose with all the RPMs in the image to allow
@@ -332,12 +338,26 @@ class RebuildImagesOnRPMAdvisoryChange(ContainerBuildHandler):
                         if compose:
                             db_compose = Compose(odcs_compose_id=compose['id'])
                             db.session.add(db_compose)
-                            db.session.commit()
-                            build.add_composes(db.session, [db_compose])
-                            db.session.commit()
+                            composes.append(db_compose)
 
+                new_builds.append((build, composes))
                 builds[nvr] = build
 
+        # Single flush to get the ids of all the new ArtifactBuilds and
+        # Composes, then the relationships between them are inserted in bulk.
+        db.session.flush()
+        db.session.bulk_insert_mappings(ArtifactBuildCompose, [
+            {"build_id": build.id, "compose_id": compose.id}
+            for build, composes in new_builds for compose in composes])
+        db.session.commit()
+
+        # Emit the messages only once the builds are stored in the database.
+        # The PLANNED builds have been created in their initial state, so
+        # there is no state change to announce for them.
+        for build, _ in new_builds:
+            if build.state == ArtifactBuildState.FAILED.value:
+                messaging.publish('build.state.changed', build.json())
+
         # Reset context to db_event.
         self.set_context(db_event)
 
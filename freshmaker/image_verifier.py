@@ -21,12 +21,79 @@
 #
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
+import copy
+import threading
+import time
+from collections import OrderedDict
+
 from freshmaker import conf
 from freshmaker.lightblue import LightBlue
 
 
+class _ResultCache(object):
+    """
+    Thread-safe cache of the verification results with bounded lifetime
+    of the results and least recently used eviction.
+    """
+
+    def __init__(self, maxsize, ttl):
+        """
+        :param int maxsize: Maximum number of cached results.
+        :param int ttl: Number of seconds after which the result expires.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return len(self._results)
+
+    def clear(self):
+        with self._lock:
+            self._results.clear()
+
+    def get(self, key):
+        """
+        Returns the (result, error) tuple cached for `key` or None if there
+        is no such result or it expired.
+        """
+        with self._lock:
+            cached = self._results.get(key)
+            if cached is None:
+                return None
+            expires, value = cached
+            if expires <= time.monotonic():
+                del self._results[key]
+                return None
+            self._results.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        if self.maxsize <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            self._results[key] = (time.monotonic() + self.ttl, value)
+            self._results.move_to_end(key)
+            while len(self._results) > self.maxsize:
+                self._results.popitem(last=False)
+
+
 class ImageVerifier(object):
 
+    # The results are shared by all the instances, because new ImageVerifier
+    # is created for each API request.
+    _cache = _ResultCache(conf.image_verifier_cache_size,
+                          conf.image_verifier_cache_ttl)
+
+    # Only the ContainerRepository fields checked by the verifier.
+    _repository_projection = [
+        {"field": "repository", "include": True},
+        {"field": "published", "include": True},
+        {"field": "auto_rebuild_tags", "include": True, "recursive": True},
+        {"field": "release_categories", "include": True, "recursive": True},
+    ]
+
     def __init__(self, lb=None):
         """
         Creates new ImageVerifier.
@@ -91,12 +158,17 @@ class ImageVerifier(object):
 
                 ]
             },
-            "projection": [
-                {"field": "*", "include": True, "recursive": True}
-            ]
+            "projection": self._repository_projection
         }
 
         repos = self.lb.find_container_repositories(query, auto_rebuild=False)
+        return self._select_repository_by_name(repo_name, repos)
+
+    def _select_repository_by_name(self, repo_name, repos):
+        """
+        Returns the only ContainerRepository from `repos` found for the
+        Repository name. Raises ValueError in case of error.
+        """
         if not repos:
             raise ValueError("Cannot get repository %s from Lightblue." % repo_name)
         if len(repos) != 1:
@@ -120,12 +192,17 @@ class ImageVerifier(object):
 
                 ]
             },
-            "projection": [
-                {"field": "*", "include": True, "recursive": True}
-            ]
+            "projection": self._repository_projection
         }
 
         repos = self.lb.find_container_repositories(query)
+        return self._select_repository_by_image(nvr, repos)
+
+    def _select_repository_by_image(self, nvr, repos):
+        """
+        Returns the only ContainerRepository from `repos` found for the
+        image NVR. Raises ValueError in case of error.
+        """
         if not repos:
             raise ValueError("Cannot get repository for image %s from Lightblue." % nvr)
         if len(repos) != 1:
@@ -134,6 +211,78 @@ class ImageVerifier(object):
 
         return repos[0]
 
+    def _get_repositories(self, nvrs, repo_names):
+        """
+        Returns the ContainerRepository objects with any of the `repo_names`
+        name or containing any of the images defined by `nvrs` using single
+        Lightblue query. Only the images from `nvrs` are included in the
+        "images" field of returned repositories.
+        """
+        query = {
+            "objectType": "containerRepository",
+            "query": {
+                "$or": [{
+                    "field": "repository",
+                    "op": "=",
+                    "rvalue": repo_name
+                } for repo_name in repo_names] + [{
+                    "field": "images.*.brew.build",
+                    "op": "=",
+                    "rvalue": nvr
+                } for nvr in nvrs]
+            },
+            "projection": list(self._repository_projection)
+        }
+        if nvrs:
+            query["projection"].append(
+                {"field": "images", "include": True,
+                 "match": {
+                     "$or": [{
+                         "field": "brew.build",
+                         "op": "=",
+                         "rvalue": nvr
+                     } for nvr in nvrs]},
+                 "project": [
+                     {"field": "brew.build", "include": True},
+                 ]
+                 })
+
+        return self.lb.find_container_repositories(query, auto_rebuild=False)
+
+    @classmethod
+    def clear_cache(cls):
+        """
+        Removes all the cached verification results.
+        """
+        cls._cache.clear()
+
+    @staticmethod
+    def _capture(verify):
+        """
+        Returns the (result, error) tuple with the result of `verify()` or
+        the message of ValueError raised by it.
+        """
+        try:
+            return (verify(), None)
+        except ValueError as e:
+            return (None, str(e))
+
+    def _cached(self, key, verify):
+        """
+        Returns the result of `verify()` cached for `key`. The ValueError
+        raised by `verify()` is cached as well and raised again.
+        """
+        cached = self._cache.get(key)
+        if cached is None:
+            cached = self._capture(verify)
+            self._cache.set(key, cached)
+
+        result, error = cached
+        if error is not None:
+            raise ValueError(error)
+        # Callers may modify the result, do not let them change the cache.
+        return copy.deepcopy(result)
+
     def verify_image(self, image_nvr):
         """
         Verifies the image defined by `image_nvr`.
@@ -143,10 +292,21 @@ class ImageVerifier(object):
         :rtype: dict
         :return: Dict with image NVR as key and list of content_sets as values.
         """
+        return self._cached(
+            ("image", image_nvr), lambda: self._verify_image(image_nvr))
+
+    def _verify_image(self, image_nvr):
         repo = self._get_repository_from_image(image_nvr)
         self._verify_repository_data(repo)
 
         images = self.lb.get_images_by_nvrs([image_nvr], include_rpm_manifest=False)
+        return self._get_image_result(repo, images)
+
+    def _get_image_result(self, repo, images):
+        """
+        Returns the result of image verification based on its verified
+        ContainerRepository and the list of its ContainerImages.
+        """
         if not images:
             raise ValueError(
                 "No published images tagged by %r found in repository" % (
@@ -171,16 +331,28 @@ class ImageVerifier(object):
         values. "images" is a dict with image NVR as key, value is a dict with
         tags and content_sets info.
         """
+        return self._cached(
+            ("repository", repo_name), lambda: self._verify_repository(repo_name))
+
+    def _verify_repository(self, repo_name):
         repo = self._get_repository_from_name(repo_name)
         self._verify_repository_data(repo)
 
+        images = self.lb.find_images_with_included_rpms(
+            [], [], {repo["repository"]: repo}, include_rpm_manifest=False)
+        return self._get_repository_result(repo, images)
+
+    def _get_repository_result(self, repo, images):
+        """
+        Returns the result of repository verification based on the verified
+        ContainerRepository and the list of its ContainerImages.
+        """
+        repo_name = repo["repository"]
         data = {
             "repository": {"auto_rebuild_tags": repo["auto_rebuild_tags"]},
             "images": {}
         }
 
-        images = self.lb.find_images_with_included_rpms(
-            [], [], {repo["repository"]: repo}, include_rpm_manifest=False)
         for image in images:
             self._verify_image_data(image)
             image_data = {"content_sets": [], "tags": []}
@@ -197,3 +369,118 @@ class ImageVerifier(object):
                     repo["auto_rebuild_tags"]))
 
         return data
+
+    def verify_images(self, nvrs=None, repo_names=None):
+        """
+        Verifies many images and repositories at once. Unlike the
+        `verify_image()` and `verify_repository()`, the Lightblue is queried
+        only once for all the containerRepositories and once for each kind
+        of the containerImages, no matter how many images and repositories
+        are verified.
+
+        :param list nvrs: NVRs of images to verify.
+        :param list repo_names: Names of repositories to verify.
+        :rtype: dict
+        :return: A dict with "images" and "repositories" as keys. "images" is
+        a dict with image NVR as key, value is a dict with "content_sets" as
+        key and list of content_sets as value. "repositories" is a dict with
+        repository name as key and the result of `verify_repository()` as
+        value. When the verification of image or repository fails, the value
+        is a dict with "error" key containing the reason instead.
+        """
+        keys = [("image", nvr) for nvr in dict.fromkeys(nvrs or [])]
+        keys += [("repository", name) for name in dict.fromkeys(repo_names or [])]
+
+        results = {}
+        for key in keys:
+            cached = self._cache.get(key)
+            if cached is not None:
+                results[key] = cached
+
+        missing_nvrs = [value for kind, value in keys
+                        if kind == "image" and (kind, value) not in results]
+        missing_repo_names = [value for kind, value in keys
+                              if kind == "repository" and (kind, value) not in results]
+        if missing_nvrs or missing_repo_names:
+            for key, result in self._verify_many(
+                    missing_nvrs, missing_repo_names).items():
+                self._cache.set(key, result)
+                results[key] = result
+
+        ret = {"images": {}, "repositories": {}}
+        for (kind, value), (result, error) in results.items():
+            group = "images" if kind == "image" else "repositories"
+            if error is not None:
+                ret[group][value] = {"error": error}
+            elif kind == "image":
+                ret[group][value] = {"content_sets": list(result[value])}
+            else:
+                ret[group][value] = copy.deepcopy(result)
+        return ret
+
+    def _verify_many(self, nvrs, repo_names):
+        """
+        Verifies the images and repositories using batched Lightblue queries.
+
+        :return: Dict with ("image", nvr) or ("repository", repo_name) as key
+            and (result, error) tuple as value.
+        """
+        repos = self._get_repositories(nvrs, repo_names)
+        results = {}
+
+        # Find and verify the repositories of all the images and repositories.
+        repo_by_name = {}
+        for repo_name in repo_names:
+            try:
+                repo = self._select_repository_by_name(
+                    repo_name, [r for r in repos if r["repository"] == repo_name])
+                self._verify_repository_data(repo)
+            except ValueError as e:
+                results[("repository", repo_name)] = (None, str(e))
+                continue
+            repo_by_name[repo_name] = repo
+
+        repo_by_nvr = {}
+        for nvr in nvrs:
+            # The same repositories as find_container_repositories() returns
+            # in _get_repository_from_image().
+            image_repos = [
+                r for r in repos if r.get("auto_rebuild_tags") and
+                any(i["brew"]["build"] == nvr for i in r.get("images", []))]
+            try:
+                repo = self._select_repository_by_image(nvr, image_repos)
+                self._verify_repository_data(repo)
+            except ValueError as e:
+                results[("image", nvr)] = (None, str(e))
+                continue
+            repo_by_nvr[nvr] = repo
+
+        # Verify the images.
+        if repo_by_nvr:
+            images_by_nvr = {}
+            for image in self.lb.get_images_by_nvrs(
+                    list(repo_by_nvr.keys()), include_rpm_manifest=False):
+                images_by_nvr.setdefault(image.nvr, []).append(image)
+            for nvr, repo in repo_by_nvr.items():
+                results[("image", nvr)] = self._capture(
+                    lambda: self._get_image_result(repo, images_by_nvr.get(nvr, [])))
+
+        # Verify the images in repositories.
+        if repo_by_name:
+            images_by_repo = {repo_name: {} for repo_name in repo_by_name}
+            for image in self.lb.find_images_with_included_rpms(
+                    [], [], repo_by_name, include_rpm_manifest=False):
+                for repodata in image["repositories"]:
+                    repo = repo_by_name.get(repodata["repository"])
+                    if (not repo or repodata["registry"] in
+                            conf.image_build_repository_registries):
+                        continue
+                    tag_names = set(t["name"] for t in repodata["tags"])
+                    if tag_names.intersection(repo["auto_rebuild_tags"]):
+                        images_by_repo[repo["repository"]][image.nvr] = image
+            for repo_name, repo in repo_by_name.items():
+                results[("repository", repo_name)] = self._capture(
+                    lambda: self._get_repository_result(
+                        repo, list(images_by_repo[repo_name].values())))
+
+        return results
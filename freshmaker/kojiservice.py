@@ -31,8 +31,10 @@ from koji import parse_NVR # noqa
 from kobo import rpmlib
 
 import contextlib
+import os
 import re
 import requests
+import threading
 import freshmaker.utils
 from freshmaker import log, conf, db
 from freshmaker.consumer import work_queue_put
@@ -50,21 +52,33 @@ class KojiService(object):
     As a wrapper of Koji API, new APIs could be added as well.
     """
 
-    # Used to generate incremental task id in dry run mode.
-    _FAKE_TASK_ID = 0
+    # Used to generate decreasing task id in dry run mode. The builds can be
+    # submitted from several threads, so it is guarded by the lock.
+    _FAKE_TASK_ID = None
+    _FAKE_TASK_ID_LOCK = threading.Lock()
 
     def __init__(self, profile=None, dry_run=False):
         self._config = koji.read_config(profile or 'koji')
         self.dry_run = dry_run
 
-        # In case we run in DRY_RUN mode, we need to initialize
-        # _FAKE_TASK_ID to the id of last ODCS builds to have the IDs
-        # increasing and unique even between Freshmaker restarts.
-        if self.dry_run:
-            KojiService._FAKE_TASK_ID = \
-                ArtifactBuild.get_lowest_build_id(db.session) - 1
-            if KojiService._FAKE_TASK_ID >= 0:
-                KojiService._FAKE_TASK_ID = -1
+        if self.dry_run and KojiService._FAKE_TASK_ID is None:
+            KojiService.seed_fake_task_id()
+
+    @classmethod
+    def seed_fake_task_id(cls):
+        """
+        Initializes the task id used in dry run mode below the lowest
+        build_id of the ArtifactBuilds to have the IDs unique even between
+        Freshmaker restarts. The task id is never increased.
+
+        This queries the database, so it must be called from the thread
+        owning the database session before the builds are submitted from
+        other threads.
+        """
+        fake_task_id = min(ArtifactBuild.get_lowest_build_id(db.session) - 1, -1)
+        with cls._FAKE_TASK_ID_LOCK:
+            if cls._FAKE_TASK_ID is None or fake_task_id < cls._FAKE_TASK_ID:
+                cls._FAKE_TASK_ID = fake_task_id
 
     @property
     def config(self):
@@ -121,8 +135,9 @@ class KojiService(object):
                  (source_url, build_target, build_opts))
 
         # Get the task_id
-        KojiService._FAKE_TASK_ID -= 1
-        task_id = KojiService._FAKE_TASK_ID
+        with KojiService._FAKE_TASK_ID_LOCK:
+            KojiService._FAKE_TASK_ID -= 1
+            task_id = KojiService._FAKE_TASK_ID
 
         # Parse the source_url to get the name of container and generate
         # fake event.
@@ -214,21 +229,85 @@ class KojiService(object):
         """
         return self.session.getBuild(buildinfo)
 
+    def _multicall(self, method, args_list):
+        """
+        Calls the Koji API `method` once for each item of `args_list`
+        using the Koji multicall, so the calls are sent to Koji in batches
+        of KOJI_MULTICALL_BATCH_SIZE calls instead of one by one.
+
+        :param str method: name of the Koji API method.
+        :param list args_list: list of positional arguments for each call.
+            Non-tuple items are passed as single argument.
+        :return: list of results of the calls in the order of `args_list`.
+        :rtype: list
+        :raises koji.GenericError: if any of the calls fails.
+        """
+        if not args_list:
+            return []
+
+        with self.session.multicall(batch=conf.koji_multicall_batch_size) as m:
+            calls = [
+                getattr(m, method)(*(args if isinstance(args, tuple) else (args,)))
+                for args in args_list
+            ]
+        return [c.result for c in calls]
+
+    def get_builds(self, buildinfos):
+        """
+        Return information about multiple builds using single multicall.
+
+        :param list buildinfos: list of builds, see `get_build`.
+        :return: list of build info dicts in the order of `buildinfos`. The
+            build info is None for the builds which do not exist.
+        :rtype: list
+        """
+        return self._multicall('getBuild', buildinfos)
+
     def get_build_id(self, build_nvr):
         return self.session.findBuildID(build_nvr)
 
     def get_task_request(self, task_id):
         return self.session.getTaskRequest(task_id)
 
+    def get_task_requests(self, task_ids):
+        """
+        Return the requests of multiple tasks using single multicall.
+
+        :param list[int] task_ids: IDs of the tasks.
+        :return: list of task requests in the order of `task_ids`.
+        :rtype: list
+        """
+        return self._multicall('getTaskRequest', task_ids)
+
     def get_build_target(self, target_name):
         return self.session.getBuildTarget(target_name)
 
     def get_task_info(self, task_id):
         return self.session.getTaskInfo(task_id)
 
+    def get_tasks_info(self, task_ids):
+        """
+        Return information about multiple tasks using single multicall.
+
+        :param list[int] task_ids: IDs of the tasks.
+        :return: list of task info dicts in the order of `task_ids`.
+        :rtype: list
+        """
+        return self._multicall('getTaskInfo', task_ids)
+
     def list_archives(self, build_id):
         return self.session.listArchives(build_id)
 
+    def list_archives_many(self, build_ids):
+        """
+        Return the archives of multiple builds using single multicall.
+
+        :param list[int] build_ids: IDs of the builds.
+        :return: list of lists of archives in the order of `build_ids`.
+        :rtype: list
+        """
+        return self._multicall('listArchives', build_ids)
+
     def get_container_build_id_from_task(self, task_id):
         """
         Return container build id by check 'koji_builds' in build
@@ -311,10 +390,88 @@ class KojiService(object):
         return rpms
 
 
+class KojiServicePool(object):
+    """
+    Process-wide pool of KojiService instances.
+
+    The KojiService instances are kept between the ``koji_service()`` calls,
+    so the Koji profile is read, the connection is established and the
+    Kerberos login is done just once per pooled instance. The anonymous and
+    the authenticated instances are pooled separately. Every instance is
+    used by a single thread at a time.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pid = os.getpid()
+        # Mapping of (profile, login, dry_run) to list of idle instances.
+        self._idle = {}
+
+    def acquire(self, profile, login, dry_run):
+        """
+        Returns an idle KojiService instance from the pool or a new one.
+
+        :param str profile: Koji profile.
+        :param bool login: whether the instance is used with login.
+        :param bool dry_run: whether the instance runs in dry run mode.
+        :rtype: KojiService
+        """
+        with self._lock:
+            if self._pid != os.getpid():
+                # The connections cannot be shared with the parent process.
+                self._idle = {}
+                self._pid = os.getpid()
+            idle = self._idle.get((profile, login, dry_run))
+            if idle:
+                return idle.pop()
+        return KojiService(profile=profile, dry_run=dry_run)
+
+    def release(self, service, profile, login, dry_run):
+        """
+        Returns the KojiService instance acquired by `acquire` to the pool.
+        When there are already KOJI_SESSION_POOL_SIZE idle instances, the
+        instance is logged out and dropped.
+
+        :param KojiService service: the instance to return.
+        :param str profile: Koji profile.
+        :param bool login: whether the instance is used with login.
+        :param bool dry_run: whether the instance runs in dry run mode.
+        """
+        with self._lock:
+            idle = self._idle.setdefault((profile, login, dry_run), [])
+            if self._pid == os.getpid() and len(idle) < conf.koji_session_pool_size:
+                idle.append(service)
+                return
+        self.discard(service)
+
+    def discard(self, service):
+        """
+        Logs out the KojiService instance which is not returned to the pool.
+
+        :param KojiService service: the instance to drop.
+        """
+        try:
+            if service.logged_in:
+                service.logout()
+        except Exception as e:
+            log.warning("Cannot logout Koji session: %s", e)
+
+    def clear(self):
+        """Drops all the idle instances without logging them out."""
+        with self._lock:
+            self._idle = {}
+
+
+_koji_service_pool = KojiServicePool()
+
+
 @contextlib.contextmanager
 def koji_service(profile=None, logger=None, login=True, dry_run=False):
     """A Koji service context manager that could be used with with
 
+    The KojiService instances are taken from the process-wide pool and
+    returned to it afterwards, so they stay logged in between the calls.
+
     Example::
 
         with KojiService() as service:
@@ -328,12 +485,13 @@ def koji_service(profile=None, logger=None, login=True, dry_run=False):
         with KojiService(koji='stg', logger=logger) as service:
             ...
     """
-    service = KojiService(profile=profile, dry_run=dry_run)
+    profile = profile or 'koji'
+    service = _koji_service_pool.acquire(profile, login, dry_run)
 
     if login:
         if not conf.krb_auth_principal:
             log.error("Cannot login to Koji, krb_auth_principal not set")
-        else:
+        elif not service.logged_in:
             log.debug('Logging into %s with Kerberos authentication.',
                       service.server)
 
@@ -343,11 +501,15 @@ def koji_service(profile=None, logger=None, login=True, dry_run=False):
             if not dry_run and not service.logged_in:
                 log.error('Could not login server %s', service.server)
                 yield None
+                return
 
     try:
         yield service
-    finally:
-        if service.logged_in:
-            if logger:
-                logger.debug('Logout Koji session')
-            service.logout()
+    except Exception:
+        # The session might be in unknown state, so do not reuse it.
+        if logger:
+            logger.debug('Logout Koji session')
+        _koji_service_pool.discard(service)
+        raise
+    else:
+        _koji_service_pool.release(service, profile, login, dry_run)
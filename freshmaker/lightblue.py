@@ -23,23 +23,52 @@
 #            Jan Kaluza <jkaluza@redhat.com>
 #            Ralph Bean <rbean@redhat.com>
 
+import array
+import copy
 import json
 import os
 import re
 import requests
 import io
+import threading
 import dogpile.cache
+import dogpile.cache.api
+import dogpile.cache.backends.null
+import dogpile.cache.util
 import kobo.rpmlib
+from collections.abc import Sequence
 from concurrent.futures import ThreadPoolExecutor
 from http import HTTPStatus
 from itertools import groupby
+from requests.adapters import HTTPAdapter
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.retry import Retry
 
 from freshmaker import log, conf
+from freshmaker.monitor import (
+    freshmaker_lightblue_pool_hit_counter,
+    freshmaker_lightblue_pool_miss_counter,
+    freshmaker_image_resolve_cache_hit_counter,
+    freshmaker_image_resolve_cache_miss_counter)
 from freshmaker.kojiservice import koji_service
-from freshmaker.utils import sorted_by_nvr, is_pkg_modular
+from freshmaker.utils import (
+    sorted_by_nvr, is_pkg_modular, parse_nvr, parse_nvra)
 import koji
 
 
+# Marks the threads of the thread pools started by LightBlue, so the nested
+# queries run serially in them instead of starting another thread pool.
+_pool_thread = threading.local()
+
+
+def _init_pool_thread():
+    _pool_thread.active = True
+
+
+def _in_pool_thread():
+    return getattr(_pool_thread, "active", False)
+
+
 class LightBlueError(Exception):
     """Base class representing errors from LightBlue server"""
 
@@ -117,6 +146,43 @@ class KojiLookupError(ValueError):
     pass
 
 
+class _MeteredPoolMixin(object):
+    """
+    Counts the connections checked out from the urllib3 connection pool.
+
+    A connection which is still open is a "hit", because the request reuses
+    the keep-alive connection. A connection without socket is a "miss",
+    because the request has to connect and do the TLS handshake again.
+    """
+
+    def _get_conn(self, timeout=None):
+        conn = super(_MeteredPoolMixin, self)._get_conn(timeout=timeout)
+        if getattr(conn, "sock", None) is not None:
+            freshmaker_lightblue_pool_hit_counter.inc()
+        else:
+            freshmaker_lightblue_pool_miss_counter.inc()
+        return conn
+
+
+class _MeteredHTTPConnectionPool(_MeteredPoolMixin, HTTPConnectionPool):
+    pass
+
+
+class _MeteredHTTPSConnectionPool(_MeteredPoolMixin, HTTPSConnectionPool):
+    pass
+
+
+class LightBlueHTTPAdapter(HTTPAdapter):
+    """HTTPAdapter reporting the connection pool usage to freshmaker.monitor"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        super(LightBlueHTTPAdapter, self).init_poolmanager(*args, **kwargs)
+        self.poolmanager.pool_classes_by_scheme = {
+            "http": _MeteredHTTPConnectionPool,
+            "https": _MeteredHTTPSConnectionPool,
+        }
+
+
 class ContainerRepository(dict):
     """Represent a container repository"""
 
@@ -127,19 +193,355 @@ class ContainerRepository(dict):
         return repo
 
 
+def _koji_cache_key_mangler(key):
+    """
+    Returns the key used to store the Koji build metadata in the cache.
+
+    The key does not depend on the process which computed it, so the cache
+    can be shared by all the Freshmaker processes using the same Koji.
+    """
+    return "freshmaker:koji:%s:%s" % (
+        conf.koji_profile, dogpile.cache.util.sha1_mangle_key(key.encode("utf-8")))
+
+
+# Fields of the RPMs in containerImageRPMManifest read by Freshmaker.
+RPM_FIELDS = ("name", "nvra", "srpm_name", "srpm_nevra")
+
+
+class RpmSymbols(object):
+    """
+    Thread-safe table assigning integer IDs to the RPM names, NVRAs and
+    SRPM NEVRAs.
+
+    Single table is shared by all the images found by the LightBlue
+    instance, so every string is stored just once per event no matter how
+    many images contain the RPM. The ID 0 is reserved for missing value.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._values = [None]
+        self._ids = {}
+
+    def __len__(self):
+        return len(self._values) - 1
+
+    def get_id(self, value):
+        """
+        Returns the ID of the `value`, adding it to the table if needed.
+
+        :param str value: String to get the ID for or None.
+        :rtype: int
+        """
+        if value is None:
+            return 0
+        id = self._ids.get(value)
+        if id is None:
+            with self._lock:
+                id = self._ids.get(value)
+                if id is None:
+                    id = len(self._values)
+                    self._values.append(value)
+                    self._ids[value] = id
+        return id
+
+    def find_id(self, value):
+        """
+        Returns the ID of the `value` or None if it is not in the table.
+        """
+        return self._ids.get(value)
+
+    def get_value(self, id):
+        """
+        Returns the string with the `id` or None for the ID 0.
+        """
+        return self._values[id]
+
+
+class RpmList(Sequence):
+    """
+    Immutable list of RPMs from the containerImageRPMManifest.
+
+    Lightblue returns every RPM as a dict of strings, which takes a lot of
+    memory when there are thousands of images with hundreds of RPMs. This
+    class stores the RPM fields in integer arrays of IDs from RpmSymbols
+    instead, so the images of the same event share the strings.
+
+    It behaves like a list of RPM dicts, but every RPM dict returned by it
+    is a new copy, so changing it does not change the RpmList.
+    """
+
+    __slots__ = ("symbols", "name_ids", "nvra_ids", "srpm_name_ids",
+                 "srpm_nevra_ids")
+
+    def __init__(self, rpms=(), symbols=None):
+        """
+        :param list rpms: List of RPM dicts with the RPM_FIELDS keys.
+        :param RpmSymbols symbols: Table to store the strings in. When None,
+            new table is used just for this RpmList.
+        """
+        self.symbols = symbols if symbols is not None else RpmSymbols()
+        columns = tuple(array.array("I") for field in RPM_FIELDS)
+        for rpm in rpms:
+            for column, field in zip(columns, RPM_FIELDS):
+                column.append(self.symbols.get_id(rpm.get(field)))
+        (self.name_ids, self.nvra_ids, self.srpm_name_ids,
+         self.srpm_nevra_ids) = columns
+
+    @classmethod
+    def from_rpms(cls, rpms, symbols=None):
+        """
+        Returns RpmList with the `rpms` or None if the `rpms` contain other
+        fields than RPM_FIELDS and therefore cannot be stored in RpmList.
+        """
+        if not isinstance(rpms, list):
+            return None
+        for rpm in rpms:
+            if (not isinstance(rpm, dict) or
+                    not rpm.keys() <= set(RPM_FIELDS) or
+                    not all(isinstance(value, str) for value in rpm.values())):
+                return None
+        return cls(rpms, symbols)
+
+    @property
+    def names(self):
+        """ Tuple with the names of RPMs. """
+        return tuple(self.symbols.get_value(id) for id in self.name_ids)
+
+    def name_set(self):
+        """ Returns set with the names of RPMs. """
+        get_value = self.symbols.get_value
+        return {get_value(id) for id in set(self.name_ids)}
+
+    def _get_rpm(self, index):
+        ids = (self.name_ids[index], self.nvra_ids[index],
+               self.srpm_name_ids[index], self.srpm_nevra_ids[index])
+        return {field: self.symbols.get_value(id)
+                for field, id in zip(RPM_FIELDS, ids) if id}
+
+    def __len__(self):
+        return len(self.name_ids)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self._get_rpm(i) for i in range(*index.indices(len(self)))]
+        return self._get_rpm(index)
+
+    def __iter__(self):
+        for index in range(len(self.name_ids)):
+            yield self._get_rpm(index)
+
+    def __eq__(self, other):
+        if isinstance(other, RpmList) and other.symbols is self.symbols:
+            return (self.name_ids == other.name_ids and
+                    self.nvra_ids == other.nvra_ids and
+                    self.srpm_name_ids == other.srpm_name_ids and
+                    self.srpm_nevra_ids == other.srpm_nevra_ids)
+        if isinstance(other, (RpmList, list, tuple)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    __hash__ = None  # type: ignore[assignment]
+
+    def __repr__(self):
+        return "RpmList(%r)" % list(self)
+
+    def __copy__(self):
+        return self
+
+    def __deepcopy__(self, memo):
+        return self
+
+    def __reduce__(self):
+        return (self.__class__, (list(self),))
+
+
+def get_rpm_names(rpms):
+    """
+    Returns set with the names of RPMs in the `rpms` list or RpmList.
+    """
+    if isinstance(rpms, RpmList):
+        return rpms.name_set()
+    return {rpm["name"] for rpm in rpms}
+
+
+class RpmNvrIndex(object):
+    """
+    Index of the input RPM NVRs by the RPM name used to filter the images
+    by the RPMs they contain.
+
+    The input NVRs are parsed just once when the index is created and only
+    the image RPMs with the indexed names are parsed, so checking many
+    images with hundreds of RPMs stays cheap.
+    """
+
+    def __init__(self, rpm_name_to_nvrs):
+        """
+        :param dict rpm_name_to_nvrs: Dict with binary RPM name as a key and
+            list of NVRs (or single NVR) as a value.
+        """
+        self.rpm_name_to_nvrs = rpm_name_to_nvrs
+        # RPM name -> tuple of (parsed NVR, is modular) of the input NVRs.
+        self._nvrs = {}
+        for name, nvrs in rpm_name_to_nvrs.items():
+            if isinstance(nvrs, str):
+                nvrs = [nvrs]
+            if nvrs:
+                self._nvrs[name] = tuple(
+                    (parse_nvr(nvr), is_pkg_modular(nvr)) for nvr in nvrs)
+        # (RpmSymbols, its size, RPM name ID -> input NVRs) for the last
+        # RpmSymbols table used, so RpmList can be probed by the name IDs.
+        self._nvrs_by_id = (None, 0, {})
+
+    def _get_nvrs_by_id(self, symbols):
+        cached_symbols, size, nvrs_by_id = self._nvrs_by_id
+        # The table only grows, so it must be checked again only when some
+        # new string has been added.
+        if cached_symbols is not symbols or size != len(symbols):
+            size = len(symbols)
+            nvrs_by_id = {}
+            for name, nvrs in self._nvrs.items():
+                name_id = symbols.find_id(name)
+                if name_id is not None:
+                    nvrs_by_id[name_id] = nvrs
+            self._nvrs_by_id = (symbols, size, nvrs_by_id)
+        return nvrs_by_id
+
+    def _iter_matching_rpms(self, rpms):
+        """
+        Yields (nvra, input NVRs) tuple for every RPM in `rpms` with the
+        name in the index.
+        """
+        if isinstance(rpms, RpmList):
+            nvrs_by_id = self._get_nvrs_by_id(rpms.symbols)
+            if nvrs_by_id.keys().isdisjoint(rpms.name_ids):
+                return
+            get_value = rpms.symbols.get_value
+            nvra_ids = rpms.nvra_ids
+            for index, name_id in enumerate(rpms.name_ids):
+                nvrs = nvrs_by_id.get(name_id)
+                if nvrs:
+                    nvra = get_value(nvra_ids[index])
+                    if nvra is None:
+                        raise KeyError("nvra")
+                    yield nvra, nvrs
+        else:
+            for rpm in rpms:
+                nvrs = self._nvrs.get(rpm.get("name"))
+                if nvrs:
+                    yield rpm["nvra"], nvrs
+
+    def check_rpms(self, rpms, check_nvr=True, check_modularity=True):
+        """
+        Checks the RPMs of an image against the input NVRs.
+
+        :param list rpms: List or RpmList of the RPMs in the image.
+        :param bool check_nvr: Whether to check the RPM versions.
+        :param bool check_modularity: Whether to check the RPM modularity.
+        :rtype: tuple
+        :return: Tuple (has_older_rpm, modularity_matches). The
+            `has_older_rpm` is True if the image contains older version of
+            any input RPM. The `modularity_matches` is True if any RPM in the
+            image is modular the same way as the input RPM of the same name.
+            The values which are not checked are always False.
+        :raises ValueError: if the RPM name in the image NVRA does not match
+            the name of the input NVR.
+        """
+        has_older_rpm = False
+        modularity_matches = False
+        for nvra, nvrs in self._iter_matching_rpms(rpms):
+            if check_nvr and not has_older_rpm:
+                image_nvr = parse_nvra(nvra)
+                image_key = image_nvr.version_release_key
+                for input_nvr, _ in nvrs:
+                    if image_nvr.name != input_nvr.name:
+                        raise ValueError(
+                            "Package names doesn't match: %s, %s" % (
+                                image_nvr.name, input_nvr.name))
+                    # We want to rebuild only images with RPM NVR lower
+                    # than input RPM NVR.
+                    if image_key < input_nvr.version_release_key:
+                        has_older_rpm = True
+                        break
+            if check_modularity and not modularity_matches:
+                image_modular = is_pkg_modular(nvra)
+                for _, input_modular in nvrs:
+                    if image_modular == input_modular:
+                        modularity_matches = True
+                        break
+            if ((has_older_rpm or not check_nvr) and
+                    (modularity_matches or not check_modularity)):
+                break
+        return has_older_rpm, modularity_matches
+
+
 class ContainerImage(dict):
     """Represent a container image"""
 
     region = dogpile.cache.make_region().configure(conf.dogpile_cache_backend)
 
+    # The Koji build metadata of the finished builds never change, so they
+    # are cached for long time in the region which can be persistent.
+    koji_region = dogpile.cache.make_region(
+        key_mangler=_koji_cache_key_mangler).configure(
+            conf.koji_cache_backend or conf.dogpile_cache_backend,
+            expiration_time=conf.koji_cache_expiration_time,
+            arguments=conf.koji_cache_arguments)
+
+    @staticmethod
+    def _compact_parsed_data(parsed_data):
+        """
+        Returns copy of the `parsed_data` with only the data Freshmaker
+        reads, which is the Dockerfile entry of "files".
+        """
+        if not isinstance(parsed_data, dict):
+            return parsed_data
+        parsed_data = {
+            key: value for key, value in parsed_data.items() if key != "layers"}
+        files = parsed_data.get("files")
+        if isinstance(files, list):
+            parsed_data["files"] = [
+                file for file in files
+                if isinstance(file, dict) and file.get("filename") == "Dockerfile"]
+        return parsed_data
+
+    @staticmethod
+    def _compact_rpm_manifest(rpm_manifest, rpm_symbols=None):
+        """
+        Returns copy of the `rpm_manifest` with the "rpms" lists stored
+        as RpmList using the `rpm_symbols` table.
+        """
+        if not isinstance(rpm_manifest, list):
+            return rpm_manifest
+        compact_rpm_manifest = []
+        for manifest in rpm_manifest:
+            if isinstance(manifest, dict) and "rpms" in manifest:
+                rpms = RpmList.from_rpms(manifest["rpms"], rpm_symbols)
+                if rpms is not None:
+                    manifest = dict(manifest, rpms=rpms)
+            compact_rpm_manifest.append(manifest)
+        return compact_rpm_manifest
+
     @classmethod
-    def create(cls, data):
+    def create(cls, data, rpm_symbols=None):
+        """
+        Creates new ContainerImage from the Lightblue containerImage data.
+
+        :param dict data: containerImage data.
+        :param RpmSymbols rpm_symbols: Table to store the RPM strings in,
+            shared by the images of the same event.
+        """
         image = cls()
         image.update(data)
+        if "parsed_data" in data:
+            image["parsed_data"] = cls._compact_parsed_data(data["parsed_data"])
+        if "rpm_manifest" in data:
+            image["rpm_manifest"] = cls._compact_rpm_manifest(
+                data["rpm_manifest"], rpm_symbols)
 
         arch = data.get('architecture')
         image['multi_arch_rpm_manifest'] = {}
-        rpm_manifest = data.get('rpm_manifest')
+        rpm_manifest = image.get('rpm_manifest')
         if arch and rpm_manifest:
             image['multi_arch_rpm_manifest'][arch] = rpm_manifest
 
@@ -206,17 +608,97 @@ class ContainerImage(dict):
             "generate_pulp_repos": True,
         }
 
-    @region.cache_on_arguments()
+    @staticmethod
+    def _get_koji_task_id(build):
+        """
+        Returns the ID of the Koji task which built the `build`.
+
+        :param dict build: Koji build info.
+        :raises KojiLookupError: if the build does not have any task ID.
+        """
+        if 'task_id' not in build or not build['task_id']:
+            if ("extra" in build and
+                    "container_koji_task_id" in build["extra"] and
+                    build["extra"]["container_koji_task_id"]):
+                build['task_id'] = build["extra"]['container_koji_task_id']
+            else:
+                raise KojiLookupError(
+                    "Cannot find task_id or container_koji_task_id "
+                    "in the Koji build %r" % build)
+        return build['task_id']
+
+    def _get_additional_data_from_koji_build(self, build, brew_task):
+        """
+        Returns dict with additional information about the Koji `build`
+        built by the task with `brew_task` request. The "arches" are not
+        set by this method.
+
+        :param dict build: Koji build info.
+        :param list brew_task: Koji task request of the build's task.
+        :raises KojiLookupError: if the build source cannot be found.
+        """
+        data = self._get_default_additional_data()
+
+        # Get the list of ODCS composes used to build the image.
+        extra_image = build.get("extra", {}).get("image", {})
+        if extra_image.get("odcs", {}).get("compose_ids"):
+            data["odcs_compose_ids"] = extra_image["odcs"]["compose_ids"]
+
+        data["parent_build_id"] = extra_image.get("parent_build_id")
+        data["parent_image_builds"] = extra_image.get("parent_image_builds")
+
+        source = brew_task[0]
+        data["target"] = brew_task[1]
+        extra_data = brew_task[2]
+        if "git_branch" in extra_data:
+            data["git_branch"] = extra_data["git_branch"]
+        else:
+            data["git_branch"] = "unknown"
+
+        # Some builds do not have "source" attribute filled in, so try
+        # both build["source"] and task_request[0] sources.
+        sources = [source]
+        if "source" in build:
+            sources.insert(0, build["source"])
+        for src in sources:
+            m = re.match(r".*/(?P<namespace>.*)/(?P<container>.*)#(?P<commit>.*)", src)
+            if m:
+                namespace = m.group("namespace")
+                # For some Koji tasks, the container part ends with "?" in
+                # source URL. This is just because some custom scripts for
+                # submitting those builds include this character in source URL
+                # to mark the query part of URL. We need to handle that by
+                # stripping that character.
+                container = m.group("container").rstrip("?")
+                data["repository"] = namespace + "/" + container
+
+                # There might be tasks which have branch name in
+                # "origin/branch_name" format, so detect it set commit
+                # hash only if this is not true.
+                if "/" not in m.group("commit"):
+                    data["commit"] = m.group("commit")
+                    break
+
+        if not data['commit']:
+            raise KojiLookupError(
+                "Cannot find valid source of Koji build %r" % build)
+
+        return data
+
+    @koji_region.cache_on_arguments()
     def _get_additional_data_from_koji(self, nvr):
         """
         Finds the build defined by `nvr` in Koji and returns dict with
         additional information about this build including "repository",
         "commit", "target" and "git_branch".
 
-        In case of lookup error, the "error" will be set to error string.
-        """
-        data = self._get_default_additional_data()
+        The lookup errors are not cached, so the build is looked up again
+        next time.
 
+        :param str nvr: NVR of the container image build.
+        :raises KojiLookupError: if the build or its source cannot be found
+            in Koji.
+        """
         with koji_service(
                 conf.koji_profile, log, dry_run=conf.dry_run,
                 login=False) as session:
@@ -225,61 +707,8 @@ class ContainerImage(dict):
                 raise KojiLookupError(
                     "Cannot find Koji build with nvr %s in Koji" % nvr)
 
-            if 'task_id' not in build or not build['task_id']:
-                if ("extra" in build and
-                        "container_koji_task_id" in build["extra"] and
-                        build["extra"]["container_koji_task_id"]):
-                    build['task_id'] = build["extra"]['container_koji_task_id']
-                else:
-                    raise KojiLookupError(
-                        "Cannot find task_id or container_koji_task_id "
-                        "in the Koji build %r" % build)
-
-            # Get the list of ODCS composes used to build the image.
-            extra_image = build.get("extra", {}).get("image", {})
-            if extra_image.get("odcs", {}).get("compose_ids"):
-                data["odcs_compose_ids"] = extra_image["odcs"]["compose_ids"]
-
-            data["parent_build_id"] = extra_image.get("parent_build_id")
-            data["parent_image_builds"] = extra_image.get("parent_image_builds")
-
-            brew_task = session.get_task_request(
-                build['task_id'])
-            source = brew_task[0]
-            data["target"] = brew_task[1]
-            extra_data = brew_task[2]
-            if "git_branch" in extra_data:
-                data["git_branch"] = extra_data["git_branch"]
-            else:
-                data["git_branch"] = "unknown"
-
-            # Some builds do not have "source" attribute filled in, so try
-            # both build["source"] and task_request[0] sources.
-            sources = [source]
-            if "source" in build:
-                sources.insert(0, build["source"])
-            for src in sources:
-                m = re.match(r".*/(?P<namespace>.*)/(?P<container>.*)#(?P<commit>.*)", src)
-                if m:
-                    namespace = m.group("namespace")
-                    # For some Koji tasks, the container part ends with "?" in
-                    # source URL. This is just because some custom scripts for
-                    # submitting those builds include this character in source URL
-                    # to mark the query part of URL. We need to handle that by
-                    # stripping that character.
-                    container = m.group("container").rstrip("?")
-                    data["repository"] = namespace + "/" + container
-
-                    # There might be tasks which have branch name in
-                    # "origin/branch_name" format, so detect it set commit
-                    # hash only if this is not true.
-                    if "/" not in m.group("commit"):
-                        data["commit"] = m.group("commit")
-                        break
-
-            if not data['commit']:
-                raise KojiLookupError(
-                    "Cannot find valid source of Koji build %r" % build)
+            brew_task = session.get_task_request(self._get_koji_task_id(build))
+            data = self._get_additional_data_from_koji_build(build, brew_task)
 
             if not conf.supply_arch_overrides:
                 data['arches'] = None
@@ -288,13 +717,103 @@ class ContainerImage(dict):
 
         return data
 
-    def _get_arches_from_koji(self, koji_session, build_id):
-        archives = koji_session.list_archives(build_id=build_id)
+    @classmethod
+    def prefetch_koji_data(cls, nvrs):
+        """
+        Fetches the Koji build metadata of the builds defined by `nvrs`
+        which are not cached yet and stores them in the cache. The data are
+        fetched using the Koji multicalls, so this costs a few round trips
+        to Koji for all the builds instead of several round trips per build.
+
+        :param list[str] nvrs: NVRs of the container image builds.
+        :return: number of NVRs which are cached.
+        :rtype: int
+        """
+        get_cached = cls._get_additional_data_from_koji.get
+        if isinstance(cls.koji_region.backend, dogpile.cache.backends.null.NullBackend):
+            # There is nowhere to store the data to.
+            return 0
+
+        image = cls()
+        nvrs = sorted(set(nvrs))
+        missing_nvrs = [
+            nvr for nvr in nvrs
+            if get_cached(image, nvr) is dogpile.cache.api.NO_VALUE]
+        if not missing_nvrs:
+            return len(nvrs)
+
+        try:
+            with koji_service(
+                    conf.koji_profile, log, dry_run=conf.dry_run,
+                    login=False) as session:
+                builds = {}
+                for nvr, build in zip(missing_nvrs, session.get_builds(missing_nvrs)):
+                    if not build:
+                        log.warning("Cannot find Koji build with nvr %s in Koji", nvr)
+                        continue
+                    try:
+                        cls._get_koji_task_id(build)
+                    except KojiLookupError as e:
+                        log.warning("Cannot get data from Koji for build %s: %s.", nvr, e)
+                        continue
+                    builds[nvr] = build
+
+                brew_tasks = session.get_task_requests(
+                    [build['task_id'] for build in builds.values()])
+                if conf.supply_arch_overrides:
+                    archives = session.list_archives_many(
+                        [build['build_id'] for build in builds.values()])
+                else:
+                    archives = [None] * len(builds)
+        except Exception as e:
+            # The builds are fetched from Koji one by one later, which also
+            # records the errors in the images.
+            log.warning("Cannot prefetch data from Koji: %s", e)
+            return len(nvrs) - len(missing_nvrs)
+
+        cached = len(nvrs) - len(missing_nvrs)
+        for (nvr, build), brew_task, build_archives in zip(
+                builds.items(), brew_tasks, archives):
+            try:
+                data = image._get_additional_data_from_koji_build(build, brew_task)
+            except KojiLookupError as e:
+                log.warning("Cannot get data from Koji for build %s: %s.", nvr, e)
+                continue
+            if build_archives is None:
+                data['arches'] = None
+            else:
+                data['arches'] = image._get_arches_from_archives(build_archives)
+            cls._get_additional_data_from_koji.set(data, image, nvr)
+            cached += 1
+
+        return cached
+
+    @classmethod
+    def prewarm_koji_cache(cls, nvrs):
+        """
+        Fetches the Koji build metadata of the builds defined by `nvrs` to
+        the cache, so they do not have to be fetched from Koji later.
+
+        :param list[str] nvrs: NVRs of the container image builds.
+        :return: number of NVRs which are cached.
+        :rtype: int
+        """
+        nvrs = sorted(set(nvrs))
+        batch_size = conf.koji_multicall_batch_size
+        return sum(
+            cls.prefetch_koji_data(nvrs[i:i + batch_size])
+            for i in range(0, len(nvrs), batch_size))
+
+    def _get_arches_from_archives(self, archives):
         arches = [
             archive['extra']['image']['arch']
             for archive in archives if archive['btype'] == 'image']
         return ' '.join(sorted(arches))
 
+    def _get_arches_from_koji(self, koji_session, build_id):
+        archives = koji_session.list_archives(build_id=build_id)
+        return self._get_arches_from_archives(archives)
+
     def resolve_commit(self):
         """
         Uses the ContainerImage data to resolve the information about
@@ -384,15 +903,50 @@ class ContainerImage(dict):
             else:
                 log.warning("No image %s found in Lightblue.", self.nvr)
 
+    def _resolve_nvr_data(self, lb_instance):
+        """
+        Resolves the metadata which depend only on the NVR of this image,
+        so they can be shared by all the ContainerImage instances with the
+        same NVR.
+
+        :param LightBlue lb_instance: LightBlue instance to use for additional
+            queries.
+        :return: dict with the keys and values set by the resolution.
+        :rtype: dict
+        """
+        self.resolve_commit()
+        self.resolve_published(lb_instance)
+        # Keys set by resolve_commit() and resolve_published(). The
+        # "parent_build_id" is set only when the Koji lookup succeeds.
+        keys = list(self._get_default_additional_data()) + [
+            "parent_build_id", "published"]
+        if not self.get("published"):
+            # The complete RPM manifest is fetched for unpublished images.
+            keys.append("rpm_manifest")
+        return {key: self[key] for key in keys if key in self}
+
     def resolve(self, lb_instance, children=None):
         """
         Resolves the Container image - populates additional metadata by
         querying Koji and lightblue.
+
+        The metadata depending only on the NVR are cached in the LightBlue
+        instance, so every NVR is resolved just once per LightBlue instance.
         """
         try:
-            self.resolve_commit()
+            if isinstance(lb_instance, LightBlue):
+                with lb_instance.resolved_images.lock_nvr(self.nvr):
+                    data = lb_instance.resolved_images.get(self.nvr)
+                    if data is None:
+                        freshmaker_image_resolve_cache_miss_counter.inc()
+                        data = self._resolve_nvr_data(lb_instance)
+                        lb_instance.resolved_images.set(self.nvr, data)
+                    else:
+                        freshmaker_image_resolve_cache_hit_counter.inc()
+                        self.update(copy.deepcopy(data))
+            else:
+                self._resolve_nvr_data(lb_instance)
             self.resolve_content_sets(lb_instance, children)
-            self.resolve_published(lb_instance)
         except Exception as e:
             err = "Cannot resolve the container image: %s" % e
             self.log_error(err)
@@ -441,12 +995,271 @@ class ContainerImage(dict):
         return previous_images[0].get_registry_repositories(lb_instance)
 
 
+class ResolvedImagesCache(object):
+    """
+    Thread-safe cache of the ContainerImage metadata resolved by
+    ContainerImage.resolve, keyed by the image NVR.
+    """
+
+    def __init__(self):
+        self._data = {}
+        self._nvr_locks = {}
+        self._lock = threading.Lock()
+
+    def lock_nvr(self, nvr):
+        """
+        Returns the lock which must be held while resolving the NVR, so
+        the same NVR is not resolved by multiple threads at the same time.
+
+        :param str nvr: NVR of the image.
+        :rtype: threading.Lock
+        """
+        with self._lock:
+            return self._nvr_locks.setdefault(nvr, threading.Lock())
+
+    def get(self, nvr):
+        """
+        Returns the resolved metadata of the image with the NVR or None
+        if the NVR has not been resolved yet.
+
+        :param str nvr: NVR of the image.
+        :rtype: dict
+        """
+        with self._lock:
+            return self._data.get(nvr)
+
+    def set(self, nvr, data):
+        """
+        Stores the resolved metadata of the image with the NVR.
+
+        :param str nvr: NVR of the image.
+        :param dict data: resolved metadata.
+        """
+        with self._lock:
+            self._data[nvr] = copy.deepcopy(data)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._data)
+
+
+class ImageChainsDeduplicator(object):
+    """
+    Deduplicates the images in the chains of images to rebuild, so only
+    single image with the highest release is used for every image group
+    (image name, version and repositories) as described in
+    `LightBlue._deduplicate_images_to_rebuild`.
+
+    The chains are indexed incrementally as they are added, so they can be
+    streamed in one by one. The index keeps the NVRs of every image group
+    as an ordered set and the coordinates of every NVR in the chains. The
+    NVRs are sorted only once per image group in `deduplicate()`, which
+    therefore runs in O(n log n) time for n images in the chains.
+    """
+
+    def __init__(self, lb, chains=None):
+        """
+        :param LightBlue lb: LightBlue instance used to describe the image
+            groups.
+        :param list chains: Initial list of chains in following format:
+            [
+                [child_image, parent_of_child_image, parent_of_parent, ...],
+                ...
+            ]
+            The list is deduplicated in-place by `deduplicate()`.
+        """
+        self.lb = lb
+        self.chains = chains if chains is not None else []
+        # Image groups and parsed parent NVRs do not change between the
+        # phases, so they are computed just once for every NVR.
+        self._nvr_to_image_group = {}
+        self._nvr_to_name_version = {}
+        self._index_chains()
+
+    def _index_chains(self):
+        # Dict mapping the NVR of image to coordinates in the chains. For
+        # example nvr_to_coordinates["nvr"] = [[0, 3], ...] means that the
+        # image with nvr "nvr" is 4th image in the chains[0] list, ...
+        self._nvr_to_coordinates = {}
+        # Dict mapping the image group to ordered set (dict with None values)
+        # of NVRs in the order they have been added.
+        self._image_group_to_nvrs = {}
+        # Dict mapping the NVR to image.
+        self._nvr_to_image = {}
+        # Dict mapping image group to latest released NVR for that image group.
+        self._image_group_to_latest_released_nvr = {}
+        for image_id, chain in enumerate(self.chains):
+            self._index_chain(image_id, chain)
+
+    def _get_image_group(self, image):
+        image_group = self._nvr_to_image_group.get(image.nvr)
+        if image_group is None:
+            image_group = self.lb.describe_image_group(image)
+            self._nvr_to_image_group[image.nvr] = image_group
+        return image_group
+
+    def _get_name_version(self, nvr):
+        name_version = self._nvr_to_name_version.get(nvr)
+        if name_version is None:
+            parsed_nvr = koji.parse_NVR(nvr)
+            name_version = (parsed_nvr["name"], parsed_nvr["version"])
+            self._nvr_to_name_version[nvr] = name_version
+        return name_version
+
+    def _index_chain(self, image_id, chain):
+        for parent_id, image in enumerate(chain):
+            image_group = self._get_image_group(image)
+            self._image_group_to_nvrs.setdefault(image_group, {})[image.nvr] = None
+            self._nvr_to_coordinates.setdefault(image.nvr, []).append([image_id, parent_id])
+            self._nvr_to_image[image.nvr] = image
+            if image.get("latest_released"):
+                self._image_group_to_latest_released_nvr[image_group] = image.nvr
+
+    def add(self, chain):
+        """
+        Adds the chain of images to deduplicate.
+
+        :param list chain: List of images in following format:
+            [child_image, parent_of_child_image, parent_of_parent, ...]
+        """
+        self.chains.append(chain)
+        self._index_chain(len(self.chains) - 1, chain)
+
+    def _sort_image_groups(self):
+        """
+        Returns dict mapping the image group to list of its NVRs sorted
+        descending and copies the content_sets between the images of the
+        same group.
+        """
+        image_group_to_nvrs = {}
+        for image_group, nvrs in self._image_group_to_nvrs.items():
+            nvrs = sorted_by_nvr(nvrs, reverse=True)
+            image_group_to_nvrs[image_group] = nvrs
+
+            # There might be container image NVRs which are not released yet,
+            # but some released image is already built on top of them.
+            # The issue is that such unreleased container image won't be in
+            # its containerRepository and therefore won't have proper
+            # content_sets set.
+            # In this case, we copy the content_sets from the released image.
+            # This might bring issue in case the content_sets changed
+            # dramatically between released and unreleased release of such
+            # image, but it's still the best guess we can do.
+            # This is also used only as fallback in case "content_sets.yml"
+            # does not exists in the dist-git repo, which should be rare
+            # situation.
+            latest_content_sets = []
+            for nvr in reversed(nvrs):
+                image = self._nvr_to_image[nvr]
+                if not image.get("content_sets") or "content_sets_source" not in image:
+                    image["content_sets"] = latest_content_sets
+                elif image["content_sets_source"] == "child_image":
+                    if latest_content_sets:
+                        image["content_sets"] = latest_content_sets
+                else:
+                    latest_content_sets = image["content_sets"]
+        return image_group_to_nvrs
+
+    def deduplicate(self):
+        """
+        Deduplicates the images in the chains in-place.
+
+        :rtype: list
+        :return: The deduplicated chains.
+        """
+        # We need to deduplicate images in two phases:
+        #
+        # 1) "handle_parent_change" - During this phase, we find out if update
+        #    to latest image changes also the parent images.
+        #    For example, foo-1-1 can be built against x-1-1, but foo-1-2 can
+        #    be built against y-1-1. If we simply replace "foo-1-1" by "foo-1-2"
+        #    while keeping the original parent image, the "foo-1-2" will be built
+        #    against x-1-1 instead of y-1-1. This would be wrong.
+        #
+        #    To fix that, we therefore find out that the parent image changed in
+        #    the latest release of foo-1-2 and we replace also the parent images
+        #    according to latest release foo-1-2.
+        #
+        # 2) "update_to_latest". During this phase, we simply find out old releases
+        #    of images in chains and update them to latest released NVR.
+        for phase in ["handle_parent_change", "update_to_latest"]:
+            if phase == "update_to_latest":
+                # The first phase changes the chains, so index them again.
+                self._index_chains()
+            chains = self.chains
+            nvr_to_coordinates = self._nvr_to_coordinates
+            nvr_to_image = self._nvr_to_image
+
+            for image_group, nvrs in self._sort_image_groups().items():
+                # We want to replace NVRs which are lower than the latest released
+                # NVR with latest released NVR. If there are some higher NVRs, we
+                # want to keep them, because we don't want to rebuild the image
+                # against older NVR than the one it is currently built against.
+                if image_group in self._image_group_to_latest_released_nvr:
+                    latest_released_nvr = self._image_group_to_latest_released_nvr[image_group]
+                else:
+                    latest_released_nvr = nvrs[0]
+
+                # The latest_released_nvr_index points to the latest released NVR
+                # in the `nvrs` list. Because `nvrs` list is desc sorted, every NVR
+                # with higher index is lower and therefore we need to replace it.
+                if not conf.lightblue_released_dependencies_only:
+                    latest_released_nvr_index = nvrs.index(latest_released_nvr)
+                else:
+                    # In case we want to use only released versions of images,
+                    # replace all the images with the latest released one.
+                    latest_released_nvr_index = -1
+
+                if phase == "handle_parent_change":
+                    # Find out the name of parent image of latest release image.
+                    latest_image = nvr_to_image[latest_released_nvr]
+                    if not latest_image.get("parent"):
+                        continue
+                    latest_parent = self._get_name_version(latest_image["parent"].nvr)
+                    latest_image_id, latest_parent_id = nvr_to_coordinates[latest_released_nvr][0]
+
+                    # Go through the older images and in case the parent image differs,
+                    # update its parents according to latest image parents.
+                    for nvr in nvrs[latest_released_nvr_index + 1:]:
+                        image = nvr_to_image[nvr]
+                        if not image.get("parent"):
+                            continue
+                        if self._get_name_version(image["parent"].nvr) != latest_parent:
+                            for image_id, parent_id in nvr_to_coordinates[nvr]:
+                                chains[image_id][parent_id:] = chains[latest_image_id][latest_parent_id:]
+                elif phase == "update_to_latest":
+                    latest_image = nvr_to_image[latest_released_nvr]
+                    for nvr in nvrs[latest_released_nvr_index + 1:]:
+                        for image_id, parent_id in nvr_to_coordinates[nvr]:
+                            # At first replace the image in chains based
+                            # on the coordinates from the index.
+                            chains[image_id][parent_id] = latest_image
+
+                            # And in case this image is not the the leaf image, also replace
+                            # the ["parent"] record for the child image to point to the image
+                            # with highest NVR.
+                            if parent_id != 0:
+                                chains[image_id][parent_id - 1]["parent"] = latest_image
+
+        # The chains have changed, so index them again in case more chains
+        # are added later.
+        self._index_chains()
+        return self.chains
+
+
 class LightBlue(object):
     """Interface to query lightblue"""
 
     region = dogpile.cache.make_region().configure(
         conf.dogpile_cache_backend, expiration_time=120)
 
+    # The HTTP session is shared by all the LightBlue instances and threads
+    # in the process, so the TLS connections to LightBlue are kept alive and
+    # reused between the queries.
+    _http_session = None
+    _http_session_pid = None
+    _http_session_lock = threading.Lock()
+
     def __init__(self, server_url, cert, private_key,
                  verify_ssl=None,
                  entity_versions=None,
@@ -489,6 +1302,11 @@ class LightBlue(object):
         # dict with mapping of EUS repositories to their 'auto_rebuild_tags'
         self.repo_to_auto_rebuild_tags = {}
 
+        # ContainerImage metadata resolved using this LightBlue instance.
+        self.resolved_images = ResolvedImagesCache()
+        # Strings of the RPMs in all the images found by this instance.
+        self.rpm_symbols = RpmSymbols()
+
     def _get_entity_version(self, entity_name):
         """Lookup configured entity's version
 
@@ -501,6 +1319,39 @@ class LightBlue(object):
         """
         return self.entity_versions.get(entity_name, '')
 
+    @classmethod
+    def _get_http_session(cls):
+        """Returns the pooled HTTP session shared by the current process
+
+        The session is created lazily and again after fork, because the
+        pooled connections cannot be shared between processes.
+
+        :return: the shared session.
+        :rtype: requests.Session
+        """
+        with cls._http_session_lock:
+            if cls._http_session is None or cls._http_session_pid != os.getpid():
+                retries = Retry(
+                    total=conf.lightblue_max_retries,
+                    backoff_factor=conf.lightblue_retry_backoff_factor,
+                    status_forcelist=(HTTPStatus.BAD_GATEWAY,
+                                      HTTPStatus.SERVICE_UNAVAILABLE,
+                                      HTTPStatus.GATEWAY_TIMEOUT),
+                    # LightBlue "find" requests are POSTs which do not
+                    # change any data, so it is safe to retry them.
+                    allowed_methods=frozenset(["GET", "POST"]),
+                    raise_on_status=False,
+                )
+                adapter = LightBlueHTTPAdapter(
+                    pool_maxsize=conf.lightblue_pool_size,
+                    max_retries=retries)
+                session = requests.Session()
+                session.mount("https://", adapter)
+                session.mount("http://", adapter)
+                cls._http_session = session
+                cls._http_session_pid = os.getpid()
+            return cls._http_session
+
     def _make_request(self, entity, data):
         """Make a request to query data from LightBlue and save it if vcrpy is configured
 
@@ -522,7 +1373,8 @@ class LightBlue(object):
             "data": json.dumps(data),
             "verify": self.verify_ssl,
             "cert": (self.cert, self.private_key),
-            "headers": {'Content-Type': 'application/json'}
+            "headers": {'Content-Type': 'application/json'},
+            "timeout": conf.lightblue_timeout,
         }
         if self.event_id and conf.vcrpy_path:
             import vcr
@@ -530,10 +1382,12 @@ class LightBlue(object):
                 cassette_library_dir=conf.vcrpy_path,
                 record_mode=conf.vcrpy_mode,
             )
+            # Do not use the pooled session here, because the requests sent
+            # over already opened connections would not be recorded.
             with my_vcr.use_cassette(f'{self.event_id}.yml'):
                 response = requests.post(entity_url, **request_kwargs)
         else:
-            response = requests.post(entity_url, **request_kwargs)
+            response = self._get_http_session().post(entity_url, **request_kwargs)
 
         status_code = response.status_code
 
@@ -595,7 +1449,7 @@ class LightBlue(object):
         images = []
         nvr_to_arches = {}
         for image_data in response['processed']:
-            image = ContainerImage.create(image_data)
+            image = ContainerImage.create(image_data, self.rpm_symbols)
             images.append(image)
 
             # TODO: In the future, we may want to combine different ContainerImage
@@ -717,7 +1571,6 @@ class LightBlue(object):
         projection = [
             {"field": "brew", "include": True, "recursive": True},
             {"field": "parsed_data.files", "include": True, "recursive": True},
-            {"field": "parsed_data.layers.*", "include": True, "recursive": True},
             {"field": "repositories.*.published", "include": True, "recursive": True},
             {"field": "repositories.*.registry", "include": True, "recursive": True},
             {"field": "repositories.*.repository", "include": True, "recursive": True},
@@ -778,38 +1631,8 @@ class LightBlue(object):
         :rtype: list
         :return: List of ContainerImage instances without the filtered images.
         """
-        ret = []
-        for image in images:
-            rpms = image.get_rpms()
-            if rpms is None:
-                ret.append(image)
-            image_included = False
-            for rpm in rpms or []:
-                image_rpm_nvra = kobo.rpmlib.parse_nvra(rpm["nvra"])
-                for rpm_nvr in rpm_name_to_nvrs.get(rpm.get("name"), []):
-                    input_rpm_nvr = kobo.rpmlib.parse_nvr(rpm_nvr)
-                    # compare_nvr return values:
-                    #   - nvr1 newer than nvr2: 1
-                    #   - same nvrs: 0
-                    #   - nvr1 older: -1
-                    # We want to rebuild only images with RPM NVR lower than
-                    # input RPM NVR, therefore we check for -1.
-                    if kobo.rpmlib.compare_nvr(
-                            image_rpm_nvra, input_rpm_nvr, ignore_epoch=True) == -1:
-                        ret.append(image)
-                        image_included = True
-                        break
-                if image_included:
-                    break
-            else:
-                # Oh-no, the mighty for/else block!
-                # The else clause executes after the loop completes normally.
-                # This means that the loop did not encounter a break statement.
-                # In our case, this means that we filtered out the image.
-                log.info("Will not rebuild %s, because it does not contain "
-                         "older version of any input package: %r" % (
-                             image.nvr, rpm_name_to_nvrs.values()))
-        return ret
+        return self._filter_out_images_by_rpms(
+            images, rpm_name_to_nvrs, check_nvr=True, check_modularity=False)
 
     def filter_out_modularity_mismatch(self, images, rpm_name_to_nvrs):
         """
@@ -825,27 +1648,47 @@ class LightBlue(object):
         :rtype: list
         :return: List of ContainerImage instances without the filtered images.
         """
+        return self._filter_out_images_by_rpms(
+            images, rpm_name_to_nvrs, check_nvr=False, check_modularity=True)
+
+    def _filter_out_images_by_rpms(self, images, rpm_name_to_nvrs,
+                                   check_nvr=True, check_modularity=True):
+        """
+        Filters out the images in a single pass over their RPMs as
+        described in `filter_out_images_with_higher_rpm_nvr` (when
+        `check_nvr` is True) and `filter_out_modularity_mismatch` (when
+        `check_modularity` is True).
+
+        :param list images: List of ContainerImage instances.
+        :param rpm_name_to_nvrs: Dict with binary RPM name as a key and list
+            of NVRs as a value or RpmNvrIndex built from such dict.
+        :rtype: list
+        :return: List of ContainerImage instances without the filtered images.
+        """
+        if isinstance(rpm_name_to_nvrs, RpmNvrIndex):
+            index = rpm_name_to_nvrs
+        else:
+            index = RpmNvrIndex(rpm_name_to_nvrs)
+
         ret = []
         for image in images:
             rpms = image.get_rpms()
             if rpms is None:
                 ret.append(image)
-            image_included = False
-            # Include the image if the RPM from the advisory is modular, and the RPM of the same
-            # name in the image is also modular. Also, include the image if the opposite is true.
-            for rpm in rpms or []:
-                for rpm_nvr in rpm_name_to_nvrs.get(rpm.get("name"), []):
-                    if is_pkg_modular(rpm_nvr) == is_pkg_modular(rpm["nvra"]):
-                        ret.append(image)
-                        image_included = True
-                        break
-                if image_included:
-                    break
-            else:
+                continue
+            has_older_rpm, modularity_matches = index.check_rpms(
+                rpms, check_nvr, check_modularity)
+            if check_nvr and not has_older_rpm:
+                log.info("Will not rebuild %s, because it does not contain "
+                         "older version of any input package: %r" % (
+                             image.nvr, index.rpm_name_to_nvrs.values()))
+            elif check_modularity and not modularity_matches:
                 log.info(
                     "Filtered out %s because there is a modularity mismatch between the RPMs "
                     "from the image and the advisory: %r" % (
-                        image.nvr, rpm_name_to_nvrs.values()))
+                        image.nvr, index.rpm_name_to_nvrs.values()))
+            else:
+                ret.append(image)
         return ret
 
     def filter_out_images_based_on_content_set(self, images, content_sets):
@@ -995,8 +1838,7 @@ class LightBlue(object):
 
         # Reassign the filtered values to `images`
         images = list(image_nvr_to_image.values())
-        images = self.filter_out_images_with_higher_rpm_nvr(images, rpm_name_to_nvrs)
-        images = self.filter_out_modularity_mismatch(images, rpm_name_to_nvrs)
+        images = self._filter_out_images_by_rpms(images, rpm_name_to_nvrs)
         if content_sets:
             images = self.filter_out_images_based_on_content_set(images, set(content_sets))
         return images
@@ -1007,6 +1849,12 @@ class LightBlue(object):
         """Query lightblue and returns containerImages defined by list of
         `nvrs`.
 
+        The `nvrs` are queried in chunks of `conf.lightblue_nvrs_chunk_size`
+        NVRs. The chunks are queried in parallel, unless this method is
+        called from a thread pool started by LightBlue, in which case they
+        are queried serially so the number of concurrent requests stays
+        bounded by `conf.max_thread_workers`.
+
         :param list nvrs: List of NVRs defining the containerImages to return.
         :param bool published: whether to limit queries to published images
         :param list content_sets: List of content_sets the image includes RPMs
@@ -1018,34 +1866,6 @@ class LightBlue(object):
         :return: List of containerImages.
         :rtype: list of ContainerImages.
         """
-        image_request = {
-            "objectType": "containerImage",
-            "query": {
-                "$and": [
-                    {
-                        "$or": [{
-                            "field": "brew.build",
-                            "op": "=",
-                            "rvalue": nvr
-                        } for nvr in nvrs]
-                    },
-                ]
-            },
-            "projection": self._get_default_projection(
-                include_rpm_manifest=include_rpm_manifest)
-        }
-
-        if content_sets is not None:
-            image_request["query"]["$and"].append(
-                {
-                    "$or": [{
-                        "field": "content_sets.*",
-                        "op": "=",
-                        "rvalue": r
-                    } for r in content_sets]
-                }
-            )
-
         if rpm_nvrs is not None:
             # Lightblue cannot compare NVRs, so just ask for all the container
             # images with any version/release of RPM we are interested in and
@@ -1054,40 +1874,130 @@ class LightBlue(object):
             for rpm_nvr in rpm_nvrs:
                 name = koji.parse_NVR(rpm_nvr)["name"]
                 rpm_name_to_nvrs.setdefault(name, []).append(rpm_nvr)
-            image_request["query"]["$and"].append(
-                {
-                    "$or": [{
-                        "field": "rpm_manifest.*.rpms.*.name",
-                        "op": "=",
-                        "rvalue": rpm_name
-                    } for rpm_name in rpm_name_to_nvrs.keys()]
-                }
-            )
 
-        if published is not None:
-            image_request["query"]["$and"].append(
-                {
-                    "field": "repositories.*.published",
-                    "op": "=",
-                    "rvalue": published
-                })
+        def _get_images(nvrs_chunk):
+            image_request = {
+                "objectType": "containerImage",
+                "query": {
+                    "$and": [
+                        {
+                            "$or": [{
+                                "field": "brew.build",
+                                "op": "=",
+                                "rvalue": nvr
+                            } for nvr in nvrs_chunk]
+                        },
+                    ]
+                },
+                "projection": self._get_default_projection(
+                    include_rpm_manifest=include_rpm_manifest)
+            }
 
-        if rpm_names:
-            image_request["query"]["$and"].append(
-                {
-                    "$or": [{
-                        "field": "rpm_manifest.*.rpms.*.name",
+            if content_sets is not None:
+                image_request["query"]["$and"].append(
+                    {
+                        "$or": [{
+                            "field": "content_sets.*",
+                            "op": "=",
+                            "rvalue": r
+                        } for r in content_sets]
+                    }
+                )
+
+            if rpm_nvrs is not None:
+                image_request["query"]["$and"].append(
+                    {
+                        "$or": [{
+                            "field": "rpm_manifest.*.rpms.*.name",
+                            "op": "=",
+                            "rvalue": rpm_name
+                        } for rpm_name in rpm_name_to_nvrs.keys()]
+                    }
+                )
+
+            if published is not None:
+                image_request["query"]["$and"].append(
+                    {
+                        "field": "repositories.*.published",
                         "op": "=",
-                        "rvalue": rpm_name
-                    } for rpm_name in rpm_names]
-                }
-            )
+                        "rvalue": published
+                    })
+
+            if rpm_names:
+                image_request["query"]["$and"].append(
+                    {
+                        "$or": [{
+                            "field": "rpm_manifest.*.rpms.*.name",
+                            "op": "=",
+                            "rvalue": rpm_name
+                        } for rpm_name in rpm_names]
+                    }
+                )
+
+            return self.find_container_images(image_request)
+
+        chunk_size = conf.lightblue_nvrs_chunk_size
+        nvrs = list(nvrs)
+        if len(nvrs) <= chunk_size:
+            images = _get_images(nvrs)
+        else:
+            # Multi-arch images of the same NVR are always in the same chunk,
+            # so the images can simply be merged and sorted again.
+            nvrs = list(dict.fromkeys(nvrs))
+            chunks = [nvrs[i:i + chunk_size] for i in range(0, len(nvrs), chunk_size)]
+            if _in_pool_thread():
+                chunks_images = map(_get_images, chunks)
+            else:
+                with ThreadPoolExecutor(
+                        max_workers=conf.max_thread_workers,
+                        initializer=_init_pool_thread) as executor:
+                    chunks_images = list(executor.map(_get_images, chunks))
+            images = sorted_by_nvr(
+                [image for images in chunks_images for image in images],
+                reverse=True)
 
-        images = self.find_container_images(image_request)
         if rpm_nvrs is not None:
             images = self.filter_out_images_with_higher_rpm_nvr(images, rpm_name_to_nvrs)
         return images
 
+    def get_images_by_nvrs_batch(self, nvrs, published=True,
+                                 include_rpm_manifest=True):
+        """
+        Resolves list of NVRs collected from multiple callers with as few
+        LightBlue queries as possible.
+
+        The NVRs can repeat in `nvrs`. Every caller still gets its own
+        ContainerImage instance, so it can be resolved or modified without
+        affecting the other callers.
+
+        :param list nvrs: List of NVRs to resolve.
+        :param bool published: whether to limit queries to published images
+        :param bool include_rpm_manifest: When True, the rpm_manifest is
+            included in the returned ContainerImages.
+        :return: List with the ContainerImage for each NVR from `nvrs` at the
+            same position. None is used for NVRs not found in LightBlue.
+        :rtype: list
+        """
+        unique_nvrs = list(dict.fromkeys(nvrs))
+        if not unique_nvrs:
+            return []
+
+        nvr_to_image = {
+            image.nvr: image for image in self.get_images_by_nvrs(
+                unique_nvrs, published=published,
+                include_rpm_manifest=include_rpm_manifest)
+        }
+
+        ret = []
+        returned_nvrs = set()
+        for nvr in nvrs:
+            image = nvr_to_image.get(nvr)
+            if image is not None and nvr in returned_nvrs:
+                image = copy.deepcopy(image)
+            returned_nvrs.add(nvr)
+            ret.append(image)
+        return ret
+
     def get_images_by_brew_package(self, names):
         """
         Query Lightblue to get all the images for a specific list of names.
@@ -1201,6 +2111,159 @@ class LightBlue(object):
         images.append(parent_image)
         return self.find_parent_images_with_package(parent_image, rpm_name, images)
 
+    def _find_parent_chains(self, images, rpm_names):
+        """
+        Finds the chains of parent images containing the RPMs for all the
+        `images`.
+
+        :param list images: List of resolved ContainerImages to find the
+            parent images for.
+        :param list rpm_names: List of binary RPM names.
+        :return: a list of chains as generated by `_iter_parent_chains`.
+        :rtype: list
+        """
+        return list(self._iter_parent_chains(images, rpm_names))
+
+    def _iter_parent_chains(self, images, rpm_names):
+        """
+        Generates the chains of parent images containing the RPMs for all the
+        `images`.
+
+        This is a breadth-first variant of calling
+        `find_parent_images_with_package` for every image and RPM name. All
+        the chains are advanced by one layer at a time. In every layer, the
+        parent NVRs are deduplicated, queried in a single batched query and
+        every parent is resolved only once, even when it is shared by many
+        chains. The parent images are therefore shared between the chains.
+
+        The chains of single image for different RPM names are all prefixes
+        of the same path of parent images, so only this path and the length
+        of chain for every RPM name are kept in memory for every image. The
+        chains of the image are generated as soon as the chains of the image
+        and of all the images before it are complete, so the memory needed
+        does not grow with the number of RPM names.
+
+        :param list images: List of resolved ContainerImages to find the
+            parent images for.
+        :param list rpm_names: List of binary RPM names.
+        :return: generator of chains, one for each image and RPM name the
+            image contains, in following format:
+            [
+                [child_image, parent_of_child_image, parent_of_parent, ...],
+                ...
+            ]
+            The chain which would be the same for more RPM names of single
+            image is generated just once.
+        :rtype: generator
+        """
+        rpm_names = list(dict.fromkeys(rpm_names))
+        # The (path, rpm_name_to_length) tuples for every image containing
+        # any of the RPMs. The path is the list of the image and the parent
+        # images found so far, the rpm_name_to_length maps the RPM name to
+        # the length of its chain or None if the chain is still growing.
+        leaves = []
+        for image in images:
+            image_rpm_names = get_rpm_names(image["rpm_manifest"][0]["rpms"])
+            rpm_name_to_length = {
+                rpm_name: None for rpm_name in rpm_names if rpm_name in image_rpm_names}
+            if rpm_name_to_length:
+                leaves.append(([image], rpm_name_to_length))
+
+        # Parent images found so far, None if the parent image is not in
+        # Lightblue.
+        nvr_to_parent = {}
+        # Names of the RPMs included in the parent images.
+        nvr_to_rpm_names = {}
+
+        def _resolve_parent(parent_and_path):
+            parent, path = parent_and_path
+            # In some cases, an image may not have its content sets defined. To
+            # circumvent this gap, we use the child images when calling
+            # resolve so their content sets can be used.
+            parent.resolve(self, path[1:] or [path[0]])
+
+        # Index of the first leaf whose chains have not been generated yet.
+        next_leaf_id = 0
+        active_leaf_ids = list(range(len(leaves)))
+        with ThreadPoolExecutor(
+                max_workers=conf.max_thread_workers,
+                initializer=_init_pool_thread) as executor:
+            while active_leaf_ids:
+                # The images at the end of paths are often shared, so find
+                # out the parent NVR just once for each of them.
+                children = {id(leaves[i][0][-1]): leaves[i][0][-1] for i in active_leaf_ids}
+                child_to_parent_nvr = dict(zip(
+                    children.keys(),
+                    executor.map(self.find_parent_brew_build_nvr_from_child,
+                                 children.values())))
+
+                # Query all the parents not seen in previous layers at once.
+                # Remember the first path which reached the parent, so its
+                # images can be used as children in resolve().
+                new_parent_nvrs = {}
+                for i in active_leaf_ids:
+                    path = leaves[i][0]
+                    parent_nvr = child_to_parent_nvr[id(path[-1])]
+                    if parent_nvr and parent_nvr not in nvr_to_parent:
+                        new_parent_nvrs.setdefault(parent_nvr, path)
+                if new_parent_nvrs:
+                    parents = self.get_images_by_nvrs(
+                        list(new_parent_nvrs.keys()), published=None)
+                    ContainerImage.prefetch_koji_data([parent.nvr for parent in parents])
+                    list(executor.map(
+                        _resolve_parent,
+                        [(parent, new_parent_nvrs[parent.nvr]) for parent in parents]))
+                    for parent in parents:
+                        nvr_to_parent[parent.nvr] = parent
+                        nvr_to_rpm_names[parent.nvr] = get_rpm_names(
+                            parent.get_rpms() or [])
+                    for parent_nvr in new_parent_nvrs.keys():
+                        nvr_to_parent.setdefault(parent_nvr, None)
+
+                next_active_leaf_ids = []
+                for i in active_leaf_ids:
+                    path, rpm_name_to_length = leaves[i]
+                    child = path[-1]
+                    parent_nvr = child_to_parent_nvr[id(child)]
+                    # We've reached the base image when there is no parent_nvr.
+                    parent = nvr_to_parent[parent_nvr] if parent_nvr else None
+                    if parent_nvr and not parent and len(path) > 1:
+                        err = "Couldn't find parent image %s. Lightblue data is probably incomplete" % (
+                            parent_nvr)
+                        log.error(err)
+                        if not child.get('error'):
+                            child['error'] = err
+                        child['parent'] = None
+
+                    # Even if the parent image does not contain the package,
+                    # we still want to set the parent of the last image with
+                    # the package so we know against which image it has been
+                    # built.
+                    if parent:
+                        child['parent'] = parent
+                    growing = False
+                    for rpm_name, length in rpm_name_to_length.items():
+                        if length is not None:
+                            continue
+                        if parent and rpm_name in nvr_to_rpm_names[parent_nvr]:
+                            growing = True
+                        else:
+                            rpm_name_to_length[rpm_name] = len(path)
+                    if growing:
+                        path.append(parent)
+                        next_active_leaf_ids.append(i)
+                active_leaf_ids = next_active_leaf_ids
+
+                # Generate the chains of the complete leaves in the original
+                # order of images and RPM names.
+                while (next_leaf_id < len(leaves) and
+                       None not in leaves[next_leaf_id][1].values()):
+                    path, rpm_name_to_length = leaves[next_leaf_id]
+                    leaves[next_leaf_id] = None
+                    next_leaf_id += 1
+                    for length in dict.fromkeys(rpm_name_to_length.values()):
+                        yield path[:length]
+
     def find_images_with_packages_from_content_set(
             self, rpm_nvrs, content_sets, filter_fnc=None, published=True,
             release_categories=conf.lightblue_release_categories,
@@ -1277,7 +2340,10 @@ class LightBlue(object):
             image["directly_affected"] = True
             return image
 
-        with ThreadPoolExecutor(max_workers=conf.max_thread_workers) as executor:
+        ContainerImage.prefetch_koji_data([image.nvr for image in images])
+        with ThreadPoolExecutor(
+                max_workers=conf.max_thread_workers,
+                initializer=_init_pool_thread) as executor:
             return list(executor.map(_resolve_image, images))
 
     def _deduplicate_images_to_rebuild(self, to_rebuild):
@@ -1299,136 +2365,10 @@ class LightBlue(object):
         occurrence in a list, because the NVR is higher than NVR of foo-1-2.
         The foo-2-2 will be kept unchanged in a list, because it is the
         single record for the foo image in version 2.
-        """
 
-        # We need to deduplicate images in two phases:
-        #
-        # 1) "handle_parent_change" - During this phase, we find out if update
-        #    to latest image changes also the parent images.
-        #    For example, foo-1-1 can be built against x-1-1, but foo-1-2 can
-        #    be built against y-1-1. If we simply replace "foo-1-1" by "foo-1-2"
-        #    while keeping the original parent image, the "foo-1-2" will be built
-        #    against x-1-1 instead of y-1-1. This would be wrong.
-        #
-        #    To fix that, we therefore find out that the parent image changed in
-        #    the latest release of foo-1-2 and we replace also the parent images
-        #    according to latest release foo-1-2.
-        #
-        # 2) "update_to_latest". During this phase, we simply find out old releases
-        #    of images in `to_rebuild` and update them to latest released NVR.
-        for phase in ["handle_parent_change", "update_to_latest"]:
-            # Temporary dict mapping the NVR of image to coordinates in the
-            # `to_rebuild` list. For example
-            # nvr_to_coordinates["nvr"] = [[0, 3], ...] means that the image with
-            # nvr "nvr" is 4th image in the to_rebuild[0] list, ...
-            nvr_to_coordinates = {}
-            # Temporary dict mapping the NV-repository_key to list of NVRs.
-            # The List of NVRs is always sorted descending.
-            image_group_to_nvrs = {}
-            # Temporary dict mapping the NVR to image.
-            nvr_to_image = {}
-            # Temporary dict mapping image_group to latest released NVR for that image_group.
-            image_group_to_latest_released_nvr = {}
-
-            # Constructs the temporary dicts as described above.
-            for image_id, images in enumerate(to_rebuild):
-                for parent_id, image in enumerate(images):
-                    image_group = self.describe_image_group(image)
-
-                    image_group_to_nvrs.setdefault(image_group, [])
-                    if image.nvr not in image_group_to_nvrs[image_group]:
-                        image_group_to_nvrs[image_group].append(image.nvr)
-
-                    nvr_to_coordinates.setdefault(image.nvr, []).append([image_id, parent_id])
-                    nvr_to_image[image.nvr] = image
-
-                    if image.get("latest_released"):
-                        image_group_to_latest_released_nvr[image_group] = image.nvr
-
-            # Sort the lists in image_group_to_nvrs dict.
-            for image_group in image_group_to_nvrs.keys():
-                image_group_to_nvrs[image_group] = sorted_by_nvr(image_group_to_nvrs[image_group], reverse=True)
-
-                # There might be container image NVRs which are not released yet,
-                # but some released image is already built on top of them.
-                # The issue is that such unreleased container image won't be in
-                # its containerRepository and therefore won't have proper
-                # content_sets set.
-                # In this case, we copy the content_sets from the released image.
-                # This might bring issue in case the content_sets changed
-                # dramatically between released and unreleased release of such
-                # image, but it's still the best guess we can do.
-                # This is also used only as fallback in case "content_sets.yml"
-                # does not exists in the dist-git repo, which should be rare
-                # situation.
-                latest_content_sets = []
-                for nvr in reversed(image_group_to_nvrs[image_group]):
-                    image = nvr_to_image[nvr]
-                    if not image.get("content_sets") or "content_sets_source" not in image:
-                        image["content_sets"] = latest_content_sets
-                    elif image["content_sets_source"] == "child_image":
-                        if latest_content_sets:
-                            image["content_sets"] = latest_content_sets
-                    else:
-                        latest_content_sets = image["content_sets"]
-
-            # Iterate through list of NVs.
-            for image_group, nvrs in image_group_to_nvrs.items():
-                # We want to replace NVRs which are lower than the latest released
-                # NVR with latest released NVR. If there are some higher NVRs, we
-                # want to keep them, because we don't want to rebuild the image
-                # against older NVR than the one it is currently built against.
-                if image_group in image_group_to_latest_released_nvr:
-                    latest_released_nvr = image_group_to_latest_released_nvr[image_group]
-                else:
-                    latest_released_nvr = nvrs[0]
-
-                # The latest_released_nvr_index points to the latest released NVR
-                # in the `nvrs` list. Because `nvrs` list is desc sorted, every NVR
-                # with higher index is lower and therefore we need to replace it.
-                if not conf.lightblue_released_dependencies_only:
-                    latest_released_nvr_index = nvrs.index(latest_released_nvr)
-                else:
-                    # In case we want to use only released versions of images,
-                    # replace all the images with the latest released one.
-                    latest_released_nvr_index = -1
-
-                if phase == "handle_parent_change":
-                    # Find out the name of parent image of latest release image.
-                    latest_image = nvr_to_image[latest_released_nvr]
-                    if not latest_image.get("parent"):
-                        continue
-                    latest_parent_nvr_dict = koji.parse_NVR(latest_image["parent"].nvr)
-                    latest_parent_name = latest_parent_nvr_dict["name"]
-                    latest_parent_version = latest_parent_nvr_dict["version"]
-
-                    # Go through the older images and in case the parent image differs,
-                    # update its parents according to latest image parents.
-                    for nvr in nvrs[latest_released_nvr_index + 1:]:
-                        image = nvr_to_image[nvr]
-                        if not image.get("parent"):
-                            continue
-                        parent_nvr_dict = koji.parse_NVR(image["parent"].nvr)
-                        parent_name = parent_nvr_dict["name"]
-                        parent_version = parent_nvr_dict["version"]
-                        if (parent_name, parent_version) != (latest_parent_name, latest_parent_version):
-                            for image_id, parent_id in nvr_to_coordinates[nvr]:
-                                latest_image_id, latest_parent_id = nvr_to_coordinates[latest_released_nvr][0]
-                                to_rebuild[image_id][parent_id:] = to_rebuild[latest_image_id][latest_parent_id:]
-                elif phase == "update_to_latest":
-                    for nvr in nvrs[latest_released_nvr_index + 1:]:
-                        for image_id, parent_id in nvr_to_coordinates[nvr]:
-                            # At first replace the image in to_rebuild based
-                            # on the coordinates from temp dict.
-                            to_rebuild[image_id][parent_id] = nvr_to_image[latest_released_nvr]
-
-                            # And in case this image is not the the leaf image, also replace
-                            # the ["parent"] record for the child image to point to the image
-                            # with highest NVR.
-                            if parent_id != 0:
-                                to_rebuild[image_id][parent_id - 1]["parent"] = nvr_to_image[latest_released_nvr]
-
-        return to_rebuild
+        See `ImageChainsDeduplicator` for the details.
+        """
+        return ImageChainsDeduplicator(self, to_rebuild).deduplicate()
 
     # Cache to avoid multiple calls. We want one call per nvr, not one per arch
     @region.cache_on_arguments(to_str=lambda image: image.nvr)
@@ -1530,53 +2470,18 @@ class LightBlue(object):
 
         rpm_names = [koji.parse_NVR(rpm_nvr)["name"] for rpm_nvr in rpm_nvrs]
 
-        def _get_images_to_rebuild(image):
-            """
-            Find out parent images to rebuild, helper called from threadpool.
-            """
-            rebuild_list = {}  # per binary rpm name rebuild list.
-            for rpm_name in rpm_names:
-                for rpm in image["rpm_manifest"][0]["rpms"]:
-                    if rpm["name"] == rpm_name:
-                        break
-                else:
-                    # This `rpm_name` is not in image.
-                    continue
-
-                rebuild_list[rpm_name] = self.find_parent_images_with_package(
-                    image, rpm_name, [])
-                if rebuild_list[rpm_name]:
-                    image['parent'] = rebuild_list[rpm_name][0]
-                else:
-                    parent_brew_build = self.find_parent_brew_build_nvr_from_child(image)
-                    if parent_brew_build:
-                        parent = self.get_images_by_nvrs([parent_brew_build], published=None)
-                        if parent:
-                            parent = parent[0]
-                            parent.resolve(self, images)
-                            image['parent'] = parent
-                rebuild_list[rpm_name].insert(0, image)
-            return rebuild_list
-
         # For every image, find out all its parent images which contain the
-        # binary rpm package and store these lists to to_rebuild.
-        to_rebuild = []
-        optimization_base = 50
-        with ThreadPoolExecutor(max_workers=conf.max_thread_workers) as executor:
-            for result in executor.map(_get_images_to_rebuild, images):
-                to_rebuild.extend(result.values())
-                # Memory consumption of fully constructed to_rebuild list could
-                # be large. To prevent this we will periodically use
-                # deduplication on the list to reduce it size.
-                if len(to_rebuild) > optimization_base:
-                    self._deduplicate_images_to_rebuild(to_rebuild)
-                    optimization_base += 50
-        # The to_rebuild list now contains all the images which need to be
-        # rebuilt, but there are lot of duplicates there.
+        # binary rpm package. The chains are indexed for the deduplication as
+        # they are generated, so they are not collected in another list.
+        deduplicator = ImageChainsDeduplicator(self)
+        for chain in self._iter_parent_chains(images, rpm_names):
+            deduplicator.add(chain)
+        # The chains now contain all the images which need to be rebuilt,
+        # but there are lot of duplicates there.
 
         # At first remove duplicated images which share the same name and
         # version, but different release.
-        to_rebuild = self._deduplicate_images_to_rebuild(to_rebuild)
+        to_rebuild = deduplicator.deduplicate()
         # Get all the directly affected images so that any parents that are not marked as
         # directly affected can be set in _images_to_rebuild_to_batches
         # And in addition mark all latest EUS images as directly affected so
@@ -29,6 +29,7 @@ from flask.cli import FlaskGroup
 from werkzeug.serving import run_simple
 from freshmaker import app, conf, db
 from freshmaker import models
+from freshmaker.types import ArtifactType
 
 migrations_dir = os.path.join(os.path.abspath(os.path.dirname(__file__)),
                               'migrations')
@@ -89,6 +90,27 @@ def cleardb():
     db.session.commit()
 
 
+@cli.command('prewarmkojicache')
+@click.option('-n', '--events', type=int, default=100,
+              help='Number of the latest events to take the NVRs from')
+def prewarmkojicache(events):
+    """ Fetches the Koji build metadata of the container images planned
+    in the latest events to the Koji cache
+    """
+    from freshmaker.lightblue import ContainerImage
+
+    event_ids = db.session.query(models.Event.id).order_by(
+        models.Event.id.desc()).limit(events)
+    query = db.session.query(models.ArtifactBuild.original_nvr).filter(
+        models.ArtifactBuild.type == ArtifactType.IMAGE.value,
+        models.ArtifactBuild.event_id.in_(event_ids.subquery()),
+        models.ArtifactBuild.original_nvr.isnot(None)).distinct()
+    nvrs = [nvr for nvr, in query]
+    cached = ContainerImage.prewarm_koji_cache(nvrs)
+    logging.info('Cached Koji build metadata of %d out of %d builds',
+                 cached, len(nvrs))
+
+
 @cli.command('gencert')
 def generatelocalhostcert():
     """ Creates a public/private key pair for message signing and the frontend
@@ -0,0 +1,35 @@
+"""Add indexes for the frequent ArtifactBuild and Event lookups
+
+Revision ID: b5935fe5b796
+Revises: fcba8824bf8d
+Create Date: 2021-02-15 10:12:31.523109
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'b5935fe5b796'
+down_revision = 'fcba8824bf8d'
+
+from alembic import op
+
+
+INDEXES = [
+    ('idx_event_search_key_event_type_id', 'events', ['search_key', 'event_type_id']),
+    ('idx_event_released_state', 'events', ['released', 'state']),
+    ('idx_artifact_build_build_id_type', 'artifact_builds', ['build_id', 'type']),
+    ('idx_artifact_build_dep_on_id_state', 'artifact_builds', ['dep_on_id', 'state']),
+    ('idx_artifact_build_event_id_original_nvr_state', 'artifact_builds',
+     ['event_id', 'original_nvr', 'state']),
+    ('idx_artifact_build_rebuilt_nvr', 'artifact_builds', ['rebuilt_nvr']),
+    ('idx_artifact_build_state_build_id', 'artifact_builds', ['state', 'build_id']),
+]
+
+
+def upgrade():
+    for name, table, columns in INDEXES:
+        op.create_index(name, table, columns, unique=False)
+
+
+def downgrade():
+    for name, table, _ in reversed(INDEXES):
+        op.drop_index(name, table_name=table)
@@ -28,7 +28,9 @@ import json
 
 from collections import defaultdict
 from datetime import datetime
-from sqlalchemy.orm import (validates, relationship)
+from sqlalchemy import func, or_
+from sqlalchemy.orm import (
+    validates, relationship, joinedload, selectinload)
 from sqlalchemy.schema import Index
 from sqlalchemy.sql.expression import false
 
@@ -316,24 +318,18 @@ class Event(FreshmakerBase):
         """
         Returns the list of Events this Event depends on.
         """
-        events = []
-        deps = EventDependency.query.filter_by(event_id=self.id).all()
-        for dep in deps:
-            events.append(Event.query.filter_by(
-                id=dep.event_dependency_id).first())
-        return events
+        return Event.query.join(
+            EventDependency, EventDependency.event_dependency_id == Event.id,
+        ).filter(EventDependency.event_id == self.id).order_by(EventDependency.id).all()
 
     @property
     def depending_events(self):
         """
         Returns the list of Events depending on this Event.
         """
-        depending_events = []
-        parents = EventDependency.query.filter_by(event_dependency_id=self.id).all()
-        for p in parents:
-            depending_events.append(Event.query.filter_by(
-                id=p.event_id).first())
-        return depending_events
+        return Event.query.join(
+            EventDependency, EventDependency.event_id == Event.id,
+        ).filter(EventDependency.event_dependency_id == self.id).order_by(EventDependency.id).all()
 
     def has_all_builds_in_state(self, state):
         """
@@ -420,22 +416,92 @@ class Event(FreshmakerBase):
         return json.loads(self.requester_metadata)
 
     def json(self):
-        data = self._common_json()
-        data['builds'] = [b.json() for b in self.builds]
-        return data
+        return Event.json_many([self])[0]
 
     def json_min(self):
-        builds_summary = defaultdict(int)
-        builds_summary['total'] = len(self.builds.all())
-        for build in self.builds:
-            state_name = ArtifactBuildState(build.state).name
-            builds_summary[state_name] += 1
+        return Event.json_min_many([self])[0]
 
-        data = self._common_json()
-        data['builds_summary'] = dict(builds_summary)
-        return data
+    @classmethod
+    def json_many(cls, events):
+        """
+        Returns the list of JSON representations of `events` including
+        their builds. The builds and the event dependencies of all the
+        events are loaded at once instead of event by event.
 
-    def _common_json(self):
+        :param list events: List of Events.
+        :rtype: list
+        """
+        if not events:
+            return []
+        dependencies = cls._get_dependencies_ids(events)
+
+        builds = defaultdict(list)
+        query = db.session.query(ArtifactBuild).filter(
+            ArtifactBuild.event_id.in_([event.id for event in events]),
+        ).options(*ArtifactBuild.json_load_options()).order_by(ArtifactBuild.id)
+        for build in query:
+            builds[build.event_id].append(build)
+
+        ret = []
+        for event in events:
+            data = event._common_json(*dependencies[event.id])
+            data['builds'] = [b.json() for b in builds[event.id]]
+            ret.append(data)
+        return ret
+
+    @classmethod
+    def json_min_many(cls, events):
+        """
+        Returns the list of minimal JSON representations of `events` with
+        the summary of their builds states. The summaries of all the events
+        are computed by single aggregate query.
+
+        :param list events: List of Events.
+        :rtype: list
+        """
+        if not events:
+            return []
+        dependencies = cls._get_dependencies_ids(events)
+
+        summaries = defaultdict(lambda: {'total': 0})
+        query = db.session.query(
+            ArtifactBuild.event_id, ArtifactBuild.state, func.count(ArtifactBuild.id),
+        ).filter(
+            ArtifactBuild.event_id.in_([event.id for event in events]),
+        ).group_by(ArtifactBuild.event_id, ArtifactBuild.state)
+        for event_id, state, count in query:
+            summary = summaries[event_id]
+            summary['total'] += count
+            summary[ArtifactBuildState(state).name] = count
+
+        ret = []
+        for event in events:
+            data = event._common_json(*dependencies[event.id])
+            data['builds_summary'] = dict(summaries[event.id])
+            ret.append(data)
+        return ret
+
+    @classmethod
+    def _get_dependencies_ids(cls, events):
+        """
+        Returns dict with Event id as a key and tuple with list of ids of
+        events it depends on and list of ids of events depending on it
+        as a value.
+        """
+        ids = [event.id for event in events]
+        dependencies = defaultdict(lambda: ([], []))
+        query = db.session.query(
+            EventDependency.event_id, EventDependency.event_dependency_id,
+        ).filter(or_(
+            EventDependency.event_id.in_(ids),
+            EventDependency.event_dependency_id.in_(ids),
+        )).order_by(EventDependency.id)
+        for event_id, event_dependency_id in query:
+            dependencies[event_id][0].append(event_dependency_id)
+            dependencies[event_dependency_id][1].append(event_id)
+        return dependencies
+
+    def _common_json(self, depends_on_events, depending_events):
         event_url = get_url_for('event', id=self.id)
         db.session.add(self)
         return {
@@ -454,8 +520,8 @@ class Event(FreshmakerBase):
             "requested_rebuilds": (self.requested_rebuilds.split(" ")
                                    if self.requested_rebuilds else []),
             "requester_metadata": self.requester_metadata_json,
-            "depends_on_events": [event.id for event in self.event_dependencies],
-            "depending_events": [event.id for event in self.depending_events],
+            "depends_on_events": depends_on_events,
+            "depending_events": depending_events,
         }
 
     def find_dependent_events(self):
@@ -507,8 +573,55 @@ class Event(FreshmakerBase):
             if parent_build:
                 return parent_build
 
+    def get_artifact_builds_from_event_dependencies(self, nvrs):
+        """
+        Bulk variant of `get_artifact_build_from_event_dependencies`.
+
+        Returns dict with `original_nvr` as a key and list of artifact builds,
+        with `DONE` state, from the first event dependency having any such
+        build as a value. NVRs not built in any event dependency are not
+        included in the returned dict.
+
+        :param list nvrs: List of original NVRs to look for.
+        :rtype: dict
+        """
+        dep_event_ids = [
+            row[0] for row in db.session.query(
+                EventDependency.event_dependency_id).filter_by(
+                    event_id=self.id).order_by(EventDependency.id)]
+        nvrs = sorted(set(nvrs))
+        if not dep_event_ids or not nvrs:
+            return {}
+
+        # {original_nvr: {event_id: [ArtifactBuild, ...]}}
+        found = defaultdict(lambda: defaultdict(list))
+        # Keep the number of bound parameters in the query within the limits
+        # of all the supported databases.
+        chunk_size = 500
+        for i in range(0, len(nvrs), chunk_size):
+            builds = db.session.query(ArtifactBuild).filter(
+                ArtifactBuild.event_id.in_(dep_event_ids),
+                ArtifactBuild.original_nvr.in_(nvrs[i:i + chunk_size]),
+                ArtifactBuild.state == ArtifactBuildState.DONE.value,
+            ).order_by(ArtifactBuild.id)
+            for build in builds:
+                found[build.original_nvr][build.event_id].append(build)
+
+        ret = {}
+        for nvr, builds_by_event in found.items():
+            for event_id in dep_event_ids:
+                if event_id in builds_by_event:
+                    ret[nvr] = builds_by_event[event_id]
+                    break
+        return ret
+
 
 Index('idx_event_message_id', Event.message_id, unique=True)
+# Used to find the event of particular type by its search key
+# (for example when handling advisory state changes).
+Index('idx_event_search_key_event_type_id', Event.search_key, Event.event_type_id)
+# Used to find the unreleased events in particular states.
+Index('idx_event_released_state', Event.released, Event.state)
 
 
 class EventDependency(FreshmakerBase):
@@ -701,6 +814,17 @@ class ArtifactBuild(FreshmakerBase):
             self.name, ArtifactType(self.type).name,
             ArtifactBuildState(self.state).name, self.event.message_id)
 
+    @staticmethod
+    def json_load_options():
+        """
+        Returns the query options to eagerly load all the relationships
+        needed by `ArtifactBuild.json()`.
+        """
+        return [
+            joinedload(ArtifactBuild.dep_on),
+            selectinload(ArtifactBuild.composes).joinedload(ArtifactBuildCompose.compose),
+        ]
+
     def json(self):
         build_args = {}
         if self.build_args:
@@ -719,7 +843,7 @@ class ArtifactBuild(FreshmakerBase):
             "state_name": ArtifactBuildState(self.state).name,
             "state_reason": self.state_reason,
             "dep_on": self.dep_on.name if self.dep_on else None,
-            "dep_on_id": self.dep_on.id if self.dep_on else None,
+            "dep_on_id": self.dep_on_id,
             "time_submitted": _utc_datetime_to_iso(self.time_submitted),
             "time_completed": _utc_datetime_to_iso(self.time_completed),
             "event_id": self.event_id,
@@ -752,6 +876,20 @@ class ArtifactBuild(FreshmakerBase):
         return all((rel.compose.finished for rel in self.composes))
 
 
+# Used to find the ArtifactBuild by the id of the Koji build.
+Index('idx_artifact_build_build_id_type', ArtifactBuild.build_id, ArtifactBuild.type)
+# Used to find the builds depending on particular ArtifactBuild.
+Index('idx_artifact_build_dep_on_id_state', ArtifactBuild.dep_on_id, ArtifactBuild.state)
+# Used to find the builds of particular NVR built in the dependant events.
+# This index is also used by the lookups of all the builds of an Event.
+Index('idx_artifact_build_event_id_original_nvr_state',
+      ArtifactBuild.event_id, ArtifactBuild.original_nvr, ArtifactBuild.state)
+# Used to find the ArtifactBuild by the NVR of the rebuilt artifact.
+Index('idx_artifact_build_rebuilt_nvr', ArtifactBuild.rebuilt_nvr)
+# Used to find the builds in particular states when polling Koji.
+Index('idx_artifact_build_state_build_id', ArtifactBuild.state, ArtifactBuild.build_id)
+
+
 class Compose(FreshmakerBase):
     __tablename__ = 'composes'
 
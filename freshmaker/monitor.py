@@ -123,12 +123,46 @@ freshmaker_event_canceled_counter = Counter(
     'Number of events canceled during their handling',
     registry=registry)
 
+freshmaker_lightblue_pool_hit_counter = Counter(
+    'freshmaker_lightblue_pool_hit',
+    'Number of LightBlue requests which reused a keep-alive connection',
+    registry=registry)
+freshmaker_lightblue_pool_miss_counter = Counter(
+    'freshmaker_lightblue_pool_miss',
+    'Number of LightBlue requests which had to open a new connection',
+    registry=registry)
+freshmaker_image_resolve_cache_hit_counter = Counter(
+    'freshmaker_image_resolve_cache_hit',
+    'Number of container images resolved from the per-event cache',
+    registry=registry)
+freshmaker_image_resolve_cache_miss_counter = Counter(
+    'freshmaker_image_resolve_cache_miss',
+    'Number of container images resolved by querying Koji and LightBlue',
+    registry=registry)
+
+freshmaker_koji_tasks_checked_counter = Counter(
+    'freshmaker_koji_tasks_checked',
+    'Number of Koji tasks checked by the poller',
+    registry=registry)
+
+freshmaker_api_response_cache_hit_counter = Counter(
+    'freshmaker_api_response_cache_hit',
+    'Number of API responses served from the response cache',
+    registry=registry)
+freshmaker_api_response_cache_miss_counter = Counter(
+    'freshmaker_api_response_cache_miss',
+    'Number of API responses which had to be built for the response cache',
+    registry=registry)
+
 freshmaker_build_api_latency = Histogram(
     'build_api_latency',
     'BuildAPI latency', registry=registry)
 freshmaker_event_api_latency = Histogram(
     'event_api_latency',
     'EventAPI latency', registry=registry)
+freshmaker_koji_poll_duration = Histogram(
+    'koji_poll_duration',
+    'Duration of checking the unfinished Koji tasks', registry=registry)
 
 
 def db_hook_event_listeners(target=None):
@@ -30,6 +30,8 @@ from freshmaker.types import EventState, ArtifactBuildState
 from freshmaker.kojiservice import koji_service
 from freshmaker.events import BrewContainerTaskStateChangeEvent
 from freshmaker.consumer import work_queue_put
+from freshmaker.monitor import (
+    freshmaker_koji_poll_duration, freshmaker_koji_tasks_checked_counter)
 
 from sqlalchemy.exc import StatementError
 
@@ -50,26 +52,32 @@ class FreshmakerProducer(PollingProducer):
         log.info('Poller will now sleep for "{}" seconds'
                  .format(conf.polling_interval))
 
+    @freshmaker_koji_poll_duration.time()
     def check_unfinished_koji_tasks(self, session):
         stale_date = datetime.utcnow() - timedelta(days=7)
-        db_events = session.query(models.Event).filter(
+        builds = session.query(
+            models.ArtifactBuild.name, models.ArtifactBuild.build_id).join(
+                models.Event).filter(
             models.Event.state == EventState.BUILDING.value,
-            models.Event.time_created >= stale_date).all()
+            models.Event.time_created >= stale_date,
+            models.ArtifactBuild.state == ArtifactBuildState.BUILD.value,
+            models.ArtifactBuild.build_id > 0).order_by(
+                models.ArtifactBuild.id).all()
+        if not builds:
+            return
 
-        for db_event in db_events:
-            for build in db_event.builds:
-                if build.state != ArtifactBuildState.BUILD.value:
-                    continue
-                if build.build_id <= 0:
-                    continue
-                with koji_service(
-                        conf.koji_profile, log, login=False) as koji_session:
-                    task = koji_session.get_task_info(build.build_id)
-                    task_states = {v: k for k, v in koji.TASK_STATES.items()}
-                    new_state = task_states[task["state"]]
-                    if new_state not in ["FAILED", "CLOSED"]:
-                        continue
-                    event = BrewContainerTaskStateChangeEvent(
-                        "fake event", build.name, None, None, build.build_id,
-                        "BUILD", new_state)
-                    work_queue_put(event)
+        with koji_service(
+                conf.koji_profile, log, login=False) as koji_session:
+            tasks = koji_session.get_tasks_info(
+                [build_id for _, build_id in builds])
+        freshmaker_koji_tasks_checked_counter.inc(len(builds))
+
+        task_states = {v: k for k, v in koji.TASK_STATES.items()}
+        for (name, build_id), task in zip(builds, tasks):
+            new_state = task_states[task["state"]]
+            if new_state not in ["FAILED", "CLOSED"]:
+                continue
+            event = BrewContainerTaskStateChangeEvent(
+                "fake event", name, None, None, build_id,
+                "BUILD", new_state)
+            work_queue_put(event)
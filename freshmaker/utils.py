@@ -21,24 +21,114 @@
 #
 
 import functools
+import re
 import requests
 import subprocess
 import sys
 import tempfile
+import threading
 import time
 import koji
 import kobo.rpmlib
+from collections import namedtuple
 
 from freshmaker import conf, app, log
 from freshmaker.types import ArtifactType
 from flask import has_app_context, url_for
 
 
-def _cmp(a, b):
+# Ranks of the version segments compared by rpmvercmp(), the "~" sorts before
+# everything else including the end of the version, the "^" sorts after the
+# end of the version, but before any other segment, numeric segments are
+# always newer than alpha segments.
+_RPMVERCMP_TILDE = (0,)
+_RPMVERCMP_END = (1,)
+_RPMVERCMP_CARET = (2,)
+_RPMVERCMP_ALPHA = 3
+_RPMVERCMP_NUMERIC = 4
+
+# Only ASCII letters and digits form the segments, everything else except
+# of "~" and "^" is a separator.
+_RPMVERCMP_SEGMENT_RE = re.compile(r"([0-9]+)|([a-zA-Z]+)|(~)|(\^)")
+
+
+@functools.lru_cache(maxsize=16384)
+def rpmvercmp_key(version):
     """
-    Replacement for cmp() in Python 3.
+    Returns the sort key for version or release string ordering it the
+    same way as rpmvercmp() used by `kobo.rpmlib.compare_nvr`.
+
+    :param str version: Version, release or epoch string.
+    :rtype: tuple
     """
-    return (a > b) - (a < b)
+    key = []
+    for match in _RPMVERCMP_SEGMENT_RE.finditer(version):
+        numeric, alpha, tilde, caret = match.groups()
+        if numeric is not None:
+            key.append((_RPMVERCMP_NUMERIC, int(numeric)))
+        elif alpha is not None:
+            key.append((_RPMVERCMP_ALPHA, alpha))
+        elif tilde is not None:
+            key.append(_RPMVERCMP_TILDE)
+        else:
+            key.append(_RPMVERCMP_CARET)
+    key.append(_RPMVERCMP_END)
+    return tuple(key)
+
+
+class NVR(namedtuple("NVR", ["name", "version", "release", "epoch"])):
+    """
+    Immutable parsed N-V-R returned by `parse_nvr()`.
+    """
+    __slots__ = ()
+
+    @property
+    def sort_key(self):
+        """
+        Key sorting the NVRs by name and then the same way as
+        `kobo.rpmlib.compare_nvr`.
+        """
+        return (self.name, rpmvercmp_key(self.epoch),
+                rpmvercmp_key(self.version), rpmvercmp_key(self.release))
+
+    @property
+    def version_release_key(self):
+        """
+        Key ordering the NVRs of the same name the same way as
+        `kobo.rpmlib.compare_nvr` with `ignore_epoch=True`.
+        """
+        return (rpmvercmp_key(self.version), rpmvercmp_key(self.release))
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_nvr(nvr):
+    """
+    Parses the N-V-R string using `kobo.rpmlib.parse_nvr`. The results
+    are cached, so parsing the same NVR again is cheap.
+
+    :param str nvr: N-V-R:E, E:N-V-R or N-E:V-R string.
+    :rtype: NVR
+    :raises ValueError: if the NVR is invalid.
+    """
+    parsed = kobo.rpmlib.parse_nvr(nvr)
+    return NVR(parsed["name"], parsed["version"], parsed["release"],
+               parsed["epoch"])
+
+
+@functools.lru_cache(maxsize=16384)
+def parse_nvra(nvra):
+    """
+    Parses the N-V-R.A string using `kobo.rpmlib.parse_nvra`. The results
+    are cached, so parsing the same NVRA again is cheap.
+
+    :param str nvra: N-V-R.A string in any format accepted by
+        `kobo.rpmlib.parse_nvra`.
+    :rtype: NVR
+    :raises ValueError: if the NVRA is invalid.
+    """
+    parsed = kobo.rpmlib.parse_nvra(nvra)
+    return NVR(parsed["name"], parsed["version"], parsed["release"],
+               parsed["epoch"])
 
 
 def sorted_by_nvr(lst, get_nvr=None, reverse=False):
@@ -52,25 +142,16 @@ def sorted_by_nvr(lst, get_nvr=None, reverse=False):
     :rtype: list
     :return: Sorted `lst`.
     """
-    def _compare_items(item1, item2):
+    def _get_sort_key(item):
         if get_nvr:
-            nvr1 = get_nvr(item1)
-            nvr2 = get_nvr(item2)
-        elif hasattr(item1, 'nvr') and hasattr(item2, 'nvr'):
-            nvr1 = item1.nvr
-            nvr2 = item2.nvr
+            nvr = get_nvr(item)
+        elif hasattr(item, 'nvr'):
+            nvr = item.nvr
         else:
-            nvr1 = item1
-            nvr2 = item2
-
-        nvr1_dict = kobo.rpmlib.parse_nvr(nvr1)
-        nvr2_dict = kobo.rpmlib.parse_nvr(nvr2)
-        if nvr1_dict["name"] != nvr2_dict["name"]:
-            return _cmp(nvr1_dict["name"], nvr2_dict["name"])
-        return kobo.rpmlib.compare_nvr(nvr1_dict, nvr2_dict)
+            nvr = item
+        return parse_nvr(nvr).sort_key
 
-    return sorted(
-        lst, key=functools.cmp_to_key(_compare_items), reverse=reverse)
+    return sorted(lst, key=_get_sort_key, reverse=reverse)
 
 
 def get_url_for(*args, **kwargs):
@@ -161,6 +242,39 @@ def retry(timeout=conf.net_timeout, interval=conf.net_retry_interval, wait_on=Ex
     return wrapper
 
 
+class RateLimiter(object):
+    """
+    Thread-safe limiter of the number of operations done per second.
+
+    Example::
+
+        limiter = RateLimiter(5)
+        for item in items:
+            limiter.wait()
+            process(item)
+    """
+
+    def __init__(self, rate):
+        """
+        :param float rate: maximum number of operations per second. When
+            0 or None, the rate is not limited.
+        """
+        self.interval = 1.0 / rate if rate else 0
+        self._lock = threading.Lock()
+        self._next_time = time.monotonic()
+
+    def wait(self):
+        """Blocks until the next operation is allowed to be done."""
+        if not self.interval:
+            return
+        with self._lock:
+            now = time.monotonic()
+            delay = self._next_time - now
+            self._next_time = max(now, self._next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+
 def _run_command(command, logger=None, rundir=None, output=subprocess.PIPE, error=subprocess.PIPE, env=None,
                  log_output=True):
     """Run a command, return output. Error out if command exit with non-zero code."""
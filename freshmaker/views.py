@@ -22,7 +22,8 @@
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
 import json
-from flask import request, jsonify
+from itertools import islice
+from flask import request, jsonify, Response, stream_with_context
 from flask.views import MethodView
 from flask import g
 
@@ -37,7 +38,13 @@ from freshmaker import log
 from freshmaker import events
 from freshmaker.api_utils import filter_artifact_builds
 from freshmaker.api_utils import filter_events
+from freshmaker.api_utils import query_artifact_builds
+from freshmaker.api_utils import query_events
 from freshmaker.api_utils import json_error
+from freshmaker.api_utils import response_cache
+from freshmaker.api_utils import conditional_json_response
+from freshmaker.api_utils import get_build_cache_validators
+from freshmaker.api_utils import get_event_cache_validators
 from freshmaker.api_utils import pagination_metadata
 from freshmaker.auth import login_required, requires_roles, require_scopes, user_has_role
 from freshmaker.parsers.internal.manual_rebuild import FreshmakerManualRebuildParser
@@ -163,59 +170,94 @@ api_v1 = {
     }
 }
 
+# Endpoints available only in the API version 2.
+api_v2 = {
+    'export_events': {
+        'export_events': {
+            'url': '/api/2/export/events',
+            'options': {
+                'methods': ['GET'],
+            }
+        },
+    },
+    'export_builds': {
+        'export_builds': {
+            'url': '/api/2/export/builds',
+            'options': {
+                'methods': ['GET'],
+            }
+        },
+    },
+    'verify_images': {
+        'verify_images': {
+            'url': '/api/2/verify-images',
+            'options': {
+                'methods': ['POST'],
+            }
+        },
+    },
+}
 
-class EventTypeAPI(MethodView):
-    def get(self, id):
-        event_types = []
-        for cls, val in models.EVENT_TYPES.items():
-            event_types.append({'name': cls.__name__, 'id': val})
-
-        if id is None:
-            return jsonify({'items': event_types}), 200
 
-        else:
-            event_type = [x for x in event_types if x['id'] == id]
+def _event_types_json(id=None):
+    event_types = []
+    for cls, val in models.EVENT_TYPES.items():
+        event_types.append({'name': cls.__name__, 'id': val})
+    return _enum_json(event_types, id)
 
-            if event_type:
-                return jsonify(event_type.pop()), 200
-            else:
-                return json_error(404, "Not Found", "No such event type found.")
 
+def _build_types_json(id=None):
+    build_types = []
+    for x in list(types.ArtifactType):
+        build_types.append({'name': x.name, 'id': x.value})
+    return _enum_json(build_types, id)
 
-class BuildTypeAPI(MethodView):
-    def get(self, id):
-        build_types = []
-        for x in list(types.ArtifactType):
-            build_types.append({'name': x.name, 'id': x.value})
 
-        if id is None:
-            return jsonify({'items': build_types}), 200
+def _build_states_json(id=None):
+    build_states = []
+    for x in list(types.ArtifactBuildState):
+        build_states.append({'name': x.name, 'id': x.value})
+    return _enum_json(build_states, id)
 
-        else:
-            build_type = [x for x in build_types if x['id'] == id]
 
-            if build_type:
-                return jsonify(build_type.pop()), 200
-            else:
-                return json_error(404, "Not Found", "No such build type found.")
+def _enum_json(items, id):
+    """
+    Returns the JSON with all the `items` when `id` is None, otherwise
+    the item with this `id` or None if there is no such item.
+    """
+    if id is None:
+        return {'items': items}
+    for item in items:
+        if item['id'] == id:
+            return item
+    return None
 
 
-class BuildStateAPI(MethodView):
+class EventTypeAPI(MethodView):
     def get(self, id):
-        build_states = []
-        for x in list(types.ArtifactBuildState):
-            build_states.append({'name': x.name, 'id': x.value})
+        response = response_cache.response(
+            ('event_types', id), lambda: _event_types_json(id))
+        if response is None:
+            return json_error(404, "Not Found", "No such event type found.")
+        return response
 
-        if id is None:
-            return jsonify({'items': build_states}), 200
 
-        else:
-            build_state = [x for x in build_states if x['id'] == id]
+class BuildTypeAPI(MethodView):
+    def get(self, id):
+        response = response_cache.response(
+            ('build_types', id), lambda: _build_types_json(id))
+        if response is None:
+            return json_error(404, "Not Found", "No such build type found.")
+        return response
 
-            if build_state:
-                return jsonify(build_state.pop()), 200
-            else:
-                return json_error(404, "Not Found", "No such build state found.")
+
+class BuildStateAPI(MethodView):
+    def get(self, id):
+        response = response_cache.response(
+            ('build_states', id), lambda: _build_states_json(id))
+        if response is None:
+            return json_error(404, "Not Found", "No such build state found.")
+        return response
 
 
 class EventAPI(MethodView):
@@ -248,7 +290,20 @@ class EventAPI(MethodView):
             - :ref:`id<event_id>`
             - :ref:`message_id<event_message_id>`
 
+        :query number after_id: Return only events following the event with this id
+            in the ``id`` or ``-id`` order. See :ref:`pagination_api_2`.
+        :query bool show_total: When ``False``, the total number of events is not
+            computed. See :ref:`pagination_api_2`.
+
+        Responses with a single event in a final state (``COMPLETE``,
+        ``FAILED``, ``SKIPPED`` or ``CANCELED``) contain the ``ETag`` header
+        and must be revalidated before every use, because the builds and
+        depending events of the event can still change. Events in other
+        states can be cached only for a short time.
+
         :statuscode 200: Requested events are returned.
+        :statuscode 304: Requested event has not been modified since the
+            ``If-None-Match`` request header.
         :statuscode 404: Freshmaker event not found.
         """
         # Boolean that is set to false if builds should not
@@ -270,21 +325,25 @@ class EventAPI(MethodView):
             }
 
             if not show_full_json:
-                json_data['items'] = [item.json_min() for item in p_query.items]
+                json_data['items'] = models.Event.json_min_many(p_query.items)
             else:
-                json_data['items'] = [item.json() for item in p_query.items]
+                json_data['items'] = models.Event.json_many(p_query.items)
 
             return jsonify(json_data), 200
 
         else:
-            event = models.Event.query.filter_by(id=id).first()
-            if event:
-                if not show_full_json:
-                    return jsonify(event.json_min()), 200
-                return jsonify(event.json()), 200
-            else:
+            variant = "full" if show_full_json else "min"
+            validators = get_event_cache_validators(id, variant)
+            if validators is None:
                 return json_error(404, "Not Found", "No such event found.")
 
+            def get_json():
+                event = models.Event.query.filter_by(id=id).first()
+                if not show_full_json:
+                    return event.json_min()
+                return event.json()
+            return conditional_json_response(*validators, get_json, revalidate=True)
+
     @login_required
     @requires_roles(['admin', 'manual_rebuilder'])
     def patch(self, id):
@@ -436,12 +495,14 @@ class BuildAPI(MethodView):
             return jsonify(json_data), 200
 
         else:
-            build = models.ArtifactBuild.query.filter_by(id=id).first()
-            if build:
-                return jsonify(build.json()), 200
-            else:
+            validators = get_build_cache_validators(id)
+            if validators is None:
                 return json_error(404, "Not Found", "No such build found.")
 
+            def get_json():
+                return models.ArtifactBuild.query.filter_by(id=id).first().json()
+            return conditional_json_response(*validators, get_json)
+
     @login_required
     @require_scopes('submit-build')
     @requires_roles(['admin', 'manual_rebuilder'])
@@ -631,18 +692,22 @@ class AsyncBuildAPI(MethodView):
         return jsonify(db_event.json()), 200
 
 
+def _about_json():
+    json = {'version': version}
+    config_items = ['auth_backend']
+    for item in config_items:
+        config_item = getattr(conf, item)
+        # All config items have a default, so if doesn't exist it is an error
+        if not config_item:
+            raise ValueError(
+                'An invalid config item of "{0}" was specified'.format(item))
+        json[item] = config_item
+    return json
+
+
 class AboutAPI(MethodView):
     def get(self):
-        json = {'version': version}
-        config_items = ['auth_backend']
-        for item in config_items:
-            config_item = getattr(conf, item)
-            # All config items have a default, so if doesn't exist it is an error
-            if not config_item:
-                raise ValueError(
-                    'An invalid config item of "{0}" was specified'.format(item))
-            json[item] = config_item
-        return jsonify(json), 200
+        return response_cache.response('about', _about_json)
 
 
 class VerifyImageAPI(MethodView):
@@ -744,6 +809,177 @@ class VerifyImageRepositoryAPI(MethodView):
         return jsonify(ret), 200
 
 
+class VerifyImagesAPI(MethodView):
+    def post(self):
+        """
+        Verifies whether the container images defined by the NVRs and
+        the container image repositories are handled by Freshmaker. If not,
+        returns explanation why for each of them.
+
+        The Lightblue is queried in batches for all the images and
+        repositories, so this is much faster than verifying them one by one.
+
+        **Sample request**:
+
+        .. sourcecode:: http
+
+            POST /api/2/verify-images HTTP/1.1
+            Accept: application/json
+
+            {
+                "images": ["foo-1-1", "bar-1-1"],
+                "repositories": ["foo/bar"]
+            }
+
+        **Sample response**:
+
+        .. sourcecode:: none
+
+            {
+                "images": {
+                    "foo-1-1": {
+                        "content_sets": [
+                            "content-set-1",
+                            "content-set-2"
+                        ]
+                    },
+                    "bar-1-1": {
+                        "error": "Cannot get repository for image bar-1-1 from Lightblue."
+                    }
+                },
+                "repositories": {
+                    "foo/bar": {
+                        "repository": {
+                            "auto_rebuild_tags": [
+                                "latest"
+                            ]
+                        },
+                        "images": {
+                            "foo-1-1": {
+                                "content_sets": [
+                                    "content-set-1",
+                                    "content-set-2"
+                                ],
+                                "tags": [
+                                    "latest",
+                                    "2.0"
+                                ]
+                            }
+                        }
+                    }
+                }
+            }
+
+        :jsonparam list images: NVRs of the container images to verify.
+        :jsonparam list repositories: Names of the container image
+            repositories to verify.
+        :statuscode 200: Images and repositories were verified.
+        :statuscode 400: Invalid request.
+        """
+        data = request.get_json(force=True)
+        if not isinstance(data, dict):
+            return json_error(400, 'Bad Request', 'Request must be a JSON object.')
+
+        for key in ('images', 'repositories'):
+            value = data.get(key, [])
+            if (
+                not isinstance(value, list) or
+                any(not isinstance(item, str) or not item for item in value)
+            ):
+                return json_error(
+                    400, 'Bad Request', f'"{key}" must be an array of strings.')
+
+        if not data.get('images') and not data.get('repositories'):
+            return json_error(
+                400, 'Bad Request', 'No images or repositories provided.')
+
+        verifier = ImageVerifier()
+        ret = verifier.verify_images(
+            data.get('images', []), data.get('repositories', []))
+        return jsonify(ret), 200
+
+
+def _stream_ndjson(query, serialize):
+    """
+    Returns the Flask streaming response with the objects returned by
+    `query` serialized as newline-delimited JSON.
+
+    The rows are fetched from the database in batches of
+    `conf.api_export_batch_size` rows, so the memory needed to export all
+    the objects does not depend on their number.
+
+    :param query: Query returning the objects to export.
+    :param serialize: Function returning iterable of JSON representations
+        of the list of objects.
+    """
+    batch_size = conf.api_export_batch_size
+    # Fail early in case of invalid query instead of returning 200 and
+    # breaking the stream.
+    rows = iter(query.yield_per(batch_size))
+    first_batch = list(islice(rows, batch_size))
+
+    def generate(batch):
+        while batch:
+            for data in serialize(batch):
+                yield json.dumps(data) + "\n"
+            batch = list(islice(rows, batch_size))
+
+    return Response(
+        stream_with_context(generate(first_batch)),
+        mimetype='application/x-ndjson')
+
+
+def _events_full_json(events):
+    """
+    Yields the JSON representations of `events` including their builds.
+
+    Single event can have thousands of builds, so the builds are loaded
+    event by event to keep the memory needed to export the batch of events
+    constant.
+    """
+    for event in events:
+        yield from models.Event.json_many([event])
+
+
+class EventExportAPI(MethodView):
+    def get(self):
+        """
+        Returns all the Freshmaker Events matching the query as
+        newline-delimited JSON, one Freshmaker Event JSON object per line.
+
+        It accepts the same filtering and ordering query parameters as
+        ``/api/2/events/``. The pagination query parameters are ignored.
+
+        :query bool show_full_json: When ``True``, the Freshmaker Event JSON
+            objects contain the builds. Default value is ``False``.
+
+        :statuscode 200: Requested events are returned.
+        :statuscode 400: Invalid query parameter is passed.
+        """
+        query = query_events(request)
+        if request.args.get('show_full_json') == 'True':
+            serialize = _events_full_json
+        else:
+            serialize = models.Event.json_min_many
+        return _stream_ndjson(query, serialize)
+
+
+class BuildExportAPI(MethodView):
+    def get(self):
+        """
+        Returns all the Freshmaker Artifact Builds matching the query as
+        newline-delimited JSON, one Artifact Build JSON object per line.
+
+        It accepts the same filtering and ordering query parameters as
+        ``/api/2/builds/``. The pagination query parameters are ignored.
+
+        :statuscode 200: Requested builds are returned.
+        :statuscode 400: Invalid query parameter is passed.
+        """
+        query = query_artifact_builds(request)
+        return _stream_ndjson(query, lambda builds: [b.json() for b in builds])
+
+
 API_V1_MAPPING = {
     'events': EventAPI,
     'builds': BuildAPI,
@@ -756,6 +992,12 @@ API_V1_MAPPING = {
     'verify_image_repository': VerifyImageRepositoryAPI,
 }
 
+API_V2_MAPPING = {
+    'export_events': EventExportAPI,
+    'export_builds': BuildExportAPI,
+    'verify_images': VerifyImagesAPI,
+}
+
 
 def register_api_v1():
     """ Registers version 1 of Freshmaker API. """
@@ -782,8 +1024,32 @@ def register_api_v2():
                              view_func=view,
                              **val['options'])
 
+    for k, v in API_V2_MAPPING.items():
+        view = v.as_view(k + "_v2")
+        for key, val in api_v2.get(k, {}).items():
+            app.add_url_rule(val['url'],
+                             endpoint=key + "_v2",
+                             view_func=view,
+                             **val['options'])
+
     app.register_blueprint(monitor_api)
 
 
+def prebuild_responses():
+    """
+    Fills the response cache with the responses of the endpoints returning
+    static data, so they are not built by the first requests.
+    """
+    with app.app_context():
+        for key, get_json in [('event_types', _event_types_json),
+                              ('build_types', _build_types_json),
+                              ('build_states', _build_states_json)]:
+            items = get_json()['items']
+            for id in [None] + [item['id'] for item in items]:
+                response_cache.get((key, id), lambda: get_json(id))
+        response_cache.get('about', _about_json)
+
+
 register_api_v1()
 register_api_v2()
+prebuild_responses()
@@ -41,3 +41,16 @@ def clear_flask_g():
 def mock_vcrpy():
     with mock.patch('vcr.VCR'):
         yield
+
+
+@pytest.fixture(autouse=True)
+def clear_koji_service_pool():
+    """
+    Clear the pool of Koji sessions after each test.
+
+    The pooled KojiService instances would otherwise leak the mocked Koji
+    sessions into the other tests.
+    """
+    yield
+    from freshmaker.kojiservice import _koji_service_pool
+    _koji_service_pool.clear()
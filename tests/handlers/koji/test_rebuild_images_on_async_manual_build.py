@@ -19,7 +19,7 @@
 # OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
 # SOFTWARE.
 
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, call
 
 from freshmaker import db
 from freshmaker.handlers.koji import RebuildImagesOnAsyncManualBuild
@@ -54,6 +54,21 @@ class TestRebuildImagesOnAsyncManualBuild(helpers.ModelsTestCase):
                  'scratch': False,
                  'signing_intent': None,
                  'yum_repourls': [('fake-url.repo')]}])
+        self.mock_get_builds = self.patcher.patch(
+            'freshmaker.kojiservice.KojiService.get_builds',
+            side_effect=lambda nvrs: [
+                {'build_id': 123456, 'extra': {'container_koji_task_id': 21938204}}
+                for nvr in nvrs])
+        self.mock_get_task_requests = self.patcher.patch(
+            'freshmaker.kojiservice.KojiService.get_task_requests',
+            side_effect=lambda task_ids: [[
+                'git://example.com/rpms/repo-1#commit_hash1',
+                'test-target',
+                {'compose_ids': None,
+                 'git_branch': 'test_branch',
+                 'scratch': False,
+                 'signing_intent': None,
+                 'yum_repourls': [('fake-url.repo')]}] for task_id in task_ids])
 
         self.mock_allow_build = self.patcher.patch('allow_build', return_value=True)
 
@@ -323,6 +338,36 @@ class TestRebuildImagesOnAsyncManualBuild(helpers.ModelsTestCase):
         self.assertEqual(len(db_event.builds.all()), 1)
         self.assertEqual(db_event.builds.one().original_nvr, 'image-a-container-1.0-3')
 
+    def test_filter_images_based_on_dist_git_branch_lower_nvr(self):
+        """
+        This test checks that when the image with the highest NVR was not built from the
+        requested branch, the image with lower NVR built from that branch is picked.
+        """
+        branches = {
+            'image-a-container-1.0-3': 'another-branch',
+            'image-a-container-1.0-2': 'test_branch',
+            'image-b-container-2.14-1': 'test_branch',
+        }
+        self.mock_get_builds.side_effect = lambda nvrs: [
+            {'build_id': 1, 'extra': {'container_koji_task_id': nvr}} for nvr in nvrs]
+        self.mock_get_task_requests.side_effect = lambda task_ids: [
+            ['git://example.com/rpms/repo-1#commit_hash1', 'test-target',
+             {'git_branch': branches[task_id]}] for task_id in task_ids]
+
+        handler = RebuildImagesOnAsyncManualBuild()
+        handler.event = FreshmakerAsyncManualBuildEvent(
+            'msg-id-123', 'test_branch', ['image-a-container', 'image-b-container'])
+        db_event = Event.get_or_create_from_event(db.session, handler.event)
+        images = handler.filter_images_based_on_dist_git_branch(
+            [self.image_a, self.image_b, self.image_c], db_event)
+
+        self.assertEqual(
+            sorted(image.nvr for image in images),
+            ['image-a-container-1.0-2', 'image-b-container-2.14-1'])
+        self.assertEqual(self.mock_get_builds.call_args_list, [
+            call(['image-b-container-2.14-1', 'image-a-container-1.0-3']),
+            call(['image-a-container-1.0-2'])])
+
     def test_building_sibilings(self):
         """
         This test checks that when the users requests to rebuild 2 images that are sibilings
@@ -460,3 +505,42 @@ class TestRebuildImagesOnAsyncManualBuild(helpers.ModelsTestCase):
             build = db_event.builds.first().json()
             self.assertEqual(build['build_args'].get('original_parent', 0),
                              original_parent)
+
+    def test_get_image_trees(self):
+        """
+        Tests that the parents of all the images are found level by level
+        using single batched query per level.
+        """
+        image_0 = ContainerImage.create({'brew': {'build': 'image-container-1.0-2'}})
+        image_a = ContainerImage.create({'brew': {'build': 'image-a-container-1.0-2'}})
+        image_b = ContainerImage.create({'brew': {'build': 'image-b-container-2.14-1'}})
+        image_d = ContainerImage.create({'brew': {'build': 'image-d-container-3.3-1'}})
+        image_c = ContainerImage.create({'brew': {'build': 'image-a-container-1.0-3'}})
+        nvr_to_image = {image.nvr: image for image in [image_0, image_a, image_b, image_d]}
+        parents = {
+            image_b.nvr: image_a.nvr,
+            image_d.nvr: image_a.nvr,
+            image_a.nvr: image_0.nvr,
+            image_c.nvr: 'missing-container-1-1',
+        }
+
+        lb = MagicMock()
+        lb.find_parent_brew_build_nvr_from_child.side_effect = \
+            lambda image: parents.get(image.nvr)
+        lb.get_images_by_nvrs_batch.side_effect = lambda nvrs, published: [
+            ContainerImage.create(dict(nvr_to_image[nvr])) if nvr in nvr_to_image else None
+            for nvr in nvrs]
+
+        handler = RebuildImagesOnAsyncManualBuild()
+        trees = handler.get_image_trees(lb, [image_b, image_d, image_c])
+
+        self.assertEqual(
+            [[image.nvr for image in tree] for tree in trees],
+            [[image_a.nvr, image_0.nvr], [image_a.nvr, image_0.nvr], []])
+        self.assertEqual(image_b['parent'].nvr, image_a.nvr)
+        self.assertNotIn('parent', image_c)
+        lb.get_images_by_nvrs_batch.assert_has_calls([
+            call([image_a.nvr, image_a.nvr, 'missing-container-1-1'], published=None),
+            call([image_0.nvr, image_0.nvr], published=None),
+        ])
+        self.assertEqual(lb.get_images_by_nvrs_batch.call_count, 2)
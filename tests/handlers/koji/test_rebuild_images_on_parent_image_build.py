@@ -52,14 +52,14 @@ class TestRebuildImagesOnParentImageBuild(helpers.ModelsTestCase):
         event = self.get_event_from_msg(get_fedmsg('brew_container_task_failed'))
         self.assertTrue(self.handler.can_handle(event))
 
-    @mock.patch('freshmaker.handlers.ContainerBuildHandler.build_image_artifact_build')
+    @mock.patch('freshmaker.handlers.ContainerBuildHandler.prepare_image_artifact_build')
     @mock.patch('freshmaker.handlers.ContainerBuildHandler.get_repo_urls')
     @mock.patch('freshmaker.handlers.ContainerBuildHandler.set_context')
     def test_build_containers_when_dependency_container_is_built(self, set_context, repo_urls, build_image):
         """
         Tests when dependency container is built, rebuild containers depend on it.
         """
-        build_image.side_effect = [1, 2, 3]
+        build_image.side_effect = [lambda: 1, lambda: 2, lambda: 3]
         repo_urls.return_value = ["url"]
         e1 = models.Event.create(db.session, "test_msg_id", "RHSA-2018-001", events.TestingEvent)
         event = self.get_event_from_msg(get_fedmsg('brew_container_task_closed'))
@@ -87,14 +87,14 @@ class TestRebuildImagesOnParentImageBuild(helpers.ModelsTestCase):
         self.assertEqual(build_1.build_id, 2)
         self.assertEqual(build_2.build_id, 3)
 
-    @mock.patch('freshmaker.handlers.ContainerBuildHandler.build_image_artifact_build')
+    @mock.patch('freshmaker.handlers.ContainerBuildHandler.prepare_image_artifact_build')
     @mock.patch('freshmaker.handlers.ContainerBuildHandler.get_repo_urls')
     def test_not_build_containers_when_dependency_container_build_task_failed(
             self, repo_urls, build_image):
         """
         Tests when dependency container build task failed in brew, only update build state in db.
         """
-        build_image.side_effect = [1, 2, 3, 4]
+        build_image.side_effect = [lambda: 1, lambda: 2, lambda: 3, lambda: 4]
         repo_urls.return_value = ["url"]
         e1 = models.Event.create(db.session, "test_msg_id", "RHSA-2018-001", events.TestingEvent)
         event = self.get_event_from_msg(get_fedmsg('brew_container_task_failed'))
@@ -164,11 +164,11 @@ class TestRebuildImagesOnParentImageBuild(helpers.ModelsTestCase):
         self.assertEqual("Advisory 12345: 1 of 4 container image(s) failed to rebuild.",
                          self.db_advisory_rpm_signed_event.state_reason)
 
-    @mock.patch('freshmaker.handlers.ContainerBuildHandler.build_image_artifact_build')
+    @mock.patch('freshmaker.handlers.ContainerBuildHandler.prepare_image_artifact_build')
     @mock.patch('freshmaker.handlers.ContainerBuildHandler.get_repo_urls')
     def test_not_change_state_if_not_all_builds_done(
-            self, get_repo_urls, build_image_artifact_build):
-        build_image_artifact_build.return_value = 67890
+            self, get_repo_urls, prepare_image_artifact_build):
+        prepare_image_artifact_build.return_value = lambda: 67890
 
         self.db_advisory_rpm_signed_event = models.Event.create(
             db.session, 'msg-id-123', '12345',
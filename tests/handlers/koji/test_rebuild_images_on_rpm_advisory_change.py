@@ -884,8 +884,10 @@ class TestBatches(helpers.ModelsTestCase):
             # build.
             if build.name in ["child1_parent1", "child1"]:
                 self.assertEqual(build.state, ArtifactBuildState.FAILED.value)
+                self.assertIsNotNone(build.state_reason)
             else:
                 self.assertEqual(build.state, ArtifactBuildState.PLANNED.value)
+                self.assertIsNone(build.state_reason)
             self.assertEqual(build.type, ArtifactType.IMAGE.value)
 
             image = images[build.original_nvr]
@@ -1093,6 +1095,7 @@ class TestRecordBatchesImages(helpers.ModelsTestCase):
         ).first()
         self.assertNotEqual(None, parent_image)
         self.assertEqual(ArtifactBuildState.PLANNED.value, parent_image.state)
+        self.assertIsNone(parent_image.state_reason)
 
         # Check child image
         child_image = query.filter(
@@ -1348,6 +1351,71 @@ class TestRecordBatchesImages(helpers.ModelsTestCase):
 
         self.assertEqual(ArtifactBuildState.FAILED.value, build.state)
 
+    @patch('freshmaker.messaging.publish')
+    def test_failed_state_published_after_commit(self, publish):
+        def check_committed(topic, msg):
+            # The build must already be stored in the database.
+            self.assertIsNotNone(msg["id"])
+            self.assertFalse(db.session.new)
+            self.assertFalse(db.session.dirty)
+        publish.side_effect = check_committed
+
+        batches = [
+            [ContainerImage({
+                "brew": {
+                    "completion_date": "20170420T17:05:37.000-0400",
+                    "build": "rhel-server-docker-7.3-82",
+                    "package": "rhel-server-docker"
+                },
+                "parent": None,
+                "content_sets": ["content-set-1"],
+                "repository": "repo-1",
+                "commit": "123456789",
+                "target": "target-candidate",
+                "git_branch": "rhel-7",
+                "error": "Some error occurs while getting this image.",
+                "arches": "x86_64",
+                "odcs_compose_ids": None,
+                "published": False,
+            })],
+            [ContainerImage({
+                "brew": {
+                    "build": "rh-dotnetcore10-docker-1.0-16",
+                    "package": "rh-dotnetcore10-docker",
+                    "completion_date": "20170511T10:06:09.000-0400"
+                },
+                "parent": ContainerImage({
+                    "brew": {
+                        "completion_date": "20170420T17:05:37.000-0400",
+                        "build": "rhel-server-docker-7.3-82",
+                        "package": "rhel-server-docker"
+                    },
+                }),
+                "content_sets": ["content-set-1"],
+                "repository": "repo-1",
+                "commit": "987654321",
+                "target": "target-candidate",
+                "git_branch": "rhel-7",
+                "error": None,
+                "arches": "x86_64",
+                "odcs_compose_ids": None,
+                "generate_pulp_repos": True,
+                "published": False,
+            })]
+        ]
+
+        handler = RebuildImagesOnRPMAdvisoryChange()
+        handler._record_batches(batches, self.mock_event)
+
+        self.assertEqual(publish.call_count, 2)
+        for (topic, msg), _ in publish.call_args_list:
+            self.assertEqual(topic, "build.state.changed")
+            self.assertEqual(msg["state"], ArtifactBuildState.FAILED.value)
+        self.assertEqual(
+            [msg["original_nvr"] for (_, msg), _ in publish.call_args_list],
+            ["rhel-server-docker-7.3-82", "rh-dotnetcore10-docker-1.0-16"])
+        self.mock_prepare_pulp_repo.assert_not_called()
+
     def test_mark_state_failed_if_depended_image_is_failed(self):
         batches = [
             [ContainerImage({
@@ -24,12 +24,14 @@
 
 from unittest.mock import patch
 import json
+import re
 
 import freshmaker
 
 from freshmaker import db
 from freshmaker.events import ErrataAdvisoryRPMsSignedEvent
-from freshmaker.handlers import ContainerBuildHandler, ODCSComposeNotReady
+from freshmaker.handlers import (
+    BaseHandler, ContainerBuildHandler, ODCSComposeNotReady)
 from freshmaker.models import (
     ArtifactBuild, ArtifactBuildState, ArtifactBuildCompose,
     Compose, Event, EVENT_TYPES
@@ -249,6 +251,88 @@ class TestGetRepoURLs(helpers.ModelsTestCase):
 
         self.assertEqual(self.build_1.state, ArtifactBuildState.PLANNED.value)
 
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_container")
+    def test_start_to_build_images(self, build_container):
+        build_container.side_effect = [1001, 1002]
+        handler = MyHandler()
+        with patch.object(freshmaker.conf, 'max_thread_workers', new=2):
+            handler.start_to_build_images([self.build_1, self.build_2])
+
+        self.assertEqual(build_container.call_count, 2)
+        self.assertEqual(
+            sorted([self.build_1.build_id, self.build_2.build_id]), [1001, 1002])
+        for build in (self.build_1, self.build_2):
+            db.session.refresh(build)
+            self.assertEqual(build.state, ArtifactBuildState.BUILD.value)
+            self.assertEqual(build.state_reason, "Building container image in Koji.")
+
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_container")
+    def test_start_to_build_images_submission_failed(self, build_container):
+        def mocked_build_container(scm_url, branch, target, **kwargs):
+            if kwargs["compose_ids"]:
+                raise ValueError("Expected exception.")
+            return 1002
+        build_container.side_effect = mocked_build_container
+
+        handler = MyHandler()
+        # The error is recorded in the build, the other builds are not failed.
+        handler.start_to_build_images([self.build_1, self.build_2])
+
+        db.session.refresh(self.build_1)
+        self.assertEqual(self.build_1.state, ArtifactBuildState.FAILED.value)
+        self.assertEqual(
+            self.build_1.state_reason,
+            "Handling of build failed with traceback: Expected exception.")
+        db.session.refresh(self.build_2)
+        self.assertEqual(self.build_2.state, ArtifactBuildState.BUILD.value)
+        self.assertEqual(self.build_2.build_id, 1002)
+
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_container")
+    def test_start_to_build_images_preparation_failed(self, build_container):
+        def mocked_odcs_get_compose(compose_id):
+            if compose_id == 5:
+                raise ValueError("Expected exception.")
+            return {
+                "id": compose_id,
+                "result_repofile": "http://localhost/%d.repo" % compose_id,
+                "state": COMPOSE_STATES["done"],
+            }
+        self.odcs_get_compose.side_effect = mocked_odcs_get_compose
+        build_container.return_value = 1002
+
+        handler = MyHandler()
+        with patch.object(db.session, "commit", wraps=db.session.commit) as commit:
+            handler.start_to_build_images([self.build_1, self.build_2])
+        commit.assert_called_once()
+
+        build_container.assert_called_once()
+        db.session.refresh(self.build_1)
+        self.assertEqual(self.build_1.state, ArtifactBuildState.FAILED.value)
+        self.assertEqual(
+            self.build_1.state_reason,
+            "Handling of build failed with traceback: Expected exception.")
+        db.session.refresh(self.build_2)
+        self.assertEqual(self.build_2.state, ArtifactBuildState.BUILD.value)
+        self.assertIsNotNone(self.build_2.rebuilt_nvr)
+
+    @patch("freshmaker.handlers.ContainerBuildHandler.build_container")
+    def test_start_to_build_images_compose_not_ready(self, build_container):
+        def mocked_odcs_get_compose(compose_id):
+            return {
+                "id": compose_id,
+                "result_repofile": "http://localhost/%d.repo" % compose_id,
+                "state": COMPOSE_STATES["generating"],
+            }
+        self.odcs_get_compose.side_effect = mocked_odcs_get_compose
+        build_container.return_value = 1002
+
+        handler = MyHandler()
+        handler.start_to_build_images([self.build_1, self.build_2])
+
+        build_container.assert_called_once()
+        self.assertEqual(self.build_1.state, ArtifactBuildState.PLANNED.value)
+        self.assertEqual(self.build_2.state, ArtifactBuildState.BUILD.value)
+
 
 class TestAllowBuildBasedOnAllowlist(helpers.FreshmakerTestCase):
     """Test BaseHandler.allow_build"""
@@ -514,3 +598,72 @@ class TestAllowBuildBasedOnAllowlist(helpers.FreshmakerTestCase):
         allowed = handler.allow_build(
             ArtifactType.IMAGE, advisory_name='RHSA-2016:1000')
         self.assertFalse(allowed)
+
+    @patch.object(freshmaker.conf, 'handler_build_allowlist', new={
+        'MyHandler': {
+            'image': all_(
+                {'advisory_name': r'RHSA-\d+:\d+'},
+                any_(
+                    {'has_hightouch_bugs': True},
+                    {'severity': ['critical', 'important']}
+                ),
+            )
+        }
+    })
+    @patch.object(freshmaker.conf, 'handler_build_blocklist', new={
+        'MyHandler': {
+            'image': {'image_name': ['foo-1$', 'bar-.*']},
+        }
+    })
+    def test_allow_build_rules_compiled_once(self):
+        """
+        Test that the rules are compiled only once when allow_build() is
+        called for many images of single advisory as when planning the
+        rebuild of large advisory.
+        """
+        handler = MyHandler()
+        with patch("freshmaker.build_rules.re.compile", wraps=re.compile) as compile:
+            allowed = [
+                handler.allow_build(
+                    ArtifactType.IMAGE, advisory_name='RHSA-2017:1000',
+                    has_hightouch_bugs=False, severity="important",
+                    image_name="foo-%d" % (i % 1000))
+                for i in range(20000)]
+
+        self.assertEqual(compile.call_count, 6)
+        self.assertEqual(allowed.count(False), 20)
+
+    @patch.object(freshmaker.conf, 'handler_build_allowlist', new={
+        'MyHandler': {
+            'image': {'advisory_name': r'RHSA-\d+:\d+'},
+        }
+    })
+    def test_allow_build_configuration_changed(self):
+        handler = MyHandler()
+        allowed = handler.allow_build(
+            ArtifactType.IMAGE, advisory_name='RHSA-2017:1000')
+        self.assertTrue(allowed)
+
+        with patch.object(freshmaker.conf, 'handler_build_allowlist', new={
+                'MyHandler': {'image': {'advisory_name': r'RHBA-\d+:\d+'}}}):
+            allowed = handler.allow_build(
+                ArtifactType.IMAGE, advisory_name='RHSA-2017:1000')
+            self.assertFalse(allowed)
+
+    @patch.object(freshmaker.conf, 'handler_build_allowlist', new={
+        'MyHandler': {
+            'image': {'advisory_name': r'RHSA-\d+:\d+'},
+        }
+    })
+    def test_allow_build_configuration_edited_in_place(self):
+        handler = MyHandler()
+        allowed = handler.allow_build(
+            ArtifactType.IMAGE, advisory_name='RHSA-2017:1000')
+        self.assertTrue(allowed)
+
+        freshmaker.conf.handler_build_allowlist['MyHandler']['image'] = {
+            'advisory_name': r'RHBA-\d+:\d+'}
+        BaseHandler.invalidate_build_rules()
+        allowed = handler.allow_build(
+            ArtifactType.IMAGE, advisory_name='RHSA-2017:1000')
+        self.assertFalse(allowed)
@@ -21,7 +21,7 @@
 #
 # Written by Jan Kaluza <jkaluza@redhat.com>
 
-from unittest.mock import MagicMock
+from unittest.mock import MagicMock, patch
 
 from freshmaker.image_verifier import ImageVerifier
 from freshmaker.lightblue import ContainerRepository, ContainerImage
@@ -34,6 +34,11 @@ class TestImageVerifier(helpers.FreshmakerTestCase):
         super(TestImageVerifier, self).setUp()
         self.lb = MagicMock()
         self.verifier = ImageVerifier(self.lb)
+        ImageVerifier.clear_cache()
+
+    def tearDown(self):
+        super(TestImageVerifier, self).tearDown()
+        ImageVerifier.clear_cache()
 
     def test_verify_repository_no_repo(self):
         self.lb.find_container_repositories.return_value = None
@@ -182,3 +187,113 @@ class TestImageVerifier(helpers.FreshmakerTestCase):
         self.assertRaisesRegex(
             ValueError, r'No published images tagged by.*',
             self.verifier.verify_image, "foo/bar")
+
+    def _mock_verify_image_data(self):
+        self.lb.find_container_repositories.return_value = [
+            ContainerRepository({
+                "repository": "foo/bar",
+                "release_categories": ["Generally Available"],
+                "published": True,
+                "auto_rebuild_tags": ["latest"]
+            })
+        ]
+        self.lb.get_images_by_nvrs.return_value = [
+            ContainerImage({
+                "brew": {"build": "foo-1-1"},
+                "content_sets": ["content-set"]
+            })
+        ]
+
+    def test_verify_image_cached(self):
+        self._mock_verify_image_data()
+        ret = self.verifier.verify_image("foo-1-1")
+        ret["foo-1-1"].append("modified")
+
+        # New verifier uses the results cached by the previous one.
+        ret = ImageVerifier(self.lb).verify_image("foo-1-1")
+        self.assertEqual(ret, {"foo-1-1": ["content-set"]})
+        self.lb.find_container_repositories.assert_called_once()
+        self.lb.get_images_by_nvrs.assert_called_once()
+
+        query = self.lb.find_container_repositories.call_args[0][0]
+        self.assertNotIn(
+            {"field": "*", "include": True, "recursive": True}, query["projection"])
+
+    def test_verify_image_cached_error(self):
+        self.lb.find_container_repositories.return_value = []
+        for i in range(2):
+            self.assertRaisesRegex(
+                ValueError, r'Cannot get repository.*',
+                self.verifier.verify_image, "foo-1-1")
+        self.lb.find_container_repositories.assert_called_once()
+
+    @patch("freshmaker.image_verifier.time.monotonic")
+    def test_verify_image_cache_expired(self, monotonic):
+        self._mock_verify_image_data()
+        monotonic.return_value = 1000
+        self.verifier.verify_image("foo-1-1")
+        monotonic.return_value = 1000 + ImageVerifier._cache.ttl
+        self.verifier.verify_image("foo-1-1")
+        self.assertEqual(self.lb.find_container_repositories.call_count, 2)
+
+    def test_verify_images(self):
+        self.lb.find_container_repositories.return_value = [
+            ContainerRepository({
+                "repository": "foo/bar",
+                "release_categories": ["Generally Available"],
+                "published": True,
+                "auto_rebuild_tags": ["latest"],
+                "images": [{"brew": {"build": "foo-1-1"}}],
+            }),
+            ContainerRepository({
+                "repository": "foo/deprecated",
+                "release_categories": ["Deprecated"],
+                "published": True,
+                "auto_rebuild_tags": ["latest"],
+                "images": [{"brew": {"build": "bar-1-1"}}],
+            }),
+        ]
+        self.lb.get_images_by_nvrs.return_value = [
+            ContainerImage({
+                "brew": {"build": "foo-1-1"},
+                "content_sets": ["content-set"]
+            })
+        ]
+        self.lb.find_images_with_included_rpms.return_value = [
+            ContainerImage({
+                "brew": {"build": "foo-1-1"},
+                "content_sets": ["content-set"],
+                "repositories": [
+                    {
+                        "registry": "registry.example.com",
+                        "published": True,
+                        "repository": "foo/bar",
+                        "tags": [{"name": "latest"}, {"name": "1-1"}],
+                    },
+                ]
+            })
+        ]
+
+        ret = self.verifier.verify_images(
+            ["foo-1-1", "bar-1-1", "baz-1-1"], ["foo/bar", "foo/unknown"])
+
+        self.assertEqual(ret["images"]["foo-1-1"], {"content_sets": ["content-set"]})
+        self.assertRegex(ret["images"]["bar-1-1"]["error"], r".*but found \[\'Deprecated\'\].")
+        self.assertRegex(ret["images"]["baz-1-1"]["error"], r"Cannot get repository.*")
+        self.assertEqual(ret["repositories"]["foo/bar"], {
+            "repository": {"auto_rebuild_tags": ["latest"]},
+            "images": {
+                "foo-1-1": {"content_sets": ["content-set"], "tags": ["latest", "1-1"]}
+            },
+        })
+        self.assertRegex(
+            ret["repositories"]["foo/unknown"]["error"], r"Cannot get repository.*")
+
+        self.lb.find_container_repositories.assert_called_once()
+        self.lb.get_images_by_nvrs.assert_called_once_with(
+            ["foo-1-1"], include_rpm_manifest=False)
+        self.lb.find_images_with_included_rpms.assert_called_once()
+
+        # All the results are cached now.
+        self.verifier.verify_images(["foo-1-1", "bar-1-1"], ["foo/unknown"])
+        self.lb.find_container_repositories.assert_called_once()
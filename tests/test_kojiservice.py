@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+# Copyright (c) 2020  Red Hat, Inc.
+#
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+#
+# The above copyright notice and this permission notice shall be included in
+# all copies or substantial portions of the Software.
+#
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import patch, PropertyMock
+
+from freshmaker import conf
+from freshmaker.kojiservice import KojiService, koji_service
+from tests import helpers
+
+
+@patch('koji.read_config', return_value={'server': 'https://koji.localhost/kojihub'})
+class TestKojiServicePool(helpers.FreshmakerTestCase):
+
+    def test_anonymous_sessions_are_reused(self, read_config):
+        with koji_service('koji', login=False) as service:
+            first = service
+        with koji_service('koji', login=False) as service:
+            self.assertIs(service, first)
+        read_config.assert_called_once_with('koji')
+
+    def test_concurrent_sessions_are_not_shared(self, read_config):
+        with koji_service('koji', login=False) as service_1:
+            with koji_service('koji', login=False) as service_2:
+                self.assertIsNot(service_1, service_2)
+        with koji_service('koji', login=False) as service:
+            self.assertIn(service, [service_1, service_2])
+
+    @patch('freshmaker.kojiservice.KojiService.logged_in', new_callable=PropertyMock)
+    @patch('freshmaker.kojiservice.KojiService.krb_login')
+    def test_login_once(self, krb_login, logged_in, read_config):
+        logged_in.side_effect = [False, True, True]
+
+        with patch.object(conf, 'krb_auth_principal', new='freshmaker@EXAMPLE.COM'):
+            with koji_service('koji', login=True) as service:
+                first = service
+            with koji_service('koji', login=True) as service:
+                self.assertIs(service, first)
+            with koji_service('koji', login=False) as service:
+                self.assertIsNot(service, first)
+
+        krb_login.assert_called_once()
+
+    @patch('freshmaker.kojiservice.KojiService.logged_in', new_callable=PropertyMock)
+    @patch('freshmaker.kojiservice.KojiService.krb_login')
+    def test_login_again_after_expiration(self, krb_login, logged_in, read_config):
+        logged_in.side_effect = [False, True, False, True]
+
+        with patch.object(conf, 'krb_auth_principal', new='freshmaker@EXAMPLE.COM'):
+            with koji_service('koji', login=True):
+                pass
+            with koji_service('koji', login=True):
+                pass
+
+        self.assertEqual(krb_login.call_count, 2)
+
+    @patch('freshmaker.kojiservice.KojiService.logout')
+    def test_session_dropped_on_error(self, logout, read_config):
+        with self.assertRaises(ValueError):
+            with koji_service('koji', login=False) as service:
+                first = service
+                raise ValueError("Expected exception.")
+        with koji_service('koji', login=False) as service:
+            self.assertIsNot(service, first)
+
+    @patch('freshmaker.kojiservice.KojiService.logged_in', new_callable=PropertyMock)
+    @patch('freshmaker.kojiservice.KojiService.logout')
+    def test_pool_size(self, logout, logged_in, read_config):
+        logged_in.return_value = True
+        with patch.object(conf, 'koji_session_pool_size', new=1):
+            with koji_service('koji', login=False):
+                with koji_service('koji', login=False):
+                    pass
+        logout.assert_called_once()
+
+
+@patch('koji.read_config', return_value={'server': 'https://koji.localhost/kojihub'})
+@patch.object(KojiService, '_FAKE_TASK_ID', new=None)
+class TestKojiServiceFakeTaskId(helpers.ModelsTestCase):
+
+    @patch('freshmaker.kojiservice.work_queue_put')
+    def test_concurrent_fake_task_ids_are_unique(self, work_queue_put, read_config):
+        KojiService.seed_fake_task_id()
+        service = KojiService(dry_run=True)
+
+        def build(i):
+            return service._fake_build_container(
+                'git://pkgs.localhost/containers/foo#%d' % i, 'target',
+                {'git_branch': 'master'})
+
+        # The workers do not query the database once the id is seeded.
+        with patch('freshmaker.models.ArtifactBuild.get_lowest_build_id',
+                   side_effect=AssertionError("Database queried")):
+            with ThreadPoolExecutor(max_workers=8) as executor:
+                task_ids = list(executor.map(build, range(200)))
+
+        self.assertEqual(len(set(task_ids)), 200)
+        self.assertEqual(max(task_ids), -2)
+
+    def test_seed_never_increases_fake_task_id(self, read_config):
+        KojiService._FAKE_TASK_ID = -10
+        KojiService.seed_fake_task_id()
+        self.assertEqual(KojiService._FAKE_TASK_ID, -10)
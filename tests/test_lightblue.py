@@ -22,9 +22,14 @@
 
 import copy
 import json
+import random
 import io
 import http.client
+import threading
+import dogpile.cache
+import koji
 
+from concurrent.futures import ThreadPoolExecutor
 from unittest import mock
 from unittest.mock import call, patch, Mock
 
@@ -32,9 +37,15 @@ import freshmaker
 
 from freshmaker.lightblue import ContainerImage
 from freshmaker.lightblue import ContainerRepository
+from freshmaker.lightblue import ImageChainsDeduplicator
 from freshmaker.lightblue import LightBlue
+from freshmaker.lightblue import LightBlueHTTPAdapter
 from freshmaker.lightblue import LightBlueRequestError
 from freshmaker.lightblue import LightBlueSystemError
+from freshmaker.lightblue import RpmList, RpmNvrIndex, RpmSymbols
+from freshmaker.lightblue import _MeteredHTTPSConnectionPool
+from freshmaker.lightblue import _init_pool_thread
+from freshmaker.lightblue import _koji_cache_key_mangler
 from freshmaker.utils import sorted_by_nvr
 from tests.test_handler import MyHandler
 from tests import helpers
@@ -247,6 +258,118 @@ class TestContainerImageObject(helpers.FreshmakerTestCase):
             's390x': rpm_manifest_s390x
         })
 
+    def test_create_compact(self):
+        rpms = [
+            {"name": "openssl", "nvra": "openssl-1.2.3-1.amd64",
+             "srpm_name": "openssl", "srpm_nevra": "openssl-0:1.2.3-1.src"},
+            {"name": "tespackage", "nvra": "testpackage-1.2.3-1.amd64"},
+        ]
+        data = {
+            "brew": {"build": "package-name-1-4-12.10"},
+            "architecture": "amd64",
+            "parsed_data": {
+                "files": [
+                    {"filename": "Dockerfile", "key": "buildfile"},
+                    {"filename": "bogus.file", "key": "bogusfile"},
+                ],
+                "layers": ["sha512:1234", "sha512:5678"],
+            },
+            "rpm_manifest": [{"rpms": rpms}],
+        }
+        image = ContainerImage.create(data)
+
+        self.assertEqual(image["parsed_data"], {
+            "files": [{"filename": "Dockerfile", "key": "buildfile"}]})
+        self.assertEqual(image.dockerfile, {"filename": "Dockerfile", "key": "buildfile"})
+        self.assertIsInstance(image["rpm_manifest"][0]["rpms"], RpmList)
+        self.assertEqual(image["rpm_manifest"], [{"rpms": rpms}])
+        self.assertEqual(image.get_rpms(), rpms)
+        self.assertEqual(image["multi_arch_rpm_manifest"], {"amd64": [{"rpms": rpms}]})
+        # The original data are not changed.
+        self.assertEqual(len(data["parsed_data"]["files"]), 2)
+        self.assertIs(data["rpm_manifest"][0]["rpms"], rpms)
+
+    def test_create_unknown_rpm_fields(self):
+        rpm_manifest = [{"rpms": [{"name": "openssl", "arch": "x86_64"}]}]
+        image = ContainerImage.create({
+            "brew": {"build": "package-name-1-4-12.10"},
+            "rpm_manifest": rpm_manifest,
+        })
+        self.assertNotIsInstance(image["rpm_manifest"][0]["rpms"], RpmList)
+        self.assertEqual(image["rpm_manifest"], rpm_manifest)
+
+    def test_rpm_list(self):
+        rpms = RpmList([
+            {"name": "openssl", "nvra": "openssl-1.2.3-1.amd64"},
+            {"name": "tespackage", "nvra": "testpackage-1.2.3-1.amd64"},
+        ])
+        self.assertEqual(len(rpms), 2)
+        self.assertEqual(rpms[-1], {"name": "tespackage", "nvra": "testpackage-1.2.3-1.amd64"})
+        self.assertEqual(rpms[:1], [{"name": "openssl", "nvra": "openssl-1.2.3-1.amd64"}])
+        self.assertEqual([rpm["name"] for rpm in rpms], ["openssl", "tespackage"])
+        self.assertIs(copy.deepcopy(rpms), rpms)
+
+        # Changing returned RPM does not change the list.
+        rpms[0]["name"] = "foo"
+        self.assertEqual(rpms.names, ("openssl", "tespackage"))
+
+    def test_rpm_list_shared_symbols(self):
+        symbols = RpmSymbols()
+        rpms1 = RpmList.from_rpms([
+            {"name": "openssl", "nvra": "openssl-1.2.3-1.amd64"},
+        ], symbols)
+        rpms2 = RpmList.from_rpms([
+            {"name": "openssl", "nvra": "openssl-1.2.3-1.amd64"},
+            {"name": "tespackage"},
+        ], symbols)
+        self.assertEqual(len(symbols), 3)
+        self.assertEqual(rpms1.name_ids[0], rpms2.name_ids[0])
+        self.assertEqual(rpms2[1], {"name": "tespackage"})
+        self.assertEqual(rpms1, rpms2[:1])
+        self.assertEqual(rpms2.name_set(), {"openssl", "tespackage"})
+        self.assertIsNone(symbols.find_id("foo"))
+
+    def test_create_shared_rpm_symbols(self):
+        symbols = RpmSymbols()
+        images = [
+            ContainerImage.create({
+                "brew": {"build": nvr},
+                "rpm_manifest": [{"rpms": [
+                    {"name": "openssl", "nvra": "openssl-1.2.3-1.amd64",
+                     "srpm_name": "openssl", "srpm_nevra": "openssl-0:1.2.3-1.src"},
+                ]}],
+            }, symbols)
+            for nvr in ("foo-1-1", "bar-1-1")]
+        self.assertEqual(len(symbols), 3)
+        rpms = [image["rpm_manifest"][0]["rpms"] for image in images]
+        self.assertIs(rpms[0].symbols, rpms[1].symbols)
+        self.assertEqual(rpms[0], rpms[1])
+
+    def test_rpm_nvr_index(self):
+        index = RpmNvrIndex({
+            "openssl": ["openssl-1.2.3-2", "openssl-1.2.3-1.module+el8+1"],
+            "bash": "bash-4.2-1",
+        })
+        rpms = [
+            {"name": "foo", "nvra": "foo-1-1.amd64"},
+            {"name": "openssl", "nvra": "openssl-1.2.3-2.module+el8+1.amd64"},
+        ]
+        for image_rpms in (rpms, RpmList(rpms), RpmList(rpms, RpmSymbols())):
+            self.assertEqual(index.check_rpms(image_rpms), (False, True))
+            self.assertEqual(
+                index.check_rpms(image_rpms, check_modularity=False), (False, False))
+
+        rpms = [{"name": "bash", "nvra": "bash-4.1-9.amd64"}]
+        for image_rpms in (rpms, RpmList(rpms)):
+            self.assertEqual(index.check_rpms(image_rpms), (True, True))
+            self.assertEqual(index.check_rpms(image_rpms, check_nvr=False), (False, True))
+
+    def test_rpm_nvr_index_name_mismatch(self):
+        index = RpmNvrIndex({"openssl": ["openssl-1.2.3-2"]})
+        rpms = [{"name": "openssl", "nvra": "openssl-libs-1.2.3-1.amd64"}]
+        self.assertRaises(ValueError, index.check_rpms, rpms)
+        self.assertEqual(index.check_rpms(rpms, check_nvr=False), (False, True))
+
     def test_log_error(self):
         image = ContainerImage.create({
             'brew': {
@@ -500,6 +623,206 @@ class TestContainerImageObject(helpers.FreshmakerTestCase):
         lb.get_images_by_nvrs.return_value = []
         image.resolve_published(lb)
 
+    @patch('freshmaker.lightblue.ContainerImage.resolve_published', autospec=True)
+    @patch('freshmaker.lightblue.ContainerImage.resolve_commit', autospec=True)
+    @patch('os.path.exists', return_value=True)
+    def test_resolve_cached_per_lightblue_instance(
+            self, exists, resolve_commit, resolve_published):
+        def fake_resolve_commit(image):
+            image['repository'] = 'rpms/foo'
+            image['commit'] = '123456'
+        resolve_commit.side_effect = fake_resolve_commit
+
+        def fake_resolve_published(image, lb_instance):
+            image['published'] = True
+        resolve_published.side_effect = fake_resolve_published
+
+        lb = LightBlue(server_url='http://lightblue.localhost',
+                       cert='path/to/cert', private_key='path/to/key')
+        images = [
+            ContainerImage.create({
+                'brew': {'build': 'package-name-1-4-12.10'},
+                'content_sets': ['rhel-7-server-rpms'],
+            })
+            for _ in range(2)
+        ]
+        hits_before = freshmaker.monitor.freshmaker_image_resolve_cache_hit_counter._value.get()
+        misses_before = freshmaker.monitor.freshmaker_image_resolve_cache_miss_counter._value.get()
+
+        for image in images:
+            image.resolve(lb)
+
+        resolve_commit.assert_called_once()
+        resolve_published.assert_called_once()
+        self.assertEqual(len(lb.resolved_images), 1)
+        for image in images:
+            self.assertEqual(image['repository'], 'rpms/foo')
+            self.assertEqual(image['commit'], '123456')
+            self.assertEqual(image['published'], True)
+            self.assertEqual(image['content_sets'], ['rhel-7-server-rpms'])
+        self.assertEqual(
+            freshmaker.monitor.freshmaker_image_resolve_cache_hit_counter._value.get(),
+            hits_before + 1)
+        self.assertEqual(
+            freshmaker.monitor.freshmaker_image_resolve_cache_miss_counter._value.get(),
+            misses_before + 1)
+
+        # Another LightBlue instance does not share the cache.
+        lb2 = LightBlue(server_url='http://lightblue.localhost',
+                        cert='path/to/cert', private_key='path/to/key')
+        ContainerImage.create({
+            'brew': {'build': 'package-name-1-4-12.10'},
+            'content_sets': ['rhel-7-server-rpms'],
+        }).resolve(lb2)
+        self.assertEqual(resolve_commit.call_count, 2)
+
+    @patch('freshmaker.lightblue.ContainerImage._get_additional_data_from_koji')
+    @patch('os.path.exists', return_value=True)
+    def test_resolve_cache_hit_equals_cache_miss(
+            self, exists, get_additional_data_from_koji):
+        koji_data = {
+            'repository': 'rpms/foo',
+            'commit': '123456',
+            'target': 'foo-target',
+            'git_branch': 'foo-branch',
+            'error': None,
+            'arches': 'x86_64',
+            'odcs_compose_ids': None,
+            'parent_image_builds': None,
+            'generate_pulp_repos': True,
+            'parent_build_id': None,
+        }
+        get_additional_data_from_koji.side_effect = lambda nvr: dict(koji_data)
+
+        for published in (True, False):
+            lb = LightBlue(server_url='http://lightblue.localhost',
+                           cert='path/to/cert', private_key='path/to/key')
+            lb.get_images_by_nvrs = Mock()
+            if published:
+                lb.get_images_by_nvrs.return_value = [{'brew': {}}]
+            else:
+                lb.get_images_by_nvrs.side_effect = lambda *args, **kwargs: (
+                    [] if kwargs.get('published') else [{'rpm_manifest': ['full']}])
+
+            images = [
+                ContainerImage.create({
+                    'brew': {'build': 'package-name-1-4-12.10'},
+                    'content_sets': ['rhel-7-server-rpms'],
+                    # Keys already set to the resolved values must be
+                    # cached as well.
+                    'published': published,
+                    'repository': 'rpms/foo',
+                })
+                for _ in range(2)
+            ]
+            for image in images:
+                image.resolve(lb)
+
+            get_additional_data_from_koji.assert_called_once()
+            get_additional_data_from_koji.reset_mock()
+            self.assertEqual(dict(images[0]), dict(images[1]))
+            self.assertEqual(images[1]['published'], published)
+            self.assertEqual(images[1]['target'], 'foo-target')
+            if not published:
+                self.assertEqual(images[1]['rpm_manifest'], ['full'])
+
+    @patch('freshmaker.lightblue.ContainerImage.prefetch_koji_data')
+    def test_prewarm_koji_cache(self, prefetch_koji_data):
+        prefetch_koji_data.side_effect = lambda nvrs: len(nvrs) - 1
+
+        nvrs = ['foo-1-%d' % i for i in range(5)] + ['foo-1-0']
+        with patch.object(freshmaker.conf, 'koji_multicall_batch_size', new=2):
+            self.assertEqual(ContainerImage.prewarm_koji_cache(nvrs), 2)
+        prefetch_koji_data.assert_has_calls([
+            call(['foo-1-0', 'foo-1-1']), call(['foo-1-2', 'foo-1-3']), call(['foo-1-4'])])
+
+    @patch('freshmaker.kojiservice.KojiService.list_archives_many')
+    @patch('freshmaker.kojiservice.KojiService.get_task_requests')
+    @patch('freshmaker.kojiservice.KojiService.get_builds')
+    @patch('freshmaker.kojiservice.KojiService.get_task_request')
+    @patch('freshmaker.kojiservice.KojiService.get_build')
+    def test_prefetch_koji_data(
+            self, get_build, get_task_request, get_builds, get_task_requests,
+            list_archives_many):
+        get_builds.return_value = [
+            {'build_id': 1, 'task_id': 11, 'extra': {}},
+            None,
+            {'build_id': 3, 'extra': {'container_koji_task_id': 33}},
+            {'build_id': 4, 'extra': {}},
+        ]
+        get_task_requests.return_value = [
+            ['git://pkgs.devel.redhat.com/rpms/a-container#a1', 'target-a', {'git_branch': 'a'}],
+            ['git://pkgs.devel.redhat.com/rpms/c-container#c1', 'target-c', {}],
+        ]
+        list_archives_many.return_value = [
+            [{'btype': 'image', 'extra': {'image': {'arch': 'x86_64'}}}],
+            [{'btype': 'image', 'extra': {'image': {'arch': 's390x'}}},
+             {'btype': 'log', 'extra': {}}],
+        ]
+
+        region = dogpile.cache.make_region().configure('dogpile.cache.memory')
+        with patch.object(ContainerImage.koji_region, 'backend', new=region.backend), \
+                patch.object(freshmaker.conf, 'supply_arch_overrides', new=True):
+            cached = ContainerImage.prefetch_koji_data(
+                ['a-1-1', 'b-1-1', 'c-1-1', 'd-1-1', 'a-1-1'])
+            self.assertEqual(cached, 2)
+            get_builds.assert_called_once_with(['a-1-1', 'b-1-1', 'c-1-1', 'd-1-1'])
+            get_task_requests.assert_called_once_with([11, 33])
+            list_archives_many.assert_called_once_with([1, 3])
+
+            image = ContainerImage()
+            data = image._get_additional_data_from_koji('a-1-1')
+            self.assertEqual(data['repository'], 'rpms/a-container')
+            self.assertEqual(data['commit'], 'a1')
+            self.assertEqual(data['git_branch'], 'a')
+            self.assertEqual(data['arches'], 'x86_64')
+            data = image._get_additional_data_from_koji('c-1-1')
+            self.assertEqual(data['target'], 'target-c')
+            self.assertEqual(data['git_branch'], 'unknown')
+            self.assertEqual(data['arches'], 's390x')
+            get_build.assert_not_called()
+            get_task_request.assert_not_called()
+
+            # Cached NVRs are not fetched again.
+            get_builds.reset_mock()
+            self.assertEqual(ContainerImage.prefetch_koji_data(['a-1-1', 'c-1-1']), 2)
+            get_builds.assert_not_called()
+
+    @patch('freshmaker.kojiservice.KojiService.get_task_requests')
+    @patch('freshmaker.kojiservice.KojiService.get_builds')
+    def test_prefetch_koji_data_invalid_source(self, get_builds, get_task_requests):
+        get_builds.return_value = [
+            {'build_id': 1, 'task_id': 11, 'extra': {}},
+            {'build_id': 2, 'task_id': 22, 'extra': {}},
+        ]
+        get_task_requests.return_value = [
+            ['git://pkgs.devel.redhat.com/rpms/a-container#a1', 'target-a', {}],
+            ['git://pkgs.devel.redhat.com/rpms/b-container#origin/b', 'target-b', {}],
+        ]
+
+        region = dogpile.cache.make_region().configure('dogpile.cache.memory')
+        with patch.object(ContainerImage.koji_region, 'backend', new=region.backend), \
+                patch.object(freshmaker.conf, 'supply_arch_overrides', new=False):
+            # The b-1-1 build without valid source is not cached.
+            self.assertEqual(ContainerImage.prefetch_koji_data(['a-1-1', 'b-1-1']), 1)
+            get_cached = ContainerImage._get_additional_data_from_koji.get
+            self.assertIs(
+                get_cached(ContainerImage(), 'b-1-1'), dogpile.cache.api.NO_VALUE)
+
+    @patch('freshmaker.kojiservice.KojiService.get_builds')
+    def test_prefetch_koji_data_null_cache(self, get_builds):
+        self.assertEqual(ContainerImage.prefetch_koji_data(['a-1-1']), 0)
+        get_builds.assert_not_called()
+
+    def test_koji_cache_key_mangler(self):
+        key = 'freshmaker.lightblue:_get_additional_data_from_koji|foo-1-1'
+        mangled = _koji_cache_key_mangler(key)
+        self.assertTrue(mangled.startswith('freshmaker:koji:koji:'))
+        self.assertEqual(mangled, _koji_cache_key_mangler(key))
+        self.assertNotEqual(
+            mangled,
+            _koji_cache_key_mangler(key.replace('foo-1-1', 'foo-1-2')))
+
 
 class TestContainerRepository(helpers.FreshmakerTestCase):
 
@@ -800,7 +1123,7 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
                        event_id=self.current_db_event_id)
         assert lb.event_id == self.current_db_event_id
 
-    @patch('freshmaker.lightblue.requests.post')
+    @patch('freshmaker.lightblue.requests.Session.post')
     def test_find_container_images(self, post):
         post.return_value.status_code = http.client.OK
         post.return_value.json.return_value = {
@@ -854,7 +1177,8 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
             data=json.dumps(fake_request),
             verify=lb.verify_ssl,
             cert=(self.fake_cert_file, self.fake_private_key),
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json'},
+            timeout=freshmaker.conf.lightblue_timeout,
         )
         self.assertEqual(2, len(images))
 
@@ -868,7 +1192,7 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
                          image['brew']['package'])
 
     @patch('freshmaker.lightblue.ContainerImage.update_multi_arch')
-    @patch('freshmaker.lightblue.requests.post')
+    @patch('freshmaker.lightblue.requests.Session.post')
     def test_find_container_images_with_multi_arch(self, post, update_multi_arch):
         post.return_value.status_code = http.client.OK
         post.return_value.json.return_value = {
@@ -926,7 +1250,8 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
             data=json.dumps(fake_request),
             verify=lb.verify_ssl,
             cert=(self.fake_cert_file, self.fake_private_key),
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json'},
+            timeout=freshmaker.conf.lightblue_timeout,
         )
         self.assertEqual(1, len(images))
         # Verify update_multi_arch is first called with the second image,
@@ -937,7 +1262,7 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
              'e0f97342ddf6a09972434f98837b5fd8b5bed9390f32f1d63e8a7e4893208af7'],
             [call_args[0][0]['image_id'] for call_args in update_multi_arch.call_args_list])
 
-    @patch('freshmaker.lightblue.requests.post')
+    @patch('freshmaker.lightblue.requests.Session.post')
     def test_find_container_repositories(self, post):
         post.return_value.status_code = http.client.OK
         post.return_value.json.return_value = {
@@ -999,7 +1324,8 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
             data=json.dumps(fake_request),
             verify=lb.verify_ssl,
             cert=(self.fake_cert_file, self.fake_private_key),
-            headers={'Content-Type': 'application/json'}
+            headers={'Content-Type': 'application/json'},
+            timeout=freshmaker.conf.lightblue_timeout,
         )
 
         self.assertEqual(2, len(repos))
@@ -1013,7 +1339,7 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
         self.assertEqual(repos[0]['repository'], 'spam')
         self.assertEqual(repos[1]['repository'], 'bacon')
 
-    @patch('freshmaker.lightblue.requests.post')
+    @patch('freshmaker.lightblue.requests.Session.post')
     def test_raise_error_if_request_data_is_incorrect(self, post):
         post.return_value.status_code = http.client.BAD_REQUEST
         post.return_value.json.return_value = {
@@ -1048,6 +1374,38 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
             self.assertRaises(LightBlueRequestError,
                               lb._make_request, 'find/containerRepository/', fake_request)
 
+    @patch.object(LightBlue, '_http_session', new=None)
+    def test_http_session_is_shared(self):
+        session = LightBlue._get_http_session()
+        self.assertIs(session, LightBlue._get_http_session())
+
+        adapter = session.get_adapter('https://lightblue.localhost/')
+        self.assertIsInstance(adapter, LightBlueHTTPAdapter)
+        self.assertEqual(adapter._pool_maxsize, freshmaker.conf.lightblue_pool_size)
+        self.assertEqual(adapter.max_retries.total, freshmaker.conf.lightblue_max_retries)
+        self.assertIn("POST", adapter.max_retries.allowed_methods)
+
+    @patch.object(LightBlue, '_http_session', new=None)
+    def test_http_session_is_recreated_after_fork(self):
+        session = LightBlue._get_http_session()
+        with patch('freshmaker.lightblue.os.getpid', return_value=-1):
+            self.assertIsNot(session, LightBlue._get_http_session())
+
+    @patch('freshmaker.lightblue.freshmaker_lightblue_pool_miss_counter')
+    @patch('freshmaker.lightblue.freshmaker_lightblue_pool_hit_counter')
+    def test_http_pool_hit_miss_counters(self, hit_counter, miss_counter):
+        pool = _MeteredHTTPSConnectionPool('lightblue.localhost', maxsize=1)
+        conn = pool._get_conn()
+        miss_counter.inc.assert_called_once_with()
+        hit_counter.inc.assert_not_called()
+
+        # Pretend the connection is open and return it back to the pool.
+        conn.sock = Mock()
+        pool._put_conn(conn)
+        with patch('urllib3.connectionpool.is_connection_dropped', return_value=False):
+            self.assertIs(pool._get_conn(), conn)
+        hit_counter.inc.assert_called_once_with()
+
     @patch('freshmaker.lightblue.LightBlue.find_container_repositories')
     @patch('os.path.exists')
     def test_find_all_container_repositories(self, exists, cont_repos):
@@ -1320,11 +1678,6 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
                                              'key': 'buildfile',
                                              'content_url': 'http://git.repo.com/cgit/rpms/repo-2/plain/Dockerfile?id=commit_hash2',
                                              'filename': 'Dockerfile'
-                                         },
-                                         {
-                                             'key': 'bogusfile',
-                                             'content_url': 'bogus_test_url',
-                                             'filename': 'bogus.file'
                                          }
                                      ]
                                  },
@@ -1431,11 +1784,6 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
                                              'key': 'buildfile',
                                              'content_url': 'http://git.repo.com/cgit/rpms/repo-2/plain/Dockerfile?id=commit_hash2',
                                              'filename': 'Dockerfile'
-                                         },
-                                         {
-                                             'key': 'bogusfile',
-                                             'content_url': 'bogus_test_url',
-                                             'filename': 'bogus.file'
                                          }
                                      ]
                                  },
@@ -1564,13 +1912,17 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
 
     @patch('freshmaker.lightblue.LightBlue.find_all_container_repositories')
     @patch('freshmaker.lightblue.LightBlue.find_images_with_packages_from_content_set')
-    @patch('freshmaker.lightblue.LightBlue.find_parent_images_with_package')
+    @patch('freshmaker.lightblue.LightBlue.find_parent_brew_build_nvr_from_child')
+    @patch('freshmaker.lightblue.LightBlue.get_images_by_nvrs')
+    @patch('freshmaker.lightblue.ContainerImage.resolve')
     @patch('freshmaker.lightblue.LightBlue._filter_out_already_fixed_published_images')
     @patch('os.path.exists')
     def test_images_to_rebuild(self,
                                exists,
                                _filter_out_already_fixed_published_images,
-                               find_parent_images_with_package,
+                               resolve,
+                               get_images_by_nvrs,
+                               find_parent_brew_build_nvr_from_child,
                                find_images_with_packages_from_content_set,
                                find_repos):
         exists.return_value = True
@@ -1707,15 +2059,42 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
         leaf_image6_as_parent['parent'] = image_f
         # When the image is a parent, directly_affected is not set
         del leaf_image6_as_parent["directly_affected"]
-        find_parent_images_with_package.side_effect = [
-            [image_b, image_a],                        # parents of leaf_image1
-            [image_c, image_b, image_a],               # parents of leaf_image2
-            [image_k, image_j, image_e, image_a],      # parents of leaf_image3
-            [image_d, image_e, image_a],               # parents of leaf_image4
-            [image_a],                                 # parents of leaf_image5
-            [image_f, image_g],                        # parents of leaf_image6
-            [leaf_image6_as_parent, image_f, image_g]  # parents of leaf_image7
+        parent_images = [
+            image_a, image_b, image_c, image_d, image_e, image_f, image_g,
+            image_j, image_k, leaf_image6_as_parent,
         ]
+        for image in parent_images:
+            image["rpm_manifest"] = [{
+                "rpms": [
+                    {"name": "dummy"}
+                ]
+            }]
+        # Chains of parents of the leaf images:
+        #   leaf_image1: image_b, image_a
+        #   leaf_image2: image_c, image_b, image_a
+        #   leaf_image3: image_k, image_j, image_e, image_a
+        #   leaf_image4: image_d, image_e, image_a
+        #   leaf_image5: image_a
+        #   leaf_image6: image_f, image_g
+        #   leaf_image7: leaf_image6_as_parent, image_f, image_g
+        child_to_parent = {
+            leaf_image1.nvr: image_b, leaf_image2.nvr: image_c, leaf_image3.nvr: image_k,
+            leaf_image4.nvr: image_d, leaf_image5.nvr: image_a, leaf_image6.nvr: image_f,
+            leaf_image7.nvr: leaf_image6_as_parent,
+            image_b.nvr: image_a, image_c.nvr: image_b, image_k.nvr: image_j,
+            image_j.nvr: image_e, image_e.nvr: image_a, image_d.nvr: image_e,
+            image_f.nvr: image_g,
+        }
+
+        def fake_find_parent_brew_build_nvr_from_child(image):
+            parent = child_to_parent.get(image.nvr)
+            return parent.nvr if parent else None
+
+        find_parent_brew_build_nvr_from_child.side_effect = \
+            fake_find_parent_brew_build_nvr_from_child
+        nvr_to_parent = {image.nvr: image for image in parent_images}
+        get_images_by_nvrs.side_effect = lambda nvrs, **kwargs: [
+            nvr_to_parent[nvr] for nvr in nvrs]
         lb = LightBlue(server_url=self.fake_server_url,
                        cert=self.fake_cert_file,
                        private_key=self.fake_private_key)
@@ -1756,6 +2135,89 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
         _filter_out_already_fixed_published_images.assert_called_once_with(
             mock.ANY, expected_directly_affected_nvrs, ["dummy-1-1"], ["dummy"]
         )
+        # The parents are queried one layer at a time and each of them only once.
+        self.assertEqual(
+            [sorted(call_args[0][0]) for call_args in get_images_by_nvrs.call_args_list],
+            [
+                sorted([image_b.nvr, image_c.nvr, image_k.nvr, image_d.nvr, image_a.nvr,
+                        image_f.nvr, leaf_image6.nvr]),
+                sorted([image_j.nvr, image_e.nvr, image_g.nvr]),
+            ])
+        self.assertEqual(resolve.call_count, len(parent_images))
+
+    @patch('freshmaker.lightblue.LightBlue.get_images_by_nvrs')
+    @patch('freshmaker.lightblue.ContainerImage.resolve')
+    @patch('os.path.exists', return_value=True)
+    def test_find_parent_chains_missing_parent(self, exists, resolve, get_images_by_nvrs):
+        def _image(nvr, parent_nvr, rpm_names):
+            return ContainerImage.create({
+                'brew': {'build': nvr},
+                'parent_brew_build': parent_nvr,
+                'error': None,
+                'rpm_manifest': [{'rpms': [{'name': name} for name in rpm_names]}],
+            })
+
+        leaf_1 = _image('leaf-1-1', 'parent-1-1', ['openssl', 'httpd'])
+        leaf_2 = _image('leaf-2-1', 'parent-1-1', ['openssl'])
+        leaf_3 = _image('leaf-3-1', 'missing-1-1', ['openssl'])
+        # The parent contains only openssl and its parent is not in Lightblue.
+        parent = _image('parent-1-1', 'missing-base-1-1', ['openssl'])
+        get_images_by_nvrs.side_effect = [[parent], []]
+
+        lb = LightBlue(server_url=self.fake_server_url,
+                       cert=self.fake_cert_file,
+                       private_key=self.fake_private_key)
+        chains = lb._find_parent_chains([leaf_1, leaf_2, leaf_3], ['openssl', 'httpd', 'openssl'])
+
+        self.assertEqual(
+            [[image.nvr for image in chain] for chain in chains],
+            [['leaf-1-1', 'parent-1-1'], ['leaf-1-1'], ['leaf-2-1', 'parent-1-1'], ['leaf-3-1']])
+        # The shared parent is queried and resolved just once.
+        self.assertIs(chains[0][1], chains[2][1])
+        resolve.assert_called_once_with(lb, [leaf_1])
+        get_images_by_nvrs.assert_has_calls([
+            call(['parent-1-1', 'missing-1-1'], published=None),
+            call(['missing-base-1-1'], published=None),
+        ])
+        self.assertIs(leaf_1['parent'], parent)
+        self.assertNotIn('parent', leaf_3)
+        self.assertIsNone(parent['parent'])
+        self.assertEqual(
+            parent['error'],
+            "Couldn't find parent image missing-base-1-1. Lightblue data is probably incomplete")
+
+    @patch('freshmaker.lightblue.LightBlue.get_images_by_nvrs')
+    @patch('freshmaker.lightblue.ContainerImage.resolve')
+    @patch('os.path.exists', return_value=True)
+    def test_iter_parent_chains(self, exists, resolve, get_images_by_nvrs):
+        def _image(nvr, parent_nvr, rpm_names):
+            return ContainerImage.create({
+                'brew': {'build': nvr},
+                'parent_brew_build': parent_nvr,
+                'parent_image_builds': {},
+                'rpm_manifest': [{'rpms': [{'name': name} for name in rpm_names]}],
+            })
+
+        base = _image('base-1-1', None, ['openssl', 'httpd'])
+        leaf_1 = _image('leaf-1-1', None, ['openssl', 'httpd'])
+        leaf_2 = _image('leaf-2-1', 'parent-1-1', ['openssl', 'httpd', 'perl'])
+        parent = _image('parent-1-1', 'base-1-1', ['openssl', 'httpd'])
+        get_images_by_nvrs.side_effect = [[parent], [base]]
+
+        lb = LightBlue(server_url=self.fake_server_url,
+                       cert=self.fake_cert_file,
+                       private_key=self.fake_private_key)
+        chains = lb._iter_parent_chains([leaf_1, leaf_2], ['openssl', 'httpd', 'perl'])
+
+        # The leaf-1-1 chains are complete after the first layer, so they are
+        # generated before the next layer is queried. The chains of single
+        # image which are the same for more RPM names are generated once.
+        self.assertEqual([image.nvr for image in next(chains)], ['leaf-1-1'])
+        self.assertEqual(get_images_by_nvrs.call_count, 1)
+        self.assertEqual(
+            [[image.nvr for image in chain] for chain in chains],
+            [['leaf-2-1', 'parent-1-1', 'base-1-1'], ['leaf-2-1']])
+        self.assertEqual(get_images_by_nvrs.call_count, 2)
 
     @patch("freshmaker.lightblue.ContainerImage.resolve_published")
     @patch("freshmaker.lightblue.LightBlue.get_images_by_nvrs")
@@ -1789,12 +2251,12 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
     @patch('freshmaker.lightblue.LightBlue.find_all_container_repositories')
     @patch('freshmaker.lightblue.LightBlue.get_images_by_nvrs')
     @patch('freshmaker.lightblue.LightBlue.find_images_with_packages_from_content_set')
-    @patch('freshmaker.lightblue.LightBlue.find_parent_images_with_package')
+    @patch('freshmaker.lightblue.ContainerImage.resolve')
     @patch('freshmaker.lightblue.LightBlue._filter_out_already_fixed_published_images')
     @patch('os.path.exists')
     def test_parent_images_with_package_using_field_parent_brew_build_parent_empty(
             self, exists, _filter_out_already_fixed_published_images,
-            find_parent_images_with_package, find_images_with_packages_from_content_set,
+            resolve, find_images_with_packages_from_content_set,
             cont_images, find_repos):
         exists.return_value = True
         find_repos.return_value = {}
@@ -1812,9 +2274,13 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
             }]
         })
 
-        find_parent_images_with_package.return_value = []
         find_images_with_packages_from_content_set.return_value = [image_a]
-        cont_images.side_effect = [self.fake_container_images_with_parent_brew_build, [], []]
+        # The parent image does not contain the "dummy" package.
+        parent_image = ContainerImage.create(
+            copy.deepcopy(self.fake_images_with_parent_brew_build[0]))
+        parent_image["brew"]["build"] = "some-original-nvr-7.6-252.1561619826"
+        parent_image["parent_brew_build"] = None
+        cont_images.side_effect = [[parent_image], [], []]
 
         lb = LightBlue(server_url=self.fake_server_url,
                        cert=self.fake_cert_file,
@@ -1822,17 +2288,17 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
         ret = lb.find_images_to_rebuild(["dummy-1-1"], ["dummy"])
 
         self.assertEqual(len(ret), 1)
-        self.assertIsNotNone(ret[0][0].get("parent"))
+        self.assertEqual(ret[0][0].get("parent"), parent_image)
 
     @patch('freshmaker.lightblue.LightBlue.find_all_container_repositories')
     @patch('freshmaker.lightblue.LightBlue.get_images_by_nvrs')
     @patch('freshmaker.lightblue.LightBlue.find_images_with_packages_from_content_set')
-    @patch('freshmaker.lightblue.LightBlue.find_parent_images_with_package')
+    @patch('freshmaker.lightblue.ContainerImage.resolve')
     @patch('freshmaker.lightblue.LightBlue._filter_out_already_fixed_published_images')
     @patch('os.path.exists')
     def test_dedupe_dependency_images_with_all_repositories(
             self, exists, _filter_out_already_fixed_published_images,
-            find_parent_images_with_package, find_images_with_packages_from_content_set,
+            resolve, find_images_with_packages_from_content_set,
             get_images_by_nvrs, find_repos):
         exists.return_value = True
         find_repos.return_value = {}
@@ -1889,25 +2355,13 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
             }]
         })
 
-        def fake_find_parent_images_with_package(image, *args, **kwargs):
-            parents = {
-                directly_affected_ubi_image.nvr: directly_affected_ubi_image,
-                dependency_ubi_image.nvr: dependency_ubi_image,
-            }
-            parent = parents.get(image.get("parent_brew_build"))
-            if parent:
-                return [parent]
-            return []
-
-        find_parent_images_with_package.side_effect = fake_find_parent_images_with_package
-
         find_images_with_packages_from_content_set.return_value = [
             directly_affected_ubi_image, python_image, nodejs_image,
         ]
 
         def fake_get_images_by_nvrs(nvrs, **kwargs):
-            if nvrs == [dependency_ubi_image.nvr]:
-                return [dependency_ubi_image]
+            if sorted(nvrs) == sorted([directly_affected_ubi_image.nvr, dependency_ubi_image.nvr]):
+                return [dependency_ubi_image, directly_affected_ubi_image]
             elif nvrs == [directly_affected_ubi_image.nvr]:
                 return [directly_affected_ubi_image]
             raise ValueError("Unexpected test data, {}".format(nvrs))
@@ -2029,7 +2483,6 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
                     {'$or': [{'field': 'rpm_manifest.*.rpms.*.name', 'rvalue': 'openssl', 'op': '='}]}]},
              'projection': [{'field': 'brew', 'include': True, 'recursive': True},
                             {'field': 'parsed_data.files', 'include': True, 'recursive': True},
-                            {'field': 'parsed_data.layers.*', 'include': True, 'recursive': True},
                             {'field': 'repositories.*.published', 'include': True, 'recursive': True},
                             {'field': 'repositories.*.registry', 'include': True, 'recursive': True},
                             {'field': 'repositories.*.repository', 'include': True, 'recursive': True},
@@ -2232,6 +2685,90 @@ class TestQueryEntityFromLightBlue(helpers.FreshmakerTestCase):
 
         self.assertEqual(ret, [find_images.return_value[1]])
 
+    @patch.object(freshmaker.conf, 'lightblue_nvrs_chunk_size', new=2)
+    @patch('freshmaker.lightblue.LightBlue.find_container_images')
+    @patch('os.path.exists', return_value=True)
+    def test_get_images_by_nvrs_in_chunks(self, exists, find_images):
+        def fake_find_container_images(request):
+            nvrs = [c["rvalue"] for c in request["query"]["$and"][0]["$or"]]
+            return [ContainerImage.create({"brew": {"build": nvr}}) for nvr in nvrs]
+
+        find_images.side_effect = fake_find_container_images
+
+        lb = LightBlue(server_url=self.fake_server_url,
+                       cert=self.fake_cert_file,
+                       private_key=self.fake_private_key)
+        nvrs = ["foo-1-1", "foo-1-2", "bar-1-1", "foo-1-2", "baz-1-1"]
+        images = lb.get_images_by_nvrs(nvrs)
+
+        self.assertEqual(find_images.call_count, 2)
+        queried_nvrs = [
+            [c["rvalue"] for c in call_args[0][0]["query"]["$and"][0]["$or"]]
+            for call_args in find_images.call_args_list]
+        self.assertEqual(
+            sorted(queried_nvrs), [["bar-1-1", "baz-1-1"], ["foo-1-1", "foo-1-2"]])
+        self.assertEqual(
+            [image.nvr for image in images], ["foo-1-2", "foo-1-1", "baz-1-1", "bar-1-1"])
+
+    @patch.object(freshmaker.conf, 'lightblue_nvrs_chunk_size', new=2)
+    @patch('freshmaker.lightblue.LightBlue.find_container_images')
+    @patch('os.path.exists', return_value=True)
+    def test_get_images_by_nvrs_in_chunks_in_pool_thread(self, exists, find_images):
+        threads = set()
+
+        def fake_find_container_images(request):
+            threads.add(threading.get_ident())
+            nvrs = [c["rvalue"] for c in request["query"]["$and"][0]["$or"]]
+            return [ContainerImage.create({"brew": {"build": nvr}}) for nvr in nvrs]
+
+        find_images.side_effect = fake_find_container_images
+
+        lb = LightBlue(server_url=self.fake_server_url,
+                       cert=self.fake_cert_file,
+                       private_key=self.fake_private_key)
+        nvrs = ["foo-1-1", "foo-1-2", "bar-1-1", "baz-1-1"]
+        with ThreadPoolExecutor(max_workers=1, initializer=_init_pool_thread) as executor:
+            images, worker = executor.submit(
+                lambda: (lb.get_images_by_nvrs(nvrs), threading.get_ident())).result()
+
+        # The chunks are queried serially by the thread pool worker itself.
+        self.assertEqual(find_images.call_count, 2)
+        self.assertEqual(threads, {worker})
+        self.assertEqual(
+            [image.nvr for image in images], ["foo-1-2", "foo-1-1", "baz-1-1", "bar-1-1"])
+
+    @patch('freshmaker.lightblue.LightBlue.get_images_by_nvrs')
+    @patch('os.path.exists', return_value=True)
+    def test_get_images_by_nvrs_batch(self, exists, get_images_by_nvrs):
+        get_images_by_nvrs.return_value = [
+            ContainerImage.create({"brew": {"build": "foo-1-1"}}),
+            ContainerImage.create({"brew": {"build": "bar-1-1"}}),
+        ]
+
+        lb = LightBlue(server_url=self.fake_server_url,
+                       cert=self.fake_cert_file,
+                       private_key=self.fake_private_key)
+        images = lb.get_images_by_nvrs_batch(
+            ["foo-1-1", "missing-1-1", "bar-1-1", "foo-1-1"], published=None)
+
+        get_images_by_nvrs.assert_called_once_with(
+            ["foo-1-1", "missing-1-1", "bar-1-1"], published=None,
+            include_rpm_manifest=True)
+        self.assertEqual(images[0].nvr, "foo-1-1")
+        self.assertIsNone(images[1])
+        self.assertEqual(images[2].nvr, "bar-1-1")
+        self.assertEqual(images[3].nvr, "foo-1-1")
+        # Every caller gets its own ContainerImage.
+        self.assertIsNot(images[0], images[3])
+        self.assertIsInstance(images[3], ContainerImage)
+
+    @patch('os.path.exists', return_value=True)
+    def test_get_images_by_nvrs_batch_empty(self, exists):
+        lb = LightBlue(server_url=self.fake_server_url,
+                       cert=self.fake_cert_file,
+                       private_key=self.fake_private_key)
+        self.assertEqual(lb.get_images_by_nvrs_batch([]), [])
+
 
 class TestEntityVersion(helpers.FreshmakerTestCase):
     """Test case for ensuring correct entity version in request"""
@@ -2709,6 +3246,146 @@ class TestDeduplicateImagesToRebuild(helpers.FreshmakerTestCase):
                 ret = self.lb._deduplicate_images_to_rebuild([httpd, perl])
                 self.assertEqual(ret, expected_images)
 
+    def test_add_chains(self):
+        httpd = self._create_imgs([
+            "httpd-2.4-12",
+            "s2i-base-1-10",
+        ])
+        perl = self._create_imgs([
+            "perl-5.7-1",
+            "s2i-base-1-2",
+        ])
+
+        deduplicator = ImageChainsDeduplicator(self.lb)
+        deduplicator.add(httpd)
+        deduplicator.add(perl)
+        ret = deduplicator.deduplicate()
+
+        self.assertEqual(ret, [httpd, perl])
+        self.assertEqual(perl[1].nvr, "s2i-base-1-10")
+        self.assertEqual(perl[0]["parent"].nvr, "s2i-base-1-10")
+
+    def _create_random_chains(self, rand):
+        """
+        Returns random chains of images sharing the parent images the same
+        way as the chains returned by LightBlue._find_parent_chains.
+        """
+        # The images are built in layers, so the image can only be built
+        # on top of the image from the lower layer.
+        layers = [["rhel"], ["s2i-core", "s2i-base"], ["httpd", "perl"]]
+        all_images = []
+        images = []
+        for names in layers:
+            lower_images = images
+            images = []
+            for i in range(rand.randint(1, 8)):
+                release = rand.randint(1, 6)
+                image = self._create_img("%s-%s-%d" % (
+                    rand.choice(names), rand.choice(["1", "1.1", "2"]), release))
+                # The repositories must be the same for all the images with
+                # the same NVR, because describe_image_group is cached by NVR.
+                image["repositories"] = [{"repository": "product/repo%d" % (release % 2)}]
+                if rand.random() < 0.2:
+                    image["latest_released"] = True
+                if rand.random() < 0.3:
+                    image["content_sets"] = [rand.choice(["foo", "bar"])]
+                    image["content_sets_source"] = rand.choice(["distgit", "child_image"])
+                if lower_images and rand.random() < 0.8:
+                    image["parent"] = rand.choice(lower_images)
+                images.append(image)
+            all_images += images
+
+        chains = []
+        for i in range(rand.randint(1, 10)):
+            chain = [rand.choice(all_images)]
+            while chain[-1].get("parent"):
+                chain.append(chain[-1]["parent"])
+            chains.append(chain)
+        return chains
+
+    def test_deduplicate_random_chains(self):
+        rand = random.Random(0)
+        for i in range(300):
+            chains = self._create_random_chains(rand)
+            for val in [True, False]:
+                with patch.object(freshmaker.conf, 'lightblue_released_dependencies_only', new=val):
+                    expected = _deduplicate_images_to_rebuild_reference(
+                        self.lb, copy.deepcopy(chains))
+                    deduplicator = ImageChainsDeduplicator(self.lb)
+                    for chain in copy.deepcopy(chains):
+                        deduplicator.add(chain)
+                    self.assertEqual(deduplicator.deduplicate(), expected)
+
+
+def _deduplicate_images_to_rebuild_reference(lb, to_rebuild):
+    """
+    Straightforward implementation of LightBlue._deduplicate_images_to_rebuild
+    which indexes and sorts all the images in both phases.
+    """
+    for phase in ["handle_parent_change", "update_to_latest"]:
+        nvr_to_coordinates = {}
+        image_group_to_nvrs = {}
+        nvr_to_image = {}
+        image_group_to_latest_released_nvr = {}
+
+        for image_id, images in enumerate(to_rebuild):
+            for parent_id, image in enumerate(images):
+                image_group = lb.describe_image_group(image)
+                image_group_to_nvrs.setdefault(image_group, [])
+                if image.nvr not in image_group_to_nvrs[image_group]:
+                    image_group_to_nvrs[image_group].append(image.nvr)
+                nvr_to_coordinates.setdefault(image.nvr, []).append([image_id, parent_id])
+                nvr_to_image[image.nvr] = image
+                if image.get("latest_released"):
+                    image_group_to_latest_released_nvr[image_group] = image.nvr
+
+        for image_group in image_group_to_nvrs.keys():
+            image_group_to_nvrs[image_group] = sorted_by_nvr(
+                image_group_to_nvrs[image_group], reverse=True)
+            latest_content_sets = []
+            for nvr in reversed(image_group_to_nvrs[image_group]):
+                image = nvr_to_image[nvr]
+                if not image.get("content_sets") or "content_sets_source" not in image:
+                    image["content_sets"] = latest_content_sets
+                elif image["content_sets_source"] == "child_image":
+                    if latest_content_sets:
+                        image["content_sets"] = latest_content_sets
+                else:
+                    latest_content_sets = image["content_sets"]
+
+        for image_group, nvrs in image_group_to_nvrs.items():
+            if image_group in image_group_to_latest_released_nvr:
+                latest_released_nvr = image_group_to_latest_released_nvr[image_group]
+            else:
+                latest_released_nvr = nvrs[0]
+            if not freshmaker.conf.lightblue_released_dependencies_only:
+                latest_released_nvr_index = nvrs.index(latest_released_nvr)
+            else:
+                latest_released_nvr_index = -1
+
+            if phase == "handle_parent_change":
+                latest_image = nvr_to_image[latest_released_nvr]
+                if not latest_image.get("parent"):
+                    continue
+                latest_parent = koji.parse_NVR(latest_image["parent"].nvr)
+                for nvr in nvrs[latest_released_nvr_index + 1:]:
+                    image = nvr_to_image[nvr]
+                    if not image.get("parent"):
+                        continue
+                    parent = koji.parse_NVR(image["parent"].nvr)
+                    if ((parent["name"], parent["version"]) !=
+                            (latest_parent["name"], latest_parent["version"])):
+                        for image_id, parent_id in nvr_to_coordinates[nvr]:
+                            latest_image_id, latest_parent_id = nvr_to_coordinates[latest_released_nvr][0]
+                            to_rebuild[image_id][parent_id:] = to_rebuild[latest_image_id][latest_parent_id:]
+            else:
+                for nvr in nvrs[latest_released_nvr_index + 1:]:
+                    for image_id, parent_id in nvr_to_coordinates[nvr]:
+                        to_rebuild[image_id][parent_id] = nvr_to_image[latest_released_nvr]
+                        if parent_id != 0:
+                            to_rebuild[image_id][parent_id - 1]["parent"] = nvr_to_image[latest_released_nvr]
+    return to_rebuild
+
 
 @patch('os.path.exists', return_value=True)
 @patch('freshmaker.lightblue.LightBlue.get_fixed_published_image')
@@ -429,3 +429,33 @@ class TestEventDependency(helpers.ModelsTestCase):
 
         self.assertEqual(event.id, dep_rel.event_id)
         self.assertEqual(event1.id, dep_rel.event_dependency_id)
+
+    def test_get_artifact_builds_from_event_dependencies(self):
+        event = Event.create(db.session, "test_msg_id", "test", events.TestingEvent)
+        event1 = Event.create(db.session, "test_msg_id2", "test2", events.TestingEvent)
+        event2 = Event.create(db.session, "test_msg_id3", "test3", events.TestingEvent)
+        build1 = ArtifactBuild.create(
+            db.session, event1, "foo", "image", original_nvr="foo-1-1",
+            state=ArtifactBuildState.DONE.value)
+        ArtifactBuild.create(
+            db.session, event1, "bar", "image", original_nvr="bar-1-1",
+            state=ArtifactBuildState.FAILED.value)
+        ArtifactBuild.create(
+            db.session, event2, "foo", "image", original_nvr="foo-1-1",
+            state=ArtifactBuildState.DONE.value)
+        build2 = ArtifactBuild.create(
+            db.session, event2, "bar", "image", original_nvr="bar-1-1",
+            state=ArtifactBuildState.DONE.value)
+        db.session.commit()
+        event.add_event_dependency(db.session, event1)
+        event.add_event_dependency(db.session, event2)
+        db.session.commit()
+
+        builds = event.get_artifact_builds_from_event_dependencies(
+            ["foo-1-1", "bar-1-1", "baz-1-1"])
+
+        self.assertEqual(builds, {"foo-1-1": [build1], "bar-1-1": [build2]})
+        for nvr in ["foo-1-1", "bar-1-1", "baz-1-1"]:
+            self.assertEqual(
+                builds.get(nvr),
+                event.get_artifact_build_from_event_dependencies(nvr))
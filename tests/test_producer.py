@@ -56,13 +56,13 @@ class TestCheckUnfinishedKojiTasks(helpers.ModelsTestCase):
     def tearDown(self):
         self.koji_read_config_patcher.stop()
 
-    @patch('freshmaker.kojiservice.KojiService.get_task_info')
+    @patch('freshmaker.kojiservice.KojiService.get_tasks_info')
     @patch('freshmaker.consumer.get_global_consumer')
-    def test_koji_task_failed(self, global_consumer, get_task_info):
+    def test_koji_task_failed(self, global_consumer, get_tasks_info):
         consumer = self.create_consumer()
         global_consumer.return_value = consumer
 
-        get_task_info.return_value = {'state': koji.TASK_STATES['FAILED']}
+        get_tasks_info.return_value = [{'state': koji.TASK_STATES['FAILED']}]
 
         hub = MagicMock()
         producer = FreshmakerProducer(hub)
@@ -71,13 +71,13 @@ class TestCheckUnfinishedKojiTasks(helpers.ModelsTestCase):
         self.assertEqual(event.task_id, 10)
         self.assertEqual(event.new_state, "FAILED")
 
-    @patch('freshmaker.kojiservice.KojiService.get_task_info')
+    @patch('freshmaker.kojiservice.KojiService.get_tasks_info')
     @patch('freshmaker.consumer.get_global_consumer')
-    def test_koji_task_closed(self, global_consumer, get_task_info):
+    def test_koji_task_closed(self, global_consumer, get_tasks_info):
         consumer = self.create_consumer()
         global_consumer.return_value = consumer
 
-        get_task_info.return_value = {'state': koji.TASK_STATES['CLOSED']}
+        get_tasks_info.return_value = [{'state': koji.TASK_STATES['CLOSED']}]
 
         hub = MagicMock()
         producer = FreshmakerProducer(hub)
@@ -86,44 +86,80 @@ class TestCheckUnfinishedKojiTasks(helpers.ModelsTestCase):
         self.assertEqual(event.task_id, 10)
         self.assertEqual(event.new_state, "CLOSED")
 
-    @patch('freshmaker.kojiservice.KojiService.get_task_info')
+    @patch('freshmaker.kojiservice.KojiService.get_tasks_info')
     @patch('freshmaker.consumer.get_global_consumer')
-    def test_koji_task_dry_run(self, global_consumer, get_task_info):
+    def test_koji_tasks_checked_in_batch(self, global_consumer, get_tasks_info):
+        consumer = self.create_consumer()
+        global_consumer.return_value = consumer
+
+        db_event = Event.get_or_create(
+            db.session, "msg2", "another_event", ErrataAdvisoryRPMsSignedEvent)
+        db_event.state = EventState.BUILDING
+        build = ArtifactBuild.create(db.session, db_event, "parent2-1-4", "image")
+        build.state = ArtifactBuildState.BUILD
+        build.build_id = 20
+        build = ArtifactBuild.create(db.session, db_event, "parent3-1-4", "image")
+        build.state = ArtifactBuildState.DONE
+        build.build_id = 30
+        db_event = Event.get_or_create(
+            db.session, "msg3", "complete_event", ErrataAdvisoryRPMsSignedEvent)
+        db_event.state = EventState.COMPLETE
+        build = ArtifactBuild.create(db.session, db_event, "parent4-1-4", "image")
+        build.state = ArtifactBuildState.BUILD
+        build.build_id = 40
+        db.session.commit()
+
+        get_tasks_info.return_value = [
+            {'state': koji.TASK_STATES['OPEN']},
+            {'state': koji.TASK_STATES['CLOSED']}]
+
+        hub = MagicMock()
+        producer = FreshmakerProducer(hub)
+        producer.check_unfinished_koji_tasks(db.session)
+        get_tasks_info.assert_called_once_with([10, 20])
+        event = consumer.incoming.get()
+        self.assertEqual(event.task_id, 20)
+        self.assertEqual(event.new_state, "CLOSED")
+        self.assertRaises(queue.Empty, consumer.incoming.get, block=False)
+
+    @patch('freshmaker.kojiservice.KojiService.get_tasks_info')
+    @patch('freshmaker.consumer.get_global_consumer')
+    def test_koji_task_dry_run(self, global_consumer, get_tasks_info):
         self.build.build_id = -10
         consumer = self.create_consumer()
         global_consumer.return_value = consumer
 
-        get_task_info.return_value = {'state': koji.TASK_STATES['CLOSED']}
+        get_tasks_info.return_value = [{'state': koji.TASK_STATES['CLOSED']}]
 
         hub = MagicMock()
         producer = FreshmakerProducer(hub)
         producer.check_unfinished_koji_tasks(db.session)
         self.assertRaises(queue.Empty, consumer.incoming.get, block=False)
 
-    @patch('freshmaker.kojiservice.KojiService.get_task_info')
+    @patch('freshmaker.kojiservice.KojiService.get_tasks_info')
     @patch('freshmaker.consumer.get_global_consumer')
-    def test_koji_task_open(self, global_consumer, get_task_info):
+    def test_koji_task_open(self, global_consumer, get_tasks_info):
         self.build.build_id = -10
         consumer = self.create_consumer()
         global_consumer.return_value = consumer
 
-        get_task_info.return_value = {'state': koji.TASK_STATES['OPEN']}
+        get_tasks_info.return_value = [{'state': koji.TASK_STATES['OPEN']}]
 
         hub = MagicMock()
         producer = FreshmakerProducer(hub)
         producer.check_unfinished_koji_tasks(db.session)
         self.assertRaises(queue.Empty, consumer.incoming.get, block=False)
 
-    @patch('freshmaker.kojiservice.KojiService.get_task_info')
+    @patch('freshmaker.kojiservice.KojiService.get_tasks_info')
     @patch('freshmaker.consumer.get_global_consumer')
-    def test_koji_invalid_request(self, global_consumer, get_task_info):
+    def test_koji_invalid_request(self, global_consumer, get_tasks_info):
         from sqlalchemy.exc import StatementError, InvalidRequestError
         from sqlalchemy import select
         self.build.build_id = -10
         consumer = self.create_consumer()
         global_consumer.return_value = consumer
 
-        get_task_info.return_value = {'state': koji.TASK_STATES['OPEN']}
+        get_tasks_info.return_value = [{'state': koji.TASK_STATES['OPEN']}]
 
         hub = MagicMock()
         producer = FreshmakerProducer(hub)
@@ -22,11 +22,13 @@
 
 from unittest.mock import patch
 
+import kobo.rpmlib
 import pytest
 
 from freshmaker import conf
 from freshmaker.models import ArtifactType
-from freshmaker.utils import get_rebuilt_nvr, sorted_by_nvr
+from freshmaker.utils import (
+    get_rebuilt_nvr, parse_nvr, parse_nvra, sorted_by_nvr, RateLimiter)
 from tests import helpers
 
 
@@ -72,3 +74,77 @@ class TestSortedByNVR(helpers.FreshmakerTestCase):
         expected = ["bar-1-2", "foo-1-1", "foo-1-10"]
         ret = sorted_by_nvr(lst, reverse=True)
         self.assertEqual(ret, list(reversed(expected)))
+
+    def test_rpmvercmp_ordering(self):
+        lst = ["foo-1.0-1", "foo-1.0~rc1-1", "foo-1.0^git1-1", "foo-1.0a-1",
+               "foo-1.01-1", "foo-1.0.1-1", "foo-1:0.1-1", "foo-1.0-1.el8"]
+        expected = ["foo-1.0~rc1-1", "foo-1.0-1", "foo-1.0-1.el8",
+                    "foo-1.0^git1-1", "foo-1.0a-1", "foo-1.0.1-1",
+                    "foo-1.01-1", "foo-1:0.1-1"]
+        ret = sorted_by_nvr(lst)
+        self.assertEqual(ret, expected)
+
+    def test_same_as_compare_nvr(self):
+        lst = ["foo-1.0-1", "foo-1.0~rc1-1", "foo-1.0^git1-1", "foo-1.0a-1",
+               "foo-1.01-1", "foo-01.1-1", "foo-1.1-1", "foo-1.0.1-1",
+               "foo-1:0.1-1", "foo-0:1.0-1", "foo-1.0-1.el8", "foo-1.0-1_el8",
+               "foo-2-10", "foo-2-9", "foo-2-9a"]
+
+        def _compare(nvr1, nvr2):
+            return kobo.rpmlib.compare_nvr(
+                kobo.rpmlib.parse_nvr(nvr1), kobo.rpmlib.parse_nvr(nvr2))
+
+        for nvr1 in lst:
+            for nvr2 in lst:
+                key1 = parse_nvr(nvr1).sort_key
+                key2 = parse_nvr(nvr2).sort_key
+                self.assertEqual(
+                    (key1 > key2) - (key1 < key2), _compare(nvr1, nvr2),
+                    "%s vs %s" % (nvr1, nvr2))
+
+    def test_parse_nvr_cached(self):
+        parse_nvr.cache_clear()
+        nvr = parse_nvr("foo-1-1")
+        self.assertEqual(nvr, ("foo", "1", "1", ""))
+        self.assertIs(parse_nvr("foo-1-1"), nvr)
+        self.assertEqual(parse_nvr.cache_info().hits, 1)
+
+    def test_parse_nvr_invalid(self):
+        self.assertRaises(ValueError, parse_nvr, "foo-1")
+
+    def test_parse_nvra(self):
+        nvr = parse_nvra("foo-1.0-1.el8.x86_64")
+        self.assertEqual(nvr, ("foo", "1.0", "1.el8", ""))
+        self.assertIs(parse_nvra("foo-1.0-1.el8.x86_64"), nvr)
+
+    def test_version_release_key(self):
+        nvrs = ["foo-1.0-1", "1:foo-1.0-2", "foo-1.0~rc-9", "2:foo-1.0-1"]
+        for nvr1 in nvrs:
+            for nvr2 in nvrs:
+                key1 = parse_nvr(nvr1).version_release_key
+                key2 = parse_nvr(nvr2).version_release_key
+                self.assertEqual(
+                    (key1 > key2) - (key1 < key2),
+                    kobo.rpmlib.compare_nvr(
+                        kobo.rpmlib.parse_nvr(nvr1), kobo.rpmlib.parse_nvr(nvr2),
+                        ignore_epoch=True))
+
+
+class TestRateLimiter(helpers.FreshmakerTestCase):
+
+    @patch('time.sleep')
+    @patch('time.monotonic')
+    def test_wait(self, monotonic, sleep):
+        monotonic.side_effect = [100.0, 100.0, 100.1, 100.2, 101.0]
+        limiter = RateLimiter(5)
+        for _ in range(4):
+            limiter.wait()
+        self.assertEqual(
+            [round(c[0][0], 6) for c in sleep.call_args_list], [0.1, 0.2])
+
+    @patch('time.sleep')
+    def test_wait_unlimited(self, sleep):
+        limiter = RateLimiter(0)
+        for _ in range(10):
+            limiter.wait()
+        sleep.assert_not_called()
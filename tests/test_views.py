@@ -25,10 +25,13 @@ import json
 import datetime
 import contextlib
 import flask
+import sqlalchemy
 
 from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
 
 from freshmaker import app, db, events, models, login_manager
+from freshmaker.api_utils import ResponseCache, response_cache
 from freshmaker.types import ArtifactType, ArtifactBuildState, EventState
 from freshmaker.errata import ErrataAdvisory
 import freshmaker.auth
@@ -331,6 +334,54 @@ class TestViews(helpers.ModelsTestCase):
         self.assertTrue(meta['prev'] is None)
         self.assertTrue(meta['next'] is None)
 
+    def test_query_builds_after_id(self):
+        resp = self.client.get('/api/2/builds/?per_page=1&after_id=3')
+        data = resp.json
+        self.assertEqual([b['id'] for b in data['items']], [2])
+        meta = data['meta']
+        self.assertEqual(meta['total'], 3)
+        self.assertIsNone(meta['prev'])
+        self.assertIn('after_id=2', meta['next'])
+        self.assertNotIn('page', parse_qs(urlparse(meta['next']).query))
+
+        resp = self.client.get('/api/2/builds/?per_page=2&after_id=2')
+        data = resp.json
+        self.assertEqual([b['id'] for b in data['items']], [1])
+        self.assertIsNone(data['meta']['next'])
+
+    def test_query_builds_after_id_order_by_id_asc(self):
+        resp = self.client.get('/api/2/builds/?per_page=1&after_id=1&order_by=id')
+        data = resp.json
+        self.assertEqual([b['id'] for b in data['items']], [2])
+        self.assertIn('after_id=2', data['meta']['next'])
+
+    def test_query_builds_after_id_invalid_order_by(self):
+        resp = self.client.get('/api/2/builds/?after_id=1&order_by=name')
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn('after_id', resp.json['message'])
+
+    def test_query_builds_without_total(self):
+        resp = self.client.get('/api/2/builds/?per_page=2&show_total=False')
+        data = resp.json
+        self.assertEqual([b['id'] for b in data['items']], [3, 2])
+        meta = data['meta']
+        for key in ['total', 'pages', 'last', 'prev']:
+            self.assertIsNone(meta[key])
+        self.assertIn('after_id=2', meta['next'])
+        self.assertIn('show_total=False', meta['next'])
+
+        resp = self.client.get(meta['next'])
+        data = resp.json
+        self.assertEqual([b['id'] for b in data['items']], [1])
+        self.assertIsNone(data['meta']['next'])
+
+    def test_query_builds_without_total_order_by_name(self):
+        resp = self.client.get('/api/2/builds/?per_page=2&show_total=False&order_by=name')
+        data = resp.json
+        self.assertEqual([b['name'] for b in data['items']], ['bash', 'ed'])
+        self.assertIn('page=2', data['meta']['next'])
+        self.assertNotIn('after_id', data['meta']['next'])
+
     def test_query_event(self):
         resp = self.client.get('/api/1/events/1')
         data = resp.json
@@ -517,6 +568,158 @@ class TestViews(helpers.ModelsTestCase):
         self.assertTrue(meta['prev'] is None)
         self.assertTrue(meta['next'] is None)
 
+    def test_query_events_after_id_without_total(self):
+        resp = self.client.get('/api/2/events/?per_page=1&after_id=2&show_total=False')
+        data = resp.json
+        self.assertEqual([e['id'] for e in data['items']], [1])
+        self.assertIsNone(data['meta']['total'])
+        self.assertIsNone(data['meta']['next'])
+
+    def test_export_builds(self):
+        resp = self.client.get('/api/2/export/builds')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.mimetype, 'application/x-ndjson')
+        builds = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([b['id'] for b in builds], [3, 2, 1])
+        self.assertEqual(builds[2]['build_args'], {"key": "value"})
+
+    def test_export_builds_filters_and_order(self):
+        resp = self.client.get('/api/2/export/builds?name=ed&order_by=id&per_page=1')
+        builds = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([b['name'] for b in builds], ['ed'])
+
+        resp = self.client.get('/api/2/export/builds?order_by=name')
+        builds = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([b['name'] for b in builds], ['bash', 'ed', 'mksh'])
+
+    def test_export_builds_invalid_filter(self):
+        resp = self.client.get('/api/2/export/builds?state=foo')
+        self.assertEqual(resp.status_code, 400)
+
+    def test_export_events_in_batches(self):
+        with patch.object(freshmaker.conf, 'api_export_batch_size', new=1):
+            resp = self.client.get('/api/2/export/events?order_by=id')
+            evs = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([e['id'] for e in evs], [1, 2])
+        self.assertEqual(evs[0]['builds_summary'], {'BUILD': 3, 'total': 3})
+        self.assertNotIn('builds', evs[0])
+
+    def test_export_events_full_json(self):
+        resp = self.client.get('/api/2/export/events?show_full_json=True&search_key=101')
+        evs = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual(len(evs), 1)
+        self.assertEqual(sorted(b['name'] for b in evs[0]['builds']), ['bash', 'ed', 'mksh'])
+
+    def test_export_events_full_json_event_by_event(self):
+        with patch('freshmaker.models.Event.json_many',
+                   wraps=models.Event.json_many) as json_many:
+            resp = self.client.get('/api/2/export/events?show_full_json=True&order_by=id')
+            evs = [json.loads(line) for line in resp.get_data(as_text=True).splitlines()]
+        self.assertEqual([e['id'] for e in evs], [1, 2])
+        self.assertEqual(len(evs[0]['builds']), 3)
+        # The builds are loaded for single event at a time.
+        self.assertEqual(json_many.call_count, 2)
+        for call_args in json_many.call_args_list:
+            self.assertEqual(len(call_args[0][0]), 1)
+
+    def test_export_not_in_api_v1(self):
+        rules = [rule.rule for rule in app.url_map.iter_rules()]
+        self.assertIn('/api/2/export/builds', rules)
+        self.assertNotIn('/api/1/export/builds', rules)
+
+    def _set_event_state(self, event_id, state):
+        event = models.Event.query.get(event_id)
+        event.state = state
+        event.time_done = datetime.datetime(2020, 1, 1, 10, 0, 0, 123)
+        db.session.commit()
+
+    def test_query_event_terminal_state_cache_headers(self):
+        self._set_event_state(1, EventState.COMPLETE.value)
+        resp = self.client.get('/api/2/events/1')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNotNone(resp.headers.get('ETag'))
+        # The builds and depending events can change after the event is done.
+        self.assertIsNone(resp.headers.get('Last-Modified'))
+        self.assertTrue(resp.cache_control.no_cache)
+        self.assertIsNone(resp.cache_control.max_age)
+
+    @patch('freshmaker.models.Event.json_min_many')
+    def test_query_event_not_modified(self, json_min_many):
+        self._set_event_state(1, EventState.COMPLETE.value)
+        json_min_many.return_value = [{'id': 1}]
+        etag = self.client.get('/api/2/events/1').headers['ETag']
+
+        resp = self.client.get('/api/2/events/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+        json_min_many.assert_called_once()
+
+        # The event is not revalidated only by the date, because its builds
+        # can change after the event is done.
+        resp = self.client.get(
+            '/api/2/events/1', headers={'If-Modified-Since': 'Wed, 01 Jan 2100 10:00:00 GMT'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_query_event_etag_depends_on_representation(self):
+        self._set_event_state(1, EventState.COMPLETE.value)
+        etag = self.client.get('/api/2/events/1').headers['ETag']
+        resp = self.client.get(
+            '/api/2/events/1?show_full_json=True', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.json['builds']), 3)
+
+    def test_query_event_etag_changes_with_depending_events(self):
+        self._set_event_state(1, EventState.COMPLETE.value)
+        etag = self.client.get('/api/2/events/1').headers['ETag']
+        event = models.Event.query.get(2)
+        event.add_event_dependency(db.session, models.Event.query.get(1))
+        db.session.commit()
+
+        resp = self.client.get('/api/2/events/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json['depending_events'], [2])
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_query_event_etag_changes_with_build_state(self):
+        self._set_event_state(1, EventState.COMPLETE.value)
+        etag = self.client.get('/api/2/events/1').headers['ETag']
+
+        # Re-triggered build changes only its state and state_reason.
+        build = models.ArtifactBuild.query.filter_by(event_id=1).first()
+        build.state = ArtifactBuildState.PLANNED.value
+        build.state_reason = "Re-triggered"
+        db.session.commit()
+
+        resp = self.client.get('/api/2/events/1', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_query_event_not_in_terminal_state(self):
+        resp = self.client.get('/api/2/events/1')
+        self.assertEqual(resp.status_code, 200)
+        self.assertIsNone(resp.headers.get('ETag'))
+        self.assertEqual(resp.cache_control.max_age, 10)
+
+        resp = self.client.get('/api/2/events/1', headers={'If-Modified-Since': 'Wed, 01 Jan 2100 10:00:00 GMT'})
+        self.assertEqual(resp.status_code, 200)
+
+    def test_query_build_not_modified(self):
+        build = models.ArtifactBuild.query.get(1)
+        build.transition(ArtifactBuildState.DONE.value, "Built successfully.")
+        db.session.commit()
+        resp = self.client.get('/api/2/builds/1')
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.cache_control.max_age, 86400)
+
+        resp = self.client.get('/api/2/builds/1', headers={'If-None-Match': resp.headers['ETag']})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.get_data(), b'')
+
+    def test_query_build_not_in_terminal_state(self):
+        resp = self.client.get('/api/2/builds/1')
+        self.assertIsNone(resp.headers.get('ETag'))
+        self.assertEqual(resp.cache_control.max_age, 10)
+
     def test_patch_event_missing_action(self):
         resp = self.client.patch(
             '/api/1/events/1',
@@ -593,10 +796,47 @@ class TestViews(helpers.ModelsTestCase):
     def test_about_api(self):
         # Since the version is always changing, let's just mock it to be consistent
         with patch('freshmaker.views.version', '1.0.0'):
-            resp = self.client.get('/api/1/about/')
+            # The about response is prebuilt when the app starts.
+            response_cache.clear()
+            try:
+                resp = self.client.get('/api/1/about/')
+            finally:
+                response_cache.clear()
         data = resp.json
         self.assertEqual(data['version'], '1.0.0')
 
+    def test_query_event_types_cached_etag(self):
+        resp = self.client.get('/api/1/event-types/')
+        self.assertEqual(resp.status_code, 200)
+        etag = resp.headers['ETag']
+
+        resp = self.client.get(
+            '/api/1/event-types/', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertEqual(resp.headers['ETag'], etag)
+
+        resp = self.client.get('/api/1/build-types/', headers={'If-None-Match': etag})
+        self.assertEqual(resp.status_code, 200)
+        self.assertNotEqual(resp.headers['ETag'], etag)
+
+    def test_response_cache_lru_eviction(self):
+        cache = ResponseCache(2)
+        cache.get('a', lambda: {'a': 1})
+        cache.get('b', lambda: {'b': 1})
+        # Use "a", so "b" is the least recently used response.
+        self.assertEqual(cache.get('a', lambda: None).body, b'{"a": 1}\n')
+        cache.get('c', lambda: {'c': 1})
+
+        self.assertEqual(len(cache), 2)
+        self.assertIsNone(cache.get('b', lambda: None))
+        self.assertIsNotNone(cache.get('a', lambda: None))
+        self.assertIsNotNone(cache.get('c', lambda: None))
+
+    def test_response_cache_does_not_store_missing_responses(self):
+        cache = ResponseCache(2)
+        self.assertIsNone(cache.get('a', lambda: None))
+        self.assertEqual(len(cache), 0)
+
     @patch("freshmaker.views.ImageVerifier")
     def test_verify_image(self, verifier):
         verifier.return_value.verify_image.return_value = {"foo-1-1": ["content-set"]}
@@ -630,6 +870,31 @@ class TestViews(helpers.ModelsTestCase):
         }
         self.assertEqual(data, expected)
 
+    @patch("freshmaker.views.ImageVerifier")
+    def test_verify_images(self, verifier):
+        verifier.return_value.verify_images.return_value = {
+            "images": {"foo-1-1": {"content_sets": ["content-set"]}},
+            "repositories": {"foo/bar": {"error": "Cannot get repository foo/bar."}},
+        }
+        resp = self.client.post(
+            "/api/2/verify-images",
+            data=json.dumps({"images": ["foo-1-1"], "repositories": ["foo/bar"]}))
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json, verifier.return_value.verify_images.return_value)
+        verifier.return_value.verify_images.assert_called_once_with(
+            ["foo-1-1"], ["foo/bar"])
+
+    @patch("freshmaker.views.ImageVerifier")
+    def test_verify_images_invalid_request(self, verifier):
+        for data, msg in [
+                ({}, "No images or repositories provided."),
+                ({"images": "foo-1-1"}, '"images" must be an array of strings.'),
+                ({"repositories": [1]}, '"repositories" must be an array of strings.')]:
+            resp = self.client.post("/api/2/verify-images", data=json.dumps(data))
+            self.assertEqual(resp.status_code, 400)
+            self.assertEqual(resp.json["message"], msg)
+        verifier.return_value.verify_images.assert_not_called()
+
     def test_dependencies(self):
         event = models.Event.create(db.session, "2017-00000000-0000-0000-0000-000000000003", "103", events.TestingEvent)
         event1 = models.Event.create(db.session, "2017-00000000-0000-0000-0000-000000000004", "104", events.TestingEvent)
@@ -698,6 +963,79 @@ class TestViewsMultipleFilterValues(helpers.ModelsTestCase):
         self.assertEqual(len(evs), 2)
 
 
+class TestViewsQueryCount(helpers.ModelsTestCase):
+    """
+    Checks that the number of SQL statements needed to render a page of
+    events or builds does not depend on the number of events or builds.
+    """
+
+    def setUp(self):
+        super(TestViewsQueryCount, self).setUp()
+        self.client = app.test_client()
+
+    def _init_data(self, num_events, builds_per_event):
+        compose = models.Compose(odcs_compose_id=len(models.Compose.query.all()) + 1)
+        db.session.add(compose)
+        prev_event = None
+        first_id = models.Event.query.count()
+        for i in range(first_id, first_id + num_events):
+            event = models.Event.create(
+                db.session, "msg-id-%d" % i, str(i), events.TestingEvent)
+            dep_on = None
+            for j in range(builds_per_event):
+                dep_on = models.ArtifactBuild.create(
+                    db.session, event, "image-%d" % j, "image", dep_on=dep_on,
+                    state=ArtifactBuildState.DONE.value if j % 2 else None)
+                db.session.flush()
+                dep_on.add_composes(db.session, [compose])
+            if prev_event:
+                db.session.flush()
+                event.add_event_dependency(db.session, prev_event)
+            prev_event = event
+        db.session.commit()
+        db.session.expire_all()
+
+    @contextlib.contextmanager
+    def _count_queries(self):
+        statements = []
+
+        def before_cursor_execute(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        sqlalchemy.event.listen(db.engine, "before_cursor_execute", before_cursor_execute)
+        try:
+            yield statements
+        finally:
+            sqlalchemy.event.remove(db.engine, "before_cursor_execute", before_cursor_execute)
+
+    def _get_num_queries(self, url):
+        with self._count_queries() as statements:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(statements)
+
+    def test_query_events_full_json(self):
+        url = '/api/2/events/?per_page=10&show_full_json=True'
+        self._init_data(2, 2)
+        self.assertEqual(self._get_num_queries(url), 5)
+        self._init_data(10, 20)
+        self.assertEqual(self._get_num_queries(url), 5)
+
+    def test_query_events_min_json(self):
+        url = '/api/2/events/?per_page=10'
+        self._init_data(2, 2)
+        self.assertEqual(self._get_num_queries(url), 4)
+        self._init_data(10, 20)
+        self.assertEqual(self._get_num_queries(url), 4)
+
+    def test_query_builds(self):
+        url = '/api/2/builds/?per_page=10'
+        self._init_data(1, 2)
+        self.assertEqual(self._get_num_queries(url), 3)
+        self._init_data(1, 20)
+        self.assertEqual(self._get_num_queries(url), 3)
+
+
 class TestManualTriggerRebuild(ViewBaseTest):
     def setUp(self):
         super(TestManualTriggerRebuild, self).setUp()